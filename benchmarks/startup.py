@@ -0,0 +1,51 @@
+"""
+Startup time of pythondb, measured in fresh interpreters.
+
+    python benchmarks/startup.py [--runs N] [--json]
+
+Every scenario is run N times as a new process from the repository root and the median and
+fastest wall clock times are reported.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "python": ["-c", "pass"],
+    "import": ["-c", "import src.mypythondb"],
+    "batch py": ["launcher.py", "-b", "-c", "py>1+1"],
+    "batch dk": ["launcher.py", "-b", "-c", "dk>SELECT 42"],
+    "batch pl": ["launcher.py", "-b", "-c", "pl>SELECT 42"],
+}
+
+
+def measure(args: list, runs: int) -> dict:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return {"median": statistics.median(times), "min": min(times)}
+
+
+@click.command()
+@click.option("--runs", "-n", default=10, help="Runs of each scenario", show_default=True)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print results as JSON")
+def main(runs: int, as_json: bool) -> None:
+    results = {name: measure(args, runs) for name, args in SCENARIOS.items()}
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, r in results.items():
+            print(f"{name:10} median {r['median'] * 1000:8.1f}ms  min {r['min'] * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
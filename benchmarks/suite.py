@@ -0,0 +1,337 @@
+"""
+Throughput and latency of every query path and front-end, on synthetic data of each size.
+
+    python benchmarks/suite.py [--sizes 1e3,1e5,1e6] [--only dk,mysql] [--runs N] [--output report.json]
+                               [--baseline benchmarks/baseline.json] [--save-baseline] [--tolerance 0.25]
+
+Every benchmark runs once to warm up, then N times, and its median and fastest wall clock times
+are reported. The report, with the machine and library versions it was measured on, is written as
+JSON and compared against the baseline if there is one. The exit status is 1 if any benchmark got
+slower than its baseline by more than the tolerance, so upgrades can be gated on it. Baselines
+are only comparable on the machine they were saved on.
+
+Groups:
+    dk, pl, py   queryraw of an aggregate and a filtering scan of the trades frame
+    to_pdf       conversions of results to polars
+    register     cost of a py> statement and of re-registering one frame against the number of frames held
+    mysql        concurrent clients against a local start_sql server, and fetching a large result
+    web          JSON, CSV and Arrow responses of a local start_web server
+"""
+import contextlib
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+import _thread as thread
+
+import click
+import numpy as np
+import polars as pl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.mypythondb.queryprocessor import QueryProcessor  # noqa: E402
+
+GROUPS = ("dk", "pl", "py", "to_pdf", "register", "mysql", "web")
+# Conversions from python lists and dicts are skipped above this many rows, they'd need too much memory
+PYOBJECT_ROWS = 10_000_000
+# Number of frames held by the session in the register benchmarks
+FRAME_COUNTS = (1, 10, 100, 1000)
+# Most rows sent by one MySQL or web response
+RESPONSE_ROWS = 1_000_000
+# Most rows of one JSON page, see QWebServ.max_rows
+JSON_ROWS = 100_000
+# Ignore changes against the baseline smaller than this many seconds, they're noise
+NOISE_FLOOR = 0.001
+
+
+def trades(n: int) -> pl.DataFrame:
+    """n rows of synthetic trades over 100 symbols, the same for every run."""
+    rng = np.random.default_rng(42)
+    syms = np.array(["SYM%02d" % i for i in range(100)])
+    return pl.DataFrame({
+        "time": pl.datetime_range(pl.datetime(2024, 1, 1), pl.datetime(2024, 1, 1) + pl.duration(milliseconds=n - 1),
+                                  "1ms", eager=True) if n else pl.Series([], dtype=pl.Datetime),
+        "sym": syms[rng.integers(0, len(syms), n)],
+        "px": rng.uniform(1, 1000, n),
+        "qty": rng.integers(1, 1000, n),
+    })
+
+
+def session(n: int) -> QueryProcessor:
+    qp = QueryProcessor()
+    qp.bind("trades", trades(n))
+    return qp
+
+
+def measure(fn, runs: int, **info) -> dict:
+    """Median and fastest seconds of runs calls of fn after one call to warm up, together with info."""
+    fn()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"median": statistics.median(times), "min": min(times), "runs": runs, **info}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port: int) -> None:
+    deadline = time.time() + 30
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def bench_lang(lang: str, sizes: list, runs: int) -> dict:
+    queries = {
+        "dk": {"aggregate": "dk>SELECT sym, sum(px * qty) AS notional, count(*) AS n FROM trades GROUP BY sym",
+               "scan": "dk>SELECT * FROM trades WHERE qty > 900"},
+        "pl": {"aggregate": "pl>SELECT sym, sum(px * qty) AS notional, count(*) AS n FROM trades GROUP BY sym",
+               "scan": "pl>SELECT * FROM trades WHERE qty > 900"},
+        "py": {"aggregate": "py>trades.group_by('sym').agg((pl.col('px') * pl.col('qty')).sum().alias('notional'), "
+                            "pl.len().alias('n'))",
+               "scan": "py>trades.filter(pl.col('qty') > 900)"},
+    }[lang]
+    results = {}
+    for n in sizes:
+        qp = session(n)
+        for name, sql in queries.items():
+            results["%s %s n=%d" % (lang, name, n)] = measure(lambda: qp.query(sql), runs, rows=n)
+    return results
+
+
+def bench_to_pdf(sizes: list, runs: int) -> dict:
+    results = {}
+    for n in sizes:
+        qp = session(n)
+        df = qp.mylocals["trades"]
+        cases = {
+            "pandas": (df.to_pandas(), None),
+            "relation": (None, lambda: qp.duckdb.sql("SELECT * FROM trades")),
+            "lazy result": (None, lambda: qp.queryraw("dk>SELECT * FROM trades")),
+        }
+        if n <= PYOBJECT_ROWS:
+            cases["list"] = (df["qty"].to_list(), None)
+            cases["dict"] = (df.to_dict(as_series=False), None)
+        for name, (obj, make) in cases.items():
+            if make is None:
+                fn = lambda obj=obj: QueryProcessor.to_pdf(obj)
+            else:
+                fn = lambda make=make: QueryProcessor.to_pdf(make())
+            results["to_pdf %s n=%d" % (name, n)] = measure(fn, runs, rows=n)
+    return results
+
+
+def bench_register(runs: int) -> dict:
+    results = {}
+    for count in FRAME_COUNTS:
+        qp = QueryProcessor()
+        frame = trades(1000)
+        for i in range(count):
+            qp.bind("f%d" % i, frame.clone())
+        results["register unchanged frames=%d" % count] = measure(lambda: qp.queryraw("py>x = 1"), runs, frames=count)
+        results["register one frame frames=%d" % count] = measure(
+            lambda: qp.queryraw("py>f0 = f0.clone()"), runs, frames=count)
+        results["register then query frames=%d" % count] = measure(
+            lambda: (qp.queryraw("py>f0 = f0.clone()"), qp.query("dk>SELECT count(*) FROM f0")), runs, frames=count)
+    return results
+
+
+def bench_mysql(sizes: list, runs: int, clients: int, queries: int) -> dict:
+    try:
+        import mysql.connector
+    except ImportError:
+        print("Skipping mysql, mysql-connector is not installed", file=sys.__stderr__)
+        return {}
+    from src.mypythondb.mysession import start_sql
+
+    results = {}
+    for n in sizes:
+        qp = session(n)
+        port = free_port()
+        thread.start_new_thread(start_sql, (qp, port, clients))
+        wait_for(port)
+        connections = [mysql.connector.connect(host="127.0.0.1", port=port, user="bench") for _ in range(clients)]
+        latencies = []
+
+        def client(con, sql):
+            cur = con.cursor()
+            for _ in range(queries):
+                t = time.perf_counter()
+                cur.execute(sql)
+                cur.fetchall()
+                latencies.append(time.perf_counter() - t)
+            cur.close()
+
+        for name, sql in {"point": "SELECT * FROM trades LIMIT 10",
+                          "aggregate": "SELECT sym, sum(px * qty) AS notional FROM trades GROUP BY sym"}.items():
+            def run():
+                threads = [threading.Thread(target=client, args=(c, sql)) for c in connections]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+
+            latencies.clear()
+            r = measure(run, runs, rows=n, clients=clients, queries=clients * queries)
+            ordered = sorted(latencies)
+            r["qps"] = clients * queries / r["median"]
+            r["p50_ms"] = ordered[len(ordered) // 2] * 1000
+            r["p99_ms"] = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1000
+            results["mysql %s clients=%d n=%d" % (name, clients, n)] = r
+
+        rows = min(n, RESPONSE_ROWS)
+
+        def fetch():
+            cur = connections[0].cursor()
+            cur.execute("SELECT * FROM trades LIMIT %d" % rows)
+            cur.fetchall()
+            cur.close()
+
+        r = measure(fetch, runs, rows=rows)
+        r["rows_per_s"] = rows / r["median"]
+        results["mysql fetch n=%d" % n] = r
+        for c in connections:
+            c.close()
+    return results
+
+
+def bench_web(sizes: list, runs: int) -> dict:
+    from src.mypythondb.qwebserv import QWebServ, start_web
+
+    results = {}
+    for n in sizes:
+        qp = session(n)
+        port = free_port()
+        thread.start_new_thread(start_web, (qp, port))
+        wait_for(port)
+        conn = http.client.HTTPConnection("localhost", port)
+        for fmt, accept, rows in (("json", "application/json", min(n, JSON_ROWS)),
+                                  ("csv", "text/csv", min(n, RESPONSE_ROWS)),
+                                  ("arrow", "application/vnd.apache.arrow.stream", min(n, RESPONSE_ROWS))):
+            body = json.dumps({"query": "SELECT * FROM trades LIMIT %d" % rows})
+            sizes_seen = []
+
+            def post():
+                conn.request("POST", "/", body, {"Content-Type": "application/json", "Accept": accept})
+                r = conn.getresponse()
+                sizes_seen.append(len(r.read()))
+                assert r.status == 200, r.status
+                # Any other format would be a fallback with different row limits
+                assert r.getheader("Content-Type") == QWebServ.extensions[fmt], r.getheader("Content-Type")
+
+            r = measure(post, runs, rows=rows)
+            r["bytes"] = sizes_seen[-1]
+            r["rows_per_s"] = rows / r["median"]
+            results["web %s n=%d" % (fmt, n)] = r
+        conn.close()
+    return results
+
+
+def meta(sizes: list) -> dict:
+    import duckdb
+    import pyarrow
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "duckdb": duckdb.__version__,
+        "polars": pl.__version__,
+        "pyarrow": pyarrow.__version__,
+        "sizes": sizes,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print each benchmark against its baseline, returning the names of those slower by more than tolerance."""
+    regressed = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            print(f"{name:48} {r['median'] * 1000:10.2f}ms  (new)")
+            continue
+        change = r["median"] / b["median"] - 1 if b["median"] else 0.0
+        slower = change > tolerance and r["median"] - b["median"] > NOISE_FLOOR
+        if slower:
+            regressed.append(name)
+        print(f"{name:48} {r['median'] * 1000:10.2f}ms  baseline {b['median'] * 1000:10.2f}ms  {change:+7.1%}"
+              + ("  REGRESSED" if slower else ""))
+    return regressed
+
+
+@click.command()
+@click.option("--sizes", default="1e3,1e4,1e5,1e6", show_default=True,
+              help="Comma separated row counts of the synthetic data, up to 1e8")
+@click.option("--only", default=",".join(GROUPS), show_default=True, help="Comma separated groups to run")
+@click.option("--runs", "-n", default=5, show_default=True, help="Runs of each benchmark")
+@click.option("--clients", default=8, show_default=True, help="Concurrent MySQL clients")
+@click.option("--queries", default=20, show_default=True, help="Queries each MySQL client runs per run")
+@click.option("--output", "-o", default=None, help="Write the report to this JSON file")
+@click.option("--baseline", default=os.path.join(ROOT, "benchmarks", "baseline.json"), show_default=True,
+              help="Report to compare against, if it exists")
+@click.option("--save-baseline", is_flag=True, default=False, help="Write the report as the new baseline")
+@click.option("--tolerance", default=0.25, show_default=True, help="Slowdown against the baseline that fails the run")
+def main(sizes: str, only: str, runs: int, clients: int, queries: int, output: str, baseline: str,
+         save_baseline: bool, tolerance: float) -> None:
+    row_counts = [int(float(s)) for s in sizes.split(",")]
+    groups = [g.strip() for g in only.split(",")]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise click.BadParameter("unknown groups " + ", ".join(sorted(unknown)), param_hint="--only")
+
+    results = {}
+    # The servers print and log every request they serve
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for g in groups:
+            if g in ("dk", "pl", "py"):
+                results.update(bench_lang(g, row_counts, runs))
+            elif g == "to_pdf":
+                results.update(bench_to_pdf(row_counts, runs))
+            elif g == "register":
+                results.update(bench_register(runs))
+            elif g == "mysql":
+                results.update(bench_mysql(row_counts, runs, clients, queries))
+            elif g == "web":
+                results.update(bench_web(row_counts, runs))
+    report = {"meta": meta(row_counts), "results": results}
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    regressed = []
+    if os.path.exists(baseline) and not save_baseline:
+        with open(baseline) as f:
+            regressed = compare(results, json.load(f)["results"], tolerance)
+    else:
+        for name, r in results.items():
+            print(f"{name:48} median {r['median'] * 1000:10.2f}ms  min {r['min'] * 1000:10.2f}ms")
+    if save_baseline:
+        with open(baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved baseline " + baseline)
+    if regressed:
+        print("%d benchmarks regressed by more than %.0f%%" % (len(regressed), tolerance * 100))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
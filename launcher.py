@@ -1,2 +1,14 @@
+import multiprocessing
+import typing
+
 from src.mypythondb.console import main
-main()
\ No newline at end of file
+
+if typing.TYPE_CHECKING:
+    # Never run, lets PyInstaller find the modules pythondb only imports when first used
+    import pandas, numpy, pyarrow, pyarrow.compute, pyarrow.parquet, xlsxwriter, kola, sqlglot, mysql_mimic
+    import src.mypythondb.qwebserv, src.mypythondb.mysession, src.mypythondb.replicas
+
+if __name__ == "__main__":
+    # Replica processes are spawned by re-running this executable
+    multiprocessing.freeze_support()
+    main()
@@ -6,7 +6,9 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # Imported lazily at runtime, see LAZY_MODULES in src/mypythondb/lazy.py
+    hiddenimports=['pandas', 'numpy', 'pyarrow', 'pyarrow.compute', 'pyarrow.parquet', 'xlsxwriter', 'kola', 'sqlglot', 'mysql_mimic',
+                   'src.mypythondb.qwebserv', 'src.mypythondb.mysession', 'src.mypythondb.replicas'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,133 @@
+"""The web editor's static files, loaded and compressed once and served from memory."""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import re
+import sys
+import typing
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzip only without it
+    brotli = None
+
+# Build output named by content hash, e.g. static/js/main.4a804e33.js, never changes under that name
+HASHED_PATTERN = re.compile(r"^static/.*\.[0-9a-f]{8,}\.(chunk\.)?(js|css|woff2?|ttf|eot|svg)$")
+# Formats that are already compressed
+COMPRESSED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "ico", "woff", "woff2", "zip", "gz", "br"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Asset:
+    """
+    One file with its compressed variants and validators.
+
+    Args:
+        body: content of the file
+        content_type: MIME type of the file
+        mtime: modification time of the file, for Last-Modified
+        cache_control: Cache-Control header the file is served with
+    """
+
+    def __init__(self, body: bytes, content_type: str, mtime: float, cache_control: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.last_modified = formatdate(int(mtime), usegmt=True)
+        self.mtime = int(mtime)
+        self.cache_control = cache_control
+        # encoding -> compressed body, only kept if smaller than body
+        self.encoded: typing.Dict[str, bytes] = {}
+
+    def add_encoding(self, encoding: str, data: bytes):
+        if len(data) < len(self.body) * 0.9:
+            self.encoded[encoding] = data
+
+    def not_modified(self, if_none_match: typing.Optional[str], if_modified_since: typing.Optional[str]) -> bool:
+        """Whether a conditional request with these headers can be answered with 304."""
+        if if_none_match is not None:
+            tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags
+        if if_modified_since is not None:
+            try:
+                return self.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def negotiate(self, accept_encoding: typing.Optional[str]) -> typing.Tuple[typing.Optional[str], bytes]:
+        """The encoding, None for identity, and body to send given an Accept-Encoding header."""
+        accepted = {}
+        for item in (accept_encoding or "").split(","):
+            enc, *params = [x.strip() for x in item.split(";")]
+            q = 1.0
+            for prm in params:
+                if prm.startswith("q="):
+                    try:
+                        q = float(prm[2:])
+                    except ValueError:
+                        q = 0.0
+            accepted[enc.lower()] = q
+        for enc in ("br", "gzip"):
+            if enc in self.encoded and accepted.get(enc, accepted.get("*", 0)) > 0:
+                return enc, self.encoded[enc]
+        return None, self.body
+
+
+class AssetTable:
+    """
+    Every file below one or more directories, read once and served from memory.
+
+    Text files get gzip, and brotli if the module is installed, variants up front. A ``.gz`` or
+    ``.br`` file next to a file is used as its variant instead of compressing at startup. Files with
+    a content hash in their name are served as immutable, everything else is revalidated against its
+    ETag on each load.
+
+    Args:
+        roots: directories to load, a relative path found in an earlier root wins
+        content_type: MIME type for a file name
+    """
+
+    def __init__(self, roots: typing.Iterable[str], content_type: typing.Callable[[str], str]):
+        self.assets: typing.Dict[str, Asset] = {}
+        for root in roots:
+            if os.path.isdir(root):
+                self._load(root, content_type)
+
+    def _load(self, root: str, content_type: typing.Callable[[str], str]):
+        for folder, _, files in os.walk(root):
+            for f in files:
+                full = os.path.join(folder, f)
+                rel = os.path.relpath(full, root).replace(os.sep, "/")
+                ext = rel.rsplit(".", 1)[-1].lower()
+                if rel in self.assets or ext in ("gz", "br"):
+                    continue
+                with open(full, "rb") as fh:
+                    body = fh.read()
+                cache_control = IMMUTABLE if HASHED_PATTERN.match(rel) else REVALIDATE
+                asset = Asset(body, content_type(rel), os.path.getmtime(full), cache_control)
+                if ext not in COMPRESSED_EXTENSIONS and len(body) > 256:
+                    for enc, suffix, compress in (("gzip", ".gz", lambda b: gzip.compress(b, 9, mtime=0)),
+                                                  ("br", ".br", brotli and (lambda b: brotli.compress(b, quality=9)))):
+                        if os.path.exists(full + suffix):
+                            with open(full + suffix, "rb") as fh:
+                                asset.add_encoding(enc, fh.read())
+                        elif compress:
+                            asset.add_encoding(enc, compress(body))
+                self.assets[rel] = asset
+
+    def get(self, path: str) -> typing.Optional[Asset]:
+        """The asset for a request path, relative to the roots, or None."""
+        return self.assets.get(path.lstrip("/"))
+
+
+def asset_roots(folder: str = "html") -> typing.List[str]:
+    """Directories static files are served from, the current directory first then the bundled copy."""
+    roots = [folder]
+    if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
+        roots.append(os.path.join(sys._MEIPASS, folder))
+    return roots
@@ -0,0 +1,145 @@
+"""MySQL view of the tables and dataframes a QueryProcessor can query."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+import duckdb
+import polars as pl
+
+if TYPE_CHECKING:
+    from mysql_mimic.schema import Column, InfoSchema
+    from .queryprocessor import QueryProcessor
+
+
+DUCKDB_TO_MYSQL = {
+    "BOOLEAN": "TINYINT(1)",
+    "TINYINT": "TINYINT",
+    "SMALLINT": "SMALLINT",
+    "INTEGER": "INT",
+    "BIGINT": "BIGINT",
+    "HUGEINT": "DECIMAL(38,0)",
+    "UTINYINT": "TINYINT UNSIGNED",
+    "USMALLINT": "SMALLINT UNSIGNED",
+    "UINTEGER": "INT UNSIGNED",
+    "UBIGINT": "BIGINT UNSIGNED",
+    "UHUGEINT": "DECIMAL(39,0)",
+    "FLOAT": "FLOAT",
+    "DOUBLE": "DOUBLE",
+    "VARCHAR": "TEXT",
+    "BLOB": "BLOB",
+    "BIT": "BIT",
+    "DATE": "DATE",
+    "TIME": "TIME",
+    "TIME WITH TIME ZONE": "TIME",
+    "TIMESTAMP": "DATETIME",
+    "TIMESTAMP_S": "DATETIME",
+    "TIMESTAMP_MS": "DATETIME",
+    "TIMESTAMP_NS": "DATETIME",
+    "TIMESTAMP WITH TIME ZONE": "TIMESTAMP",
+    "INTERVAL": "TIME",
+    "UUID": "CHAR(36)",
+    "JSON": "JSON",
+}
+
+POLARS_TO_MYSQL = {
+    pl.Boolean: "TINYINT(1)",
+    pl.Int8: "TINYINT",
+    pl.Int16: "SMALLINT",
+    pl.Int32: "INT",
+    pl.Int64: "BIGINT",
+    pl.UInt8: "TINYINT UNSIGNED",
+    pl.UInt16: "SMALLINT UNSIGNED",
+    pl.UInt32: "INT UNSIGNED",
+    pl.UInt64: "BIGINT UNSIGNED",
+    pl.Float32: "FLOAT",
+    pl.Float64: "DOUBLE",
+    pl.String: "TEXT",
+    pl.Binary: "BLOB",
+    pl.Date: "DATE",
+    pl.Time: "TIME",
+    pl.Duration: "TIME",
+}
+
+
+def duckdb_to_mysql_type(t: str) -> str:
+    """MySQL column type for a DuckDB type name as reported by information_schema.columns."""
+    if t.startswith("DECIMAL"):
+        return t
+    elif t.endswith("]") or t.startswith(("STRUCT", "MAP", "UNION")):
+        return "JSON"
+    return DUCKDB_TO_MYSQL.get(t, "TEXT")
+
+
+def polars_to_mysql_type(t: pl.DataType) -> str:
+    """MySQL column type for a polars dtype."""
+    if isinstance(t, pl.Decimal):
+        return f"DECIMAL({t.precision or 38},{t.scale})"
+    elif isinstance(t, pl.Datetime):
+        return "DATETIME" if t.time_zone is None else "TIMESTAMP"
+    elif isinstance(t, (pl.List, pl.Array, pl.Struct)):
+        return "JSON"
+    return POLARS_TO_MYSQL.get(t.base_type(), "TEXT")
+
+
+class Catalog:
+    """
+    Cached INFORMATION_SCHEMA for a QueryProcessor.
+
+    Built from DuckDB's information_schema.columns, with polars frames registered from python
+    described by their own dtypes. The result is reused until a frame is (re)registered or a DDL
+    statement runs, so clients introspecting metadata on every connect don't cost a query each.
+
+    Args:
+        query_processor: processor whose tables and frames are described
+    """
+
+    def __init__(self, query_processor: QueryProcessor):
+        self.query_processor = query_processor
+        self._version: Optional[tuple] = None
+        self._info_schema: Optional[InfoSchema] = None
+
+    def version(self) -> tuple:
+        """Changes whenever the cached catalog may be stale."""
+        return self.query_processor.frames.generation, self.query_processor.ddl_generation
+
+    def is_current(self) -> bool:
+        return self._info_schema is not None and self._version == self.version()
+
+    def info_schema(self, db: duckdb.DuckDBPyConnection = None) -> InfoSchema:
+        """
+        The cached INFORMATION_SCHEMA, rebuilt first if stale.
+
+        Args:
+            db: connection used to read DuckDB's information_schema if a rebuild is needed
+        """
+        from mysql_mimic.schema import InfoSchema, info_schema_tables
+
+        version = self.version()
+        if self._info_schema is None or self._version != version:
+            self._info_schema = InfoSchema(info_schema_tables(self.columns(db)))
+            self._version = version
+        return self._info_schema
+
+    def columns(self, db: duckdb.DuckDBPyConnection = None) -> list[Column]:
+        """Describe every column of every table, view and registered frame."""
+        from mysql_mimic.schema import Column
+
+        qp = self.query_processor
+        db = qp.cursor() if db is None else db
+        with qp.lock.read():
+            qp.frames.refresh(db)
+            polars_frames = {k: v for k, (v, _) in qp.frames.frames.items() if isinstance(v, pl.DataFrame)}
+            rows = db.execute(
+                "SELECT table_catalog, table_schema, table_name, column_name, data_type, is_nullable "
+                "FROM information_schema.columns ORDER BY table_schema, table_name, ordinal_position"
+            ).fetchall()
+        cols = []
+        for catalog, schema, table, column, data_type, is_nullable in rows:
+            if catalog == "temp" and table in polars_frames:
+                continue
+            cols.append(Column(name=column, type=duckdb_to_mysql_type(data_type), table=table,
+                               is_nullable=is_nullable == "YES", schema=schema))
+        for table, df in polars_frames.items():
+            for column, dtype in df.schema.items():
+                cols.append(Column(name=column, type=polars_to_mysql_type(dtype), table=table, schema="main"))
+        return cols
@@ -5,24 +5,12 @@ import click
 from click.core import ParameterSource
 import code
 
-import polars as pl
-import pandas as pd
-
 from datetime import date, datetime
 
-# TO allow pyinstaller to find imports
-import pyarrow as pa
-import xlsxwriter
-import numpy as np
-import kola
-
 import duckdb
 import _thread as thread
-from polars import DataFrame
 
 from src.mypythondb.queryprocessor import QueryProcessor
-from src.mypythondb.qwebserv import start_web
-from .mysession import Session, start_sql
 from . import __version__
 
 
@@ -41,47 +29,92 @@ BANNER = """
 @click.option("--command", "-c", help="Run COMMAND", metavar="COMMAND")
 @click.option("--port", "-P", help="Port for MySQL compatible server to listen on", metavar="SQLPORT", default=3306)
 @click.option("--webport", "-w", help="Port for webserver to listen on", metavar="WEBPORT", default=8080)
+@click.option("--sqlworkers", help="Number of MySQL queries that may execute at once", metavar="N", default=4)
+@click.option("--webworkers", help="Number of web queries that may execute at once", metavar="N", default=4)
+@click.option("--replicas", help="Serve MySQL from N read only worker processes", metavar="N", type=int, default=None)
+@click.option("--jobs", "-j", help="Number of files to load at once", metavar="N", type=int, default=None)
+@click.option("--materialize", help="Load data files into tables rather than views over the files", default=False, is_flag=True)
+@click.option("--lazy-polars", help="Run pl> queries lazily on polars' streaming engine", default=False, is_flag=True)
+@click.option("--restore", help="Restore the frames of a pythondb.snapshot(PATH) before loading files", metavar="PATH", default=None)
+@click.option("--max-execution-time", help="Interrupt queries running longer than SECONDS, 0 for no limit", metavar="SECONDS", type=float, default=0)
+@click.option("--memory-limit", help="Memory DuckDB may use for all queries together e.g. 4GB, beyond it queries spill or fail", metavar="SIZE", default=None)
+@click.option("--max-result-bytes", help="Fail queries whose result held in memory would exceed N bytes, 0 for no limit", metavar="N", type=int, default=0)
 @click.option("--quiet", "-q", help="Quiet, don't show banner", default=False, is_flag=True)
+@click.option("--batch", "-b", help="Run COMMAND and files then exit, without starting the servers or REPL", default=False, is_flag=True)
 @click.option("--verbose", "-v", help="Display debugging information", default=False, is_flag=True)
 @click.argument('filepaths', nargs=-1)
 @click.version_option(version=__version__)
-def main(filepaths: tuple[str], language: str, port: int, webport: int, command: str, quiet: bool, verbose: bool) -> None:
+def main(filepaths: tuple[str], language: str, port: int, webport: int, sqlworkers: int, webworkers: int, replicas: int, command: str, jobs: int, materialize: bool, lazy_polars: bool, restore: str, max_execution_time: float, memory_limit: str, max_result_bytes: int, quiet: bool, batch: bool, verbose: bool) -> None:
 
+    limits = dict(max_execution_time=max_execution_time, memory_limit=memory_limit, max_result_bytes=max_result_bytes)
     lang = language
     parameter_source = click.get_current_context().get_parameter_source('language')
     if parameter_source == ParameterSource.DEFAULT:
         lang = None
 
     """ PythonDB interactive SQL/python querying."""
+    if batch:
+        query_processor = start(filepaths, lang, quiet=True, verbose=verbose, serve=False, jobs=jobs, materialize=materialize, restore=restore, lazy_polars=lazy_polars, limits=limits)
+        if command is not None:
+            r = query_processor.queryraw(command)
+            if r is not None:
+                print(r)
+        return
     if not quiet:
         click.secho(BANNER, fg="blue")
         click.echo("PythonDB 0.2.5 https://github.com/ryanhamilton/pythondb")
         click.echo("web: http://localhost:" + str(webport) + "    MySQL port: " + str(port) + "    Version: " + str(port))
     # https://bernsteinbear.com/blog/simple-python-repl/
-    query_processor = start(filepaths, lang, port, webport, command, quiet, verbose)
+    query_processor = start(filepaths, lang, port, webport, command, quiet, verbose, sqlworkers, webworkers, jobs=jobs, materialize=materialize, restore=restore, replicas=replicas, lazy_polars=lazy_polars, limits=limits)
     repl = Repl(query_processor, verbose)
     repl.interact(banner="", exitmsg="")
 
 
-def start(filepaths: tuple[str] = (), language: str = "", port: int = 3306, webport: int = 8080, command: str = "", quiet: bool = False, verbose: bool = False) -> QueryProcessor:
+def start(filepaths: tuple[str] = (), language: str = "", port: int = 3306, webport: int = 8080, command: str = "", quiet: bool = False, verbose: bool = False, sqlworkers: int = 4, webworkers: int = 4, serve: bool = True, jobs: int = None, materialize: bool = False, restore: str = None, replicas: int = None, lazy_polars: bool = False, limits: dict = None) -> QueryProcessor:
     db = None
+    db_path = None
     lang = language
     source_files = []
-    print(filepaths)
+    if not quiet:
+        print(filepaths)
     for p in filepaths:
         if p.endswith(".duckdb") or p.endswith(".db"):
-            db = duckdb.connect(p)
+            # Replicas can only open the file while no process has it open for writing
+            db = duckdb.connect(p, read_only=bool(replicas and serve))
+            db_path = p
             if len(filepaths) == 1 and lang is None:
                 lang = "dk"
         else:
             source_files.append(p)
+    if replicas and serve and source_files:
+        # The workers only open the DuckDB file and snapshot, anything loaded here would be missing from them
+        raise click.UsageError("--replicas serves only a .duckdb file and --restore snapshot, not data files or scripts: "
+                               + " ".join(source_files))
     query_processor = QueryProcessor(verbose, db=db)
     if lang is not None and lang != "":
         query_processor.setlang(lang)
-    thread.start_new_thread(start_web, (query_processor, webport))
-    thread.start_new_thread(start_sql, (query_processor, port))
+    if lazy_polars:
+        query_processor.enable_lazy_polars()
+    if limits:
+        query_processor.limit_resources(**limits)
+    if serve:
+        # Imported here so runs without servers don't load the web and MySQL stacks
+        from .qwebserv import start_web
+        from .mysession import start_sql
+        thread.start_new_thread(start_web, (query_processor, webport, webworkers))
+        if replicas:
+            from .replicas import Supervisor
+            query_processor.replicas = Supervisor(port, replicas, db_path, restore, query_processor.getlang(), sqlworkers,
+                                                  limits=limits)
+            query_processor.replicas.start()
+        else:
+            thread.start_new_thread(start_sql, (query_processor, port, sqlworkers))
 
-    query_processor.load_files(source_files)
+    if restore is not None:
+        restored = query_processor.restore(restore)
+        if not quiet:
+            print("Restored " + ", ".join(restored) + " from " + restore)
+    query_processor.load_files(source_files, jobs, materialize, progress=not quiet)
 
     if command is not None:
         query_processor.queryraw(command)
@@ -0,0 +1,152 @@
+"""Conversion of py> results of any type to the polars DataFrames the servers send."""
+from __future__ import annotations
+
+import collections.abc
+import itertools
+from abc import ABCMeta
+from typing import Any, Callable, Dict, Optional, Union
+
+import duckdb
+import polars as pl
+
+from .lazy import imported
+from .result import LazyResult
+
+Converter = Callable[[Any], pl.DataFrame]
+
+# Scalars a list or iterator of is sent as one column of values
+SCALARS = (bool, int, float, complex, str, bytes, type(None))
+
+
+class Converters:
+    """
+    Type dispatched converters of results to polars DataFrames.
+
+    The converter of a type is that of its nearest class registered, then that of the first
+    abstract base class registered it is a subclass of, e.g. ``collections.abc.Iterator`` for
+    generators. Types of optional libraries are registered by ``"module.QualName"`` so checking
+    a result against them never imports the library. numpy and Arrow data are wrapped without
+    copying, LazyFrames are collected with the streaming engine and iterators are consumed
+    chunk_size items at a time, so only one chunk of python objects is held at once.
+    """
+
+    # Items of an iterator converted at a time
+    chunk_size = 100000
+
+    def __init__(self):
+        self.types: Dict[type, Converter] = {}
+        # "module.QualName" -> converter of types registered by name
+        self.names: Dict[str, Converter] = {}
+        # type -> converter found for it, cleared when registrations change
+        self._resolved: Dict[type, Optional[Converter]] = {}
+        self.register(pl.DataFrame, lambda df: df)
+        self.register(pl.Series, lambda s: s.to_frame())
+        self.register(pl.LazyFrame, lambda lf: lf.collect(streaming=True))
+        self.register(bool, lambda v: pl.DataFrame({"bool": [v]}))
+        self.register(int, lambda v: pl.DataFrame({"int": [v]}))
+        self.register(float, lambda v: pl.DataFrame({"float": [v]}))
+        self.register(complex, lambda v: pl.DataFrame({"complex": [v]}))
+        self.register(str, lambda v: pl.DataFrame({"str": [v]}))
+        self.register(tuple, lambda v: pl.DataFrame({"tuple": [v]}))
+        self.register(range, lambda v: pl.DataFrame({"range": [v]}))
+        self.register(set, lambda v: pl.DataFrame({"set": list(v)}))
+        self.register(dict, pl.from_dict)
+        self.register(type(None), lambda v: pl.DataFrame({"None": []}))
+        self.register(list, self.from_list)
+        self.register(duckdb.DuckDBPyRelation, lambda r: r.pl())
+        self.register(LazyResult, lambda r: r.pl())
+        self.register("pandas.core.frame.DataFrame", from_pandas)
+        self.register("pandas.core.series.Series", lambda s: from_pandas(s.to_frame()))
+        self.register("numpy.ndarray", from_numpy)
+        self.register("numpy.generic", lambda v: self.convert(v.item()))
+        self.register("pyarrow.lib.Table", lambda t: pl.from_arrow(t, rechunk=False))
+        self.register("pyarrow.lib.RecordBatch", pl.from_arrow)
+        self.register("pyarrow.lib.RecordBatchReader", lambda r: pl.from_arrow(r.read_all(), rechunk=False))
+        self.register("pyarrow.lib.Array", lambda a: pl.from_arrow(a).to_frame())
+        self.register("pyarrow.lib.ChunkedArray", lambda a: pl.from_arrow(a, rechunk=False).to_frame())
+        self.register(collections.abc.Iterator, self.from_iterator)
+
+    def register(self, cls: Union[type, str], converter: Converter) -> None:
+        """Convert results of type cls, a class or "module.QualName", and its subclasses with converter."""
+        if isinstance(cls, str):
+            self.names[cls] = converter
+        else:
+            self.types[cls] = converter
+        self._resolved.clear()
+
+    def lookup(self, cls: type) -> Optional[Converter]:
+        """The converter of cls, None if there is none."""
+        try:
+            return self._resolved[cls]
+        except KeyError:
+            pass
+        converter = None
+        for c in cls.__mro__[:-1]:
+            converter = self.types.get(c) or self.names.get(c.__module__ + "." + c.__qualname__)
+            if converter is not None:
+                break
+        else:
+            converter = next((f for t, f in self.types.items() if isinstance(t, ABCMeta) and issubclass(cls, t)), None)
+        self._resolved[cls] = converter
+        return converter
+
+    def convert(self, obj: Any) -> pl.DataFrame:
+        converter = self.lookup(type(obj))
+        if converter is None:
+            print(obj)
+            return pl.DataFrame({"unrecognised": type(obj)})
+        return converter(obj)
+
+    def from_list(self, items: list) -> pl.DataFrame:
+        """Rows of a list of dicts, the frames of a list of frames stacked, otherwise one column of the items."""
+        if items and all(isinstance(v, dict) for v in items):
+            return pl.from_dicts(items, infer_schema_length=None)
+        if items and not isinstance(items[0], SCALARS + (list, dict, set)) and self.lookup(type(items[0])) is not None:
+            return pl.concat([self.convert(v) for v in items], how="diagonal_relaxed")
+        return pl.DataFrame({"list": items})
+
+    def from_iterator(self, it: collections.abc.Iterator) -> pl.DataFrame:
+        """The items of it converted a chunk at a time, as a list of them would be."""
+        chunks = []
+        while chunk := list(itertools.islice(it, self.chunk_size)):
+            chunks.append(self.from_list(chunk))
+        if not chunks:
+            return pl.DataFrame({"list": []})
+        return pl.concat(chunks, how="diagonal_relaxed") if len(chunks) > 1 else chunks[0]
+
+
+def from_numpy(a) -> pl.DataFrame:
+    """A 1-d array as column "array", a 2-d array's columns or a structured array's fields, numeric data uncopied."""
+    if a.ndim == 0:
+        return CONVERTERS.convert(a.item())
+    if a.ndim == 1 and a.dtype.names is None:
+        return pl.Series("array", a).to_frame()
+    return pl.from_numpy(a)
+
+
+def from_pandas(df) -> pl.DataFrame:
+    """
+    df without its index, numeric numpy backed columns shared rather than copied.
+
+    A float column holding NaN is converted by polars, turning NaN into null as pl.from_pandas does.
+    """
+    numpy = imported("numpy")
+    if not df.columns.is_unique:
+        return pl.from_pandas(df)
+    columns = {}
+    rest = []
+    for name, s in df.items():
+        if isinstance(s.dtype, numpy.dtype) and s.dtype.kind in "biuf":
+            values = s.to_numpy()
+            if s.dtype.kind != "f" or not numpy.isnan(values).any():
+                columns[str(name)] = pl.Series(str(name), values)
+                continue
+        rest.append(name)
+    if rest:
+        converted = pl.from_pandas(df[rest])
+        columns.update(zip(converted.columns, converted.get_columns()))
+    return pl.DataFrame([columns[str(name)] for name in df.columns])
+
+
+# Used by QueryProcessor.to_pdf, see QueryProcessor.register_converter
+CONVERTERS = Converters()
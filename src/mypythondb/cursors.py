@@ -0,0 +1,116 @@
+"""Query results held server side so the web editor can page and sort through them without re-running the query."""
+from __future__ import annotations
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .governor import ResultTooLarge
+from .lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+pc = lazy_import("pyarrow.compute")
+
+
+class ResultCursor:
+    """
+    The complete result of a query, executed once, from which windows of rows are read.
+
+    Sorting computes the row order for a column once and reuses it for every window read in
+    that order, only the most recent order is kept.
+
+    Args:
+        cursor_id: id clients refer to the cursor by
+        query: the query the result is of
+        table: the result
+    """
+
+    def __init__(self, cursor_id: str, query: str, table: pa.Table):
+        self.cursor_id = cursor_id
+        self.query = query
+        self.table = table
+        self.expires = 0.0
+        # ((column, descending), row indices in that order) of the last sorted read
+        self._order: Optional[tuple[tuple[str, bool], pa.Array]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes + (self._order[1].nbytes if self._order is not None else 0)
+
+    def window(self, offset: int, limit: int, sort: Optional[str] = None, descending: bool = False) -> pa.Table:
+        """Rows offset to offset+limit, in the order of column sort if given, raises KeyError for unknown columns."""
+        offset = max(offset, 0)
+        limit = max(min(limit, self.num_rows - offset), 0)
+        if sort is None:
+            return self.table.slice(offset, limit)
+        if sort not in self.table.column_names:
+            raise KeyError(sort)
+        with self._lock:
+            if self._order is None or self._order[0] != (sort, descending):
+                indices = pc.sort_indices(self.table, sort_keys=[(sort, "descending" if descending else "ascending")],
+                                          null_placement="at_end")
+                self._order = ((sort, descending), indices)
+            indices = self._order[1]
+        return self.table.take(indices.slice(offset, limit))
+
+
+class CursorStore:
+    """
+    The open ResultCursors, each closed once unused for ttl seconds.
+
+    Cursors over max_bytes in total are closed least recently used first, a result that alone
+    exceeds max_bytes is refused.
+
+    Args:
+        max_bytes: total size of the results held
+        ttl: seconds a cursor stays open after its last use
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024, ttl: float = 600.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cursors: OrderedDict[str, ResultCursor] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, query: str, table: pa.Table) -> ResultCursor:
+        if table.nbytes > self.max_bytes:
+            raise ResultTooLarge("Result of %d bytes is too large to hold, at most %d bytes" % (table.nbytes, self.max_bytes))
+        cursor = ResultCursor(secrets.token_urlsafe(12), query, table)
+        with self._lock:
+            self._expire()
+            cursor.expires = time.monotonic() + self.ttl
+            self.cursors[cursor.cursor_id] = cursor
+            self._evict()
+        return cursor
+
+    def get(self, cursor_id: str) -> Optional[ResultCursor]:
+        """The cursor if still open, which then stays open another ttl seconds."""
+        with self._lock:
+            self._expire()
+            cursor = self.cursors.get(cursor_id)
+            if cursor is not None:
+                cursor.expires = time.monotonic() + self.ttl
+                self.cursors.move_to_end(cursor_id)
+            return cursor
+
+    def close(self, cursor_id: str) -> bool:
+        with self._lock:
+            return self.cursors.pop(cursor_id, None) is not None
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for k in [k for k, c in self.cursors.items() if c.expires < now]:
+            del self.cursors[k]
+
+    def _evict(self) -> None:
+        total = sum(c.nbytes for c in self.cursors.values())
+        while total > self.max_bytes and len(self.cursors) > 1:
+            _, cursor = self.cursors.popitem(last=False)
+            total -= cursor.nbytes
@@ -0,0 +1,159 @@
+"""Runs blocking QueryProcessor work off the asyncio loop serving MySQL."""
+from __future__ import annotations
+
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+import duckdb
+from mysql_mimic.errors import MysqlError
+
+from .queryprocessor import QueryProcessor
+
+T = TypeVar("T")
+
+
+class QueryExecutor:
+    """
+    Thread pool that executes queries with one DuckDB cursor per worker.
+
+    At most ``workers`` queries execute at once, up to ``queue_size`` further queries wait for a
+    free worker, for at most the governor's queue_timeout, and anything beyond that is rejected
+    straight away. Each query leases a cursor
+    created from ``query_processor.duckdb.cursor()`` for as long as it runs, so one slow scan
+    only occupies one worker while the loop keeps serving every other connection.
+
+    Args:
+        query_processor: processor whose database the cursors are opened on
+        workers: number of queries that may execute concurrently
+        queue_size: number of queries allowed to wait for a free worker, by default the governor's
+    """
+
+    def __init__(self, query_processor: QueryProcessor, workers: int = 4, queue_size: Optional[int] = None):
+        self.query_processor = query_processor
+        self.workers = workers
+        self.queue_size = query_processor.governor.queue_size if queue_size is None else queue_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pythondb-sql")
+        self.cursors: queue.SimpleQueue[duckdb.DuckDBPyConnection] = queue.SimpleQueue()
+        for _ in range(workers):
+            cur = query_processor.duckdb.cursor()
+            query_processor.frames.attach(cur)
+            self.cursors.put(cur)
+        # key -> cursor of the query currently running for that key
+        self.running: Dict[Hashable, duckdb.DuckDBPyConnection] = {}
+        self.pending = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._shutdown = False
+
+    async def lease(self, key: Hashable) -> CursorLease:
+        """
+        Wait for a free worker and lease its cursor.
+
+        The caller must ``release()`` the lease, results read lazily from the cursor (e.g. a
+        streaming Arrow reader) stay valid until then.
+
+        Args:
+            key: identifies the caller, usually the MySQL connection id, for ``cancel``
+        """
+        if self._shutdown:
+            raise RuntimeError("QueryExecutor is shut down")
+        if self.pending >= self.workers + self.queue_size:
+            raise MysqlError(f"Server busy: {self.pending} queries already running or queued")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        self.pending += 1
+        timeout = self.query_processor.governor.queue_timeout or None
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.pending -= 1
+            raise MysqlError(f"Server busy: no worker became free within {timeout:g}s")
+        except BaseException:
+            self.pending -= 1
+            raise
+
+        lease = CursorLease(self, key, self.cursors.get_nowait())
+        self.running[key] = lease.cursor
+        return lease
+
+    async def run(self, key: Hashable, fn: Callable[[duckdb.DuckDBPyConnection], T]) -> T:
+        """
+        Run fn(cursor) on a worker thread.
+
+        Args:
+            key: identifies the caller, usually the MySQL connection id, for ``cancel``
+            fn: blocking function to call with the leased cursor
+        Returns:
+            The value returned by fn.
+        """
+        lease = await self.lease(key)
+        try:
+            return await lease.call(partial(fn, lease.cursor))
+        finally:
+            lease.release()
+
+    def _free(self, lease: CursorLease) -> None:
+        if self.running.get(lease.key) is lease.cursor:
+            del self.running[lease.key]
+        self.cursors.put(lease.cursor)
+        self.pending -= 1
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        """Stop the worker threads once their calls finished and close the free cursors."""
+        self._shutdown = True
+        self.pool.shutdown(wait=False)
+        while True:
+            try:
+                cur = self.cursors.get_nowait()
+            except queue.Empty:
+                break
+            self.query_processor.frames.detach(cur)
+            cur.close()
+
+    def cancel(self, key: Hashable) -> bool:
+        """Interrupt the query running for key, returns False if there is none."""
+        cur = self.running.get(key)
+        if cur is None:
+            return False
+        cur.interrupt()
+        return True
+
+
+class CursorLease:
+    """A worker's cursor held by one caller until ``release``."""
+
+    def __init__(self, executor: QueryExecutor, key: Hashable, cursor: duckdb.DuckDBPyConnection):
+        self.executor = executor
+        self.key = key
+        self.cursor = cursor
+        self._busy: Optional[asyncio.Future] = None
+        self._released = False
+
+    async def call(self, fn: Callable[[], T]) -> T:
+        """Run fn() on a worker thread, interrupting the cursor if the caller is cancelled."""
+        self._busy = asyncio.get_running_loop().run_in_executor(self.executor.pool, fn)
+        try:
+            return await asyncio.shield(self._busy)
+        except asyncio.CancelledError:
+            self.cursor.interrupt()
+            raise
+
+    def release(self) -> None:
+        """Give the cursor back, deferred until any call still running on it has finished."""
+        if self._released:
+            return
+        self._released = True
+        busy = self._busy
+        if busy is None or busy.done():
+            self._done(busy)
+        else:
+            busy.add_done_callback(self._done)
+
+    def _done(self, busy: Optional[asyncio.Future]) -> None:
+        if busy is not None and not busy.cancelled():
+            busy.exception()  # mark retrieved, the caller may have stopped waiting
+        self.executor._free(self)
@@ -0,0 +1,140 @@
+"""Tracks the dataframes held in python variables and exposes them to DuckDB and polars SQL."""
+import weakref
+from typing import Any, Collection, Optional
+
+import duckdb
+import polars as pl
+
+from .lazy import imported
+
+
+class FrameRegistry:
+    """
+    Keeps DuckDB connections and a polars SQLContext in sync with the dataframes in a namespace.
+
+    Each registered variable is remembered together with the object it was bound to and a cheap
+    version stamp (shape and column names). ``sync`` only registers, re-registers or unregisters
+    the names whose binding actually changed, so the cost of a ``py>`` statement no longer grows
+    with the number of frames held in the session. The stamp can't see values edited in place,
+    e.g. ``df[0, "a"] = 1``, so the names a statement touched are passed to ``sync`` and always
+    re-registered.
+
+    DuckDB registrations are local to a connection and a connection must not be used by two
+    threads at once, so ``sync`` only updates the shared tables. Each connection catches up in
+    ``refresh``, called by the thread about to query on it. Polars frames are converted to Arrow
+    once in ``sync``, DuckDB would otherwise convert them on every connection, and the conversion
+    can't run while another thread reads the same frame.
+
+    Args:
+        db: DuckDB connection frames are registered on
+        ctx: polars SQLContext polars frames are registered on
+    """
+
+    def __init__(self, db: duckdb.DuckDBPyConnection, ctx: pl.SQLContext):
+        self.ctx = ctx
+        # name -> (frame, version) of everything currently registered
+        self.frames: dict[str, tuple[Any, tuple]] = {}
+        # name -> Arrow table of each registered polars frame
+        self.arrow: dict[str, Any] = {}
+        # name -> LazyFrame registered on ctx by register_lazy, hidden by a polars frame of the same name
+        self.lazy: dict[str, pl.LazyFrame] = {}
+        # Incremented whenever any registration changes
+        self.generation = 0
+        # connection -> [generation it was last refreshed at, {name: frames entry registered on it}]
+        self._applied: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.attach(db)
+
+    @staticmethod
+    def version(v: Any) -> Optional[tuple]:
+        """Version stamp of a registrable frame or None if v is not a dataframe."""
+        if isinstance(v, pl.DataFrame):
+            return v.shape, tuple(v.columns)
+        pandas = imported("pandas")
+        if pandas is not None and isinstance(v, pandas.DataFrame):
+            return v.shape, tuple(v.columns)
+        return None
+
+    def attach(self, con: duckdb.DuckDBPyConnection) -> None:
+        """Register every current frame on con, which must not be in use by another thread."""
+        self._applied[con] = [-1, {}]
+        self.refresh(con)
+
+    def detach(self, con: duckdb.DuckDBPyConnection) -> None:
+        """Stop tracking what is registered on con."""
+        self._applied.pop(con, None)
+
+    def refresh(self, con: duckdb.DuckDBPyConnection) -> None:
+        """Bring the frames registered on con up to date, from the thread using con."""
+        state = self._applied.get(con)
+        if state is None:
+            state = self._applied[con] = [-1, {}]
+        if state[0] == self.generation:
+            return
+        generation = self.generation
+        registered = state[1]
+        frames = dict(self.frames)
+        for k, entry in frames.items():
+            if registered.get(k) is not entry:
+                con.register(k, self.arrow.get(k, entry[0]))
+                registered[k] = entry
+        for k in [k for k in registered if k not in frames]:
+            con.unregister(k)
+            del registered[k]
+        state[0] = generation
+
+    def sync(self, namespace: dict, touched: Collection[str] = (), tables: Optional[dict] = None) -> set[str]:
+        """
+        Bring the registrations in line with namespace.
+
+        Args:
+            namespace: variables to register the dataframes of
+            touched: names whose frames are re-registered even if their stamp is unchanged
+            tables: name -> Arrow table holding the same data as the polars frame bound to name,
+                registered on DuckDB instead of converting the frame, e.g. a memory mapped snapshot
+        Returns:
+            The names that were registered, re-registered or unregistered.
+        """
+        changed = set()
+        seen = set()
+        for k, v in namespace.items():
+            ver = self.version(v)
+            if ver is None:
+                continue
+            seen.add(k)
+            existing = self.frames.get(k)
+            if existing is None or existing[0] is not v or existing[1] != ver or k in touched:
+                self._register(k, v, ver, tables.get(k) if tables else None)
+                changed.add(k)
+        for k in [k for k in self.frames if k not in seen]:
+            self._unregister(k)
+            changed.add(k)
+        if changed:
+            self.generation += 1
+        return changed
+
+    def register_lazy(self, name: str, lf: pl.LazyFrame) -> None:
+        """Register lf on ctx as name, for as long as no polars frame is bound to name."""
+        self.lazy[name] = lf
+        if name not in self.arrow:
+            self.ctx.register(name, lf)
+
+    def _register(self, name: str, v: Any, ver: tuple, table: Any = None) -> None:
+        if isinstance(v, pl.DataFrame):
+            self.ctx.register(name, v)
+            self.arrow[name] = v.to_arrow() if table is None else table
+        elif name in self.frames and isinstance(self.frames[name][0], pl.DataFrame):
+            self._unregister_ctx(name)
+        self.frames[name] = (v, ver)
+
+    def _unregister(self, name: str) -> None:
+        v, _ = self.frames.pop(name)
+        if isinstance(v, pl.DataFrame):
+            self._unregister_ctx(name)
+
+    def _unregister_ctx(self, name: str) -> None:
+        # A lazy registration the frame hid becomes visible again
+        del self.arrow[name]
+        if name in self.lazy:
+            self.ctx.register(name, self.lazy[name])
+        else:
+            self.ctx.unregister(name)
@@ -0,0 +1,142 @@
+"""Limits on how long queries run, how much memory they take and how many are admitted at once."""
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+import duckdb
+
+
+class QueryTimeout(TimeoutError):
+    """A query was interrupted for running longer than its maximum execution time."""
+
+    def __init__(self, seconds: float):
+        super().__init__("Query execution was interrupted, maximum statement execution time of %gs exceeded" % seconds)
+        self.seconds = seconds
+
+
+class ResultTooLarge(ValueError):
+    """A result would take more memory than a query may hold."""
+
+
+class ServerBusy(Exception):
+    """Every worker is busy and no more queries may wait for one."""
+
+
+class Deadline:
+    """A callback due at a point in time, unless cancelled before."""
+
+    def __init__(self, seconds: float, callback: Callable[[], None]):
+        self.seconds = seconds
+        self.due = time.monotonic() + seconds
+        self.callback = callback
+        self.fired = False
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Watchdog:
+    """One thread calling the callbacks of every armed Deadline when due."""
+
+    def __init__(self):
+        # Min heap of (due, sequence number, deadline)
+        self._heap: List[tuple[float, int, Deadline]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def arm(self, seconds: float, callback: Callable[[], None]) -> Deadline:
+        """Call callback in seconds unless the returned Deadline is cancelled first."""
+        d = Deadline(seconds, callback)
+        with self._cond:
+            heapq.heappush(self._heap, (d.due, next(self._seq), d))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pythondb-watchdog", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return d
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                d = heapq.heappop(self._heap)[2]
+                if d.cancelled:
+                    continue
+                d.fired = True
+            try:
+                d.callback()
+            except Exception as e:
+                print(e)
+
+
+class ResourceGovernor:
+    """
+    The execution time, memory and admission limits of a QueryProcessor.
+
+    A query running longer than its maximum execution time has its DuckDB cursor interrupted and
+    fails with QueryTimeout, only DuckDB execution can be interrupted, py> and eager pl> code runs
+    to completion. DuckDB's memory_limit caps the memory of all connections together, beyond it
+    DuckDB spills to disk where it can and otherwise fails the query with an out of memory error
+    rather than the process being killed. Results materialized in memory, e.g. by query() or a web
+    page, are read in batches and abandoned with ResultTooLarge once over max_result_bytes.
+    The MySQL and web servers admit queue_size queries beyond their workers, waiting at most
+    queue_timeout seconds for one, and reject any other with ServerBusy.
+
+    Args:
+        max_execution_time: seconds a query may run, 0 for no limit, MySQL sessions may SET max_execution_time
+        memory_limit: DuckDB memory_limit e.g. "4GB", None keeps DuckDB's default of 80% of RAM
+        max_result_bytes: most bytes of result one query may materialize, 0 for no limit
+        queue_size: queries allowed to wait for a free worker of each server
+        queue_timeout: seconds a query may wait for a free worker, 0 to wait indefinitely
+    """
+
+    def __init__(self, max_execution_time: float = 0, memory_limit: Optional[str] = None,
+                 max_result_bytes: int = 0, queue_size: int = 64, queue_timeout: float = 30.0):
+        self.max_execution_time = max_execution_time
+        self.memory_limit = memory_limit
+        self.max_result_bytes = max_result_bytes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.watchdog = Watchdog()
+
+    def apply(self, con: duckdb.DuckDBPyConnection) -> None:
+        """Set DuckDB's memory_limit, shared by every connection to the database of con."""
+        if self.memory_limit is not None:
+            con.execute("SET memory_limit = '" + str(self.memory_limit).replace("'", "''") + "'")
+
+    def arm(self, cursor: duckdb.DuckDBPyConnection, seconds: Optional[float] = None) -> Optional[Deadline]:
+        """Interrupt cursor in seconds, by default max_execution_time, None if there is no limit."""
+        seconds = self.max_execution_time if seconds is None else seconds
+        if not seconds:
+            return None
+        return self.watchdog.arm(seconds, cursor.interrupt)
+
+    @contextmanager
+    def deadline(self, cursor: duckdb.DuckDBPyConnection, seconds: Optional[float] = None) -> Iterator[None]:
+        """Interrupt what the with block runs on cursor once it took too long, raising QueryTimeout."""
+        d = self.arm(cursor, seconds)
+        try:
+            yield
+        except Exception as e:
+            # DuckDB raises InterruptException, Arrow readers streaming its result an OSError
+            if d is not None and d.fired:
+                raise QueryTimeout(d.seconds) from e
+            raise
+        finally:
+            if d is not None:
+                d.cancel()
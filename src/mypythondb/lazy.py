@@ -0,0 +1,51 @@
+"""Deferred imports of heavy optional modules, so starting pythondb only pays for what a session uses."""
+import importlib
+import sys
+import types
+from typing import Optional
+
+# Imported on first use only, launcher.py and launcher.spec declare them so PyInstaller still bundles them
+LAZY_MODULES = ("pandas", "numpy", "pyarrow", "pyarrow.compute", "pyarrow.parquet", "xlsxwriter", "kola", "sqlglot", "mysql_mimic")
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until an attribute of it is first read, which imports the real module.
+
+    Used for the modules offered to py> code by name (pd, np, pa, ...), so a session that never
+    touches pandas never imports it.
+
+    Args:
+        name: fully qualified name of the module
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not yet copied over from the real module
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return "<lazy module '" + self.__name__ + "'>"
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """The module if already imported, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def imported(name: str) -> Optional[types.ModuleType]:
+    """
+    The module if something has imported it, otherwise None.
+
+    No object can be an instance of a class from a module that was never imported, so
+    ``isinstance`` checks against optional modules go through this rather than importing them.
+    A module another thread is still importing counts as not imported yet.
+    """
+    module = sys.modules.get(name)
+    if module is None or getattr(getattr(module, "__spec__", None), "_initializing", False):
+        return None
+    return module
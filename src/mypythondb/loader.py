@@ -0,0 +1,265 @@
+"""Loads data files and scripts into a QueryProcessor, independent ones concurrently."""
+from __future__ import annotations
+
+import glob
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+import duckdb
+import polars as pl
+
+from .lazy import lazy_import
+
+if TYPE_CHECKING:
+    from .queryprocessor import QueryProcessor
+
+pa = lazy_import("pyarrow")
+
+# File extension -> DuckDB table function scanning it, and its extra arguments
+SCANNERS = {
+    "parquet": ("read_parquet", ""),
+    "csv": ("read_csv", ""),
+    "tsv": ("read_csv", ", delim='\\t'"),
+    "json": ("read_json", ""),
+    "ndjson": ("read_json", ", format='newline_delimited'"),
+    "jsonl": ("read_json", ", format='newline_delimited'"),
+}
+# Arrow IPC files, memory mapped and registered as frames as DuckDB has no reader for them
+ARROW_EXTENSIONS = ("arrow", "feather", "ipc")
+# First line of a script that may run concurrently with the sources around it
+PARALLEL_MARKER = re.compile(r"^\s*(--|#)\s*pythondb:\s*parallel\b", re.IGNORECASE)
+
+SCAN = "scan"
+ARROW = "arrow"
+DELTA = "delta"
+SCRIPT = "script"
+
+
+def extension(path: str) -> str:
+    return path.rsplit(".", 1)[-1].lower() if "." in os.path.basename(path) else ""
+
+
+def has_prefix(text: str) -> bool:
+    """Whether text names its own language, as queryraw reads it, e.g. pl>, py>, q) or pythondb."""
+    s = text.lstrip()
+    return s.startswith(("pythondb.", "pdb.", "q)")) or (len(s) >= 3 and s[2] == ">")
+
+
+def literal(s: str) -> str:
+    return "'" + s.replace("'", "''") + "'"
+
+
+class Source:
+    """
+    One file, glob or directory to load.
+
+    Data is registered under a name derived from the file name, ``name=path`` chooses it instead.
+    A directory is read as a Delta table if it has a ``_delta_log``, otherwise as the (hive
+    partitioned) parquet files below it. Scripts only run concurrently with other sources if their
+    first line is ``-- pythondb: parallel`` or ``# pythondb: parallel``.
+
+    Args:
+        arg: the path, glob or name=path
+    """
+
+    def __init__(self, arg: str):
+        name, sep, path = arg.partition("=")
+        if not sep or not name.isidentifier() or os.path.exists(arg) or glob.glob(arg):
+            name, path = None, arg
+        self.path = path
+        if os.path.isdir(path):
+            self.kind = DELTA if os.path.isdir(os.path.join(path, "_delta_log")) else SCAN
+        elif extension(path) in ARROW_EXTENSIONS:
+            self.kind = ARROW
+        elif extension(path) in SCANNERS:
+            self.kind = SCAN
+        else:
+            self.kind = SCRIPT
+        self.name = name or self.default_name(path)
+        self.text = Path(path).read_text() if self.kind == SCRIPT else None
+        self.parallel = self.kind != SCRIPT or bool(PARALLEL_MARKER.match(self.text))
+
+    @staticmethod
+    def default_name(path: str) -> str:
+        """The file name without extension or wildcards, else the directory's name, as an identifier."""
+        base = os.path.basename(path.rstrip("/\\"))
+        stem = re.sub(r"[*?\[\]]", "", base.rsplit(".", 1)[0] if "." in base else base).strip("_-. ")
+        if not stem:
+            stem = os.path.basename(os.path.dirname(path.rstrip("/\\"))) or "data"
+        stem = re.sub(r"\W+", "_", stem)
+        return "_" + stem if stem[0].isdigit() else stem
+
+    def scan_sql(self) -> str:
+        """The DuckDB table function call reading the source."""
+        if self.kind == DELTA:
+            return "delta_scan(" + literal(self.path) + ")"
+        if os.path.isdir(self.path):
+            return "read_parquet(" + literal(os.path.join(self.path, "**", "*.parquet")) + ", hive_partitioning=true)"
+        fn, args = SCANNERS[extension(self.path)]
+        return fn + "(" + literal(self.path) + args + ")"
+
+    def polars_scan(self) -> Optional[pl.LazyFrame]:
+        """A lazy polars scan of the source, None if polars can only read it eagerly."""
+        if self.kind == DELTA:
+            return pl.scan_delta(self.path)
+        if os.path.isdir(self.path):
+            return pl.scan_parquet(os.path.join(self.path, "**", "*.parquet"), hive_partitioning=True)
+        ext = extension(self.path)
+        if ext == "parquet":
+            return pl.scan_parquet(self.path)
+        if ext in ("csv", "tsv"):
+            return pl.scan_csv(self.path, separator="\t" if ext == "tsv" else ",")
+        if ext in ("ndjson", "jsonl"):
+            return pl.scan_ndjson(self.path)
+        return None
+
+    def __str__(self) -> str:
+        return self.path
+
+
+def read_arrow(path: str) -> pa.Table:
+    """Every Arrow IPC file matching path, memory mapped so the data is paged in as it is read."""
+    tables = []
+    for f in sorted(glob.glob(path)) or [path]:
+        source = pa.memory_map(f)
+        try:
+            tables.append(pa.ipc.open_file(source).read_all())
+        except pa.ArrowInvalid:
+            source.seek(0)
+            tables.append(pa.ipc.open_stream(source).read_all())
+    return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+
+def print_progress(done: int, total: int, source: Source, seconds: float, error: Optional[BaseException]) -> None:
+    if error is not None:
+        outcome = "failed: " + str(error)
+    else:
+        outcome = "ran" if source.kind == SCRIPT else "loaded as " + source.name
+    print("[%d/%d] %s %s in %.2fs" % (done, total, source, outcome, seconds))
+
+
+class Loader:
+    """
+    Loads sources into a QueryProcessor on a pool of threads, each querying on its own cursor.
+
+    Consecutive data files and parallel scripts load concurrently. Any other script waits for
+    everything before it and runs on the calling thread before anything after it starts.
+
+    Args:
+        query_processor: processor to load into
+        jobs: most sources loading at once, by default ThreadPoolExecutor's default
+        materialize: load data files into tables rather than views over the files
+        progress: called with (done, total, source, seconds, error) as each source finishes
+    """
+
+    def __init__(self, query_processor: QueryProcessor, jobs: Optional[int] = None, materialize: bool = False,
+                 progress: Optional[Callable[[int, int, Source, float, Optional[BaseException]], None]] = None):
+        self.qp = query_processor
+        self.jobs = jobs
+        self.materialize = materialize
+        self.progress = progress
+        self._local = threading.local()
+        self._cursors: List[duckdb.DuckDBPyConnection] = []
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        cur = getattr(self._local, "cursor", None)
+        if cur is None:
+            cur = self._local.cursor = self.qp.duckdb.cursor()
+            self.qp.frames.attach(cur)
+            self._cursors.append(cur)
+        return cur
+
+    def load(self, args: List[str]) -> None:
+        """Load every source in args, raising the first error once the sources loading with it finished."""
+        sources = [Source(a) for a in args]
+        groups: List[List[Source]] = []
+        for s in sources:
+            if s.parallel and groups and groups[-1][0].parallel:
+                groups[-1].append(s)
+            else:
+                groups.append([s])
+        # Language each script runs in, as if the language was switched per file
+        original_lang = lang = self.qp.getlang()
+        langs = {}
+        for s in sources:
+            if s.kind == SCRIPT:
+                p = s.path.lower()
+                if p.endswith(".sql") and original_lang == "py":
+                    lang = "dk"
+                elif p.endswith(".py"):
+                    lang = "py"
+                langs[s] = lang
+
+        done = 0
+        try:
+            with ThreadPoolExecutor(self.jobs, thread_name_prefix="pythondb-load") as pool:
+                for group in groups:
+                    if not group[0].parallel:
+                        t = time.perf_counter()
+                        error = None
+                        try:
+                            self._run(group[0], langs.get(group[0]), None)
+                        except BaseException as e:
+                            error = e
+                        done += 1
+                        self._report(done, len(sources), group[0], time.perf_counter() - t, error)
+                        if error is not None:
+                            raise error
+                        continue
+                    starts = {}
+                    futures = {}
+                    for s in group:
+                        starts[s] = time.perf_counter()
+                        futures[pool.submit(self._run, s, langs.get(s), self._cursor)] = s
+                    first_error = None
+                    for f in as_completed(futures):
+                        s = futures[f]
+                        error = f.exception()
+                        first_error = first_error or error
+                        done += 1
+                        self._report(done, len(sources), s, time.perf_counter() - starts[s], error)
+                    if first_error is not None:
+                        raise first_error
+        finally:
+            for cur in self._cursors:
+                self.qp.frames.detach(cur)
+                cur.close()
+            self._cursors.clear()
+        if lang != original_lang:
+            self.qp.setlang(lang)
+
+    def _report(self, done: int, total: int, source: Source, seconds: float, error: Optional[BaseException]) -> None:
+        if self.progress is not None:
+            self.progress(done, total, source, seconds, error)
+
+    def _run(self, source: Source, lang: Optional[str], cursor: Optional[Callable[[], duckdb.DuckDBPyConnection]]):
+        db = cursor() if cursor is not None else None
+        if self.qp.verbose:
+            print("Loading file: " + source.path)
+        if source.kind == SCRIPT:
+            text = source.text
+            if not has_prefix(text):
+                text = ("q)" if lang == "q" else lang + ">") + text
+            self.qp.queryraw(text, db)
+        elif source.kind == ARROW:
+            self.qp.bind(source.name, pl.from_arrow(read_arrow(source.path)))
+        else:
+            what = "TABLE" if self.materialize else "VIEW"
+            name = '"' + source.name.replace('"', '""') + '"'
+            cur = db or self.qp.cursor()
+            # CREATE OR REPLACE only replaces an object of the same kind
+            existing = cur.execute("SELECT 'VIEW' FROM duckdb_views() WHERE view_name = $1 AND NOT internal "
+                                   "UNION ALL SELECT 'TABLE' FROM duckdb_tables() WHERE table_name = $1",
+                                   [source.name]).fetchall()
+            sql = "CREATE OR REPLACE " + what + " " + name + " AS SELECT * FROM " + source.scan_sql()
+            if existing and existing[0][0] != what:
+                sql = "DROP " + existing[0][0] + " " + name + "; " + sql
+            self.qp.queryraw("dk>" + sql, db)
+            lf = source.polars_scan()
+            if lf is not None:
+                self.qp.register_lazy(source.name, lf)
@@ -1,18 +1,22 @@
 from __future__ import annotations
 
 import asyncio
+import re
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
 from dataclasses import dataclass
-from datetime import datetime, timezone as timezone_
+from datetime import datetime, time as time_, timedelta, timezone as timezone_
 from functools import partial
 from typing import (
     Dict,
     List,
-    TYPE_CHECKING,
     Optional,
     Callable,
     Awaitable,
     Type,
     Any,
+    Sequence,
 )
 
 from sqlglot import Dialect
@@ -43,18 +47,27 @@ from mysql_mimic.variables import (
     DEFAULT,
     parse_timezone,
 )
-from mysql_mimic.results import AllowedResult
+from mysql_mimic.results import AllowedResult, ResultColumn, ResultSet, _binary_encode_timedelta
+from mysql_mimic.types import ColumnType
 
 from mysql_mimic import MysqlServer
 from src.mypythondb.queryprocessor import QueryProcessor
+from .executor import QueryExecutor, CursorLease
+from .governor import Deadline, QueryTimeout
+from .prepared import NativeStatement, PreparedConnection
+from .profiler import QueryProfile
+import duckdb
 import polars as pl
+import pyarrow as pa
 
-if TYPE_CHECKING:
-    from mysql_mimic.connection import Connection
+from mysql_mimic.connection import Connection
 
 
 Middleware = Callable[["Query"], Awaitable[AllowedResult]]
 
+# ER_QUERY_TIMEOUT, which mysql_mimic's ErrorCode lacks
+QUERY_TIMEOUT = 3024
+
 
 @dataclass
 class Query:
@@ -102,6 +115,56 @@ class Query:
         return await self._middlewares[0](self)
 
 
+class StatementCache:
+    """
+    LRU cache of parsed statements keyed on the SQL text sent by the client.
+
+    Each entry holds the parsed expressions of a statement together with how it is routed,
+    so dashboards repeating identical queries skip sqlglot parsing entirely. Cached expressions
+    are shared and must never be mutated, callers hand copies to middlewares that transform them.
+
+    Args:
+        maxsize: maximum number of SQL texts kept
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, List[tuple[exp.Expression | None, str]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql: str) -> List[tuple[exp.Expression | None, str]] | None:
+        entry = self.entries.get(sql)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(sql)
+        return entry
+
+    def put(self, sql: str, statements: List[tuple[exp.Expression | None, str]]) -> None:
+        self.entries[sql] = statements
+        self.entries.move_to_end(sql)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+# Routes of a cached statement, anything but PASSTHROUGH goes through the middlewares
+PASSTHROUGH = "passthrough"
+STATIC = "static"
+SHOW = "show"
+SET = "set"
+INFO_SCHEMA_ROUTE = "info_schema"
+COMMAND = "command"
+HINTED = "hinted"
+VARIABLES = "variables"
+
+# sqlglot can't parse this form of SHOW PROFILE
+SHOW_PROFILE_FOR_QUERY = re.compile(r"^\s*SHOW\s+PROFILE\s+FOR\s+QUERY\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+# Queries listed by SHOW PROFILES, MySQL's default profiling_history_size
+PROFILING_HISTORY_SIZE = 15
+
+
 class BaseSession:
     """
     Session interface.
@@ -169,8 +232,9 @@ class Session(BaseSession):
 
     dialect: Type[Dialect] = MySQL
 
-    def __init__(self, variables: Variables | None = None):
+    def __init__(self, variables: Variables | None = None, statement_cache: StatementCache | None = None):
         self.variables = variables or SessionVariables(GlobalVariables())
+        self.statement_cache = statement_cache or StatementCache()
 
         # Query middlewares.
         # These allow queries to be intercepted or wrapped.
@@ -232,6 +296,12 @@ class Session(BaseSession):
 
         self._connection: Optional[Connection] = None
 
+        # COM_STMT_PREPARE statement id -> statement prepared by prepare_native
+        self.native_statements: Dict[int, NativeStatement] = {}
+
+        # Seconds spent parsing the statement being handled, 0 if it came from the statement cache
+        self.parse_time = 0.0
+
     async def query(
         self, expression: exp.Expression, sql: str, attrs: Dict[str, str]
     ) -> AllowedResult:
@@ -279,46 +349,100 @@ class Session(BaseSession):
             raise AttributeError("Session is not yet bound")
         return self._connection
 
+    async def prepare_native(self, sql: str) -> Optional[NativeStatement]:
+        """
+        Prepare a statement for COM_STMT_PREPARE.
+
+        Returns:
+            A statement executed with ``execute_native``, or None to have its parameters
+            interpolated into the text and run through ``handle_query`` on every execution.
+        """
+        return None
+
     async def init(self, connection: Connection) -> None:
         """
         Called when connection phase is complete.
         """
         self._connection = connection
+        # mysql_mimic has no hook for the connection class, upgrade it so prepared statements reach prepare_native
+        if type(connection) is Connection:
+            connection.__class__ = PreparedConnection
 
     async def close(self) -> None:
         """
         Called when the client closes the connection.
         """
+        for stmt in self.native_statements.values():
+            stmt.close()
+        self.native_statements.clear()
         self._connection = None
 
     async def handle_query(self, sql: str, attrs: Dict[str, str]) -> AllowedResult:
         self.timestamp = datetime.now(tz=self.timezone())
         result = None
 
-        # Ryan - Hack to try parsing and normally run that but then revert to standard run
-        exps = None
-        try :
-            exps = self._parse(sql)
-        except:
-            exps = None
-
-        if exps is None:
-            q = Query(expression=None,sql=sql,attrs=attrs,_middlewares=self.middlewares,_query=self.query,)
+        t = time.perf_counter()
+        statements = self.statement_cache.get(sql)
+        if statements is None:
+            statements = self._prepare(sql)
+            self.statement_cache.put(sql, statements)
+        self.parse_time = time.perf_counter() - t
+
+        in_info_schema = self.database and self.database.lower() in INFO_SCHEMA
+        for expression, route in statements:
+            if route == PASSTHROUGH and not in_info_schema:
+                # Nothing would intercept or rewrite it, skip the middlewares
+                result = await self.query(expression, sql, attrs)
+                continue
+            q = Query(
+                expression=expression.copy() if expression is not None else None,
+                sql=sql,
+                attrs=attrs,
+                _middlewares=self.middlewares,
+                _query=self.query,
+            )
             result = await q.start()
-        else:
-            for expression in exps:
-                if not expression:
-                    continue
-                q = Query(
-                    expression=expression,
-                    sql=sql,
-                    attrs=attrs,
-                    _middlewares=self.middlewares,
-                    _query=self.query,
-                )
-                result = await q.start()
         return result
 
+    def _prepare(self, sql: str) -> List[tuple[exp.Expression | None, str]]:
+        """Parse sql and decide the route of each statement."""
+        # Ryan - Hack to try parsing and normally run that but then revert to standard run
+        try:
+            exps = self._parse(sql)
+        except Exception:
+            m = SHOW_PROFILE_FOR_QUERY.match(sql)
+            if m:
+                return [(exp.Show(this="PROFILE", query=exp.Literal.number(m.group(1))), SHOW)]
+            return [(None, PASSTHROUGH)]
+        return [(expression, self._route(expression)) for expression in exps]
+
+    def _route(self, expression: exp.Expression) -> str:
+        """Which middleware, if any, will handle expression."""
+        if isinstance(expression, exp.Set):
+            return SET
+        if isinstance(expression, exp.Show):
+            return SHOW
+        if isinstance(expression, (exp.Use, exp.Kill, exp.Describe, exp.Transaction, exp.Commit, exp.Rollback)):
+            return COMMAND
+        if expression.find(exp.Hint):
+            return HINTED
+        if isinstance(expression, exp.Select) and not any(
+            expression.args.get(a)
+            for a in set(exp.Select.arg_types) - {"expressions", "limit", "hint"}
+        ):
+            return STATIC
+        dbs = find_dbs(expression)
+        if dbs and all(db.lower() in INFO_SCHEMA for db in dbs):
+            return INFO_SCHEMA_ROUTE
+        for node in expression.find_all(exp.Func, exp.Column, exp.SessionParameter):
+            if isinstance(node, exp.Func):
+                func_name = node.name.upper() if isinstance(node, exp.Anonymous) else node.sql_name()
+                if func_name in self._functions:
+                    return VARIABLES
+            elif isinstance(node, exp.SessionParameter) or node.sql() in self._constants:
+                return VARIABLES
+        return PASSTHROUGH
+
     async def use(self, database: str) -> None:
         self.database = database
 
@@ -374,23 +498,34 @@ class Session(BaseSession):
     async def _kill_middleware(self, q: Query) -> AllowedResult:
         """Intercept KILL statements"""
         if isinstance(q.expression, exp.Kill):
+            kind = KillKind[q.expression.text("kind").upper() or "CONNECTION"]
+            this = q.expression.this.name
+
+            try:
+                connection_id = int(this)
+            except ValueError as e:
+                raise MysqlError(
+                    f"Invalid KILL connection ID: {this}",
+                    code=ErrorCode.PARSE_ERROR,
+                ) from e
+
+            self.cancel_query(connection_id)
             control = self.connection.control
             if control:
-                kind = KillKind[q.expression.text("kind").upper() or "CONNECTION"]
-                this = q.expression.this.name
-
-                try:
-                    connection_id = int(this)
-                except ValueError as e:
-                    raise MysqlError(
-                        f"Invalid KILL connection ID: {this}",
-                        code=ErrorCode.PARSE_ERROR,
-                    ) from e
-
                 await control.kill(connection_id, kind)
             return [], []
         return await q.next()
 
+    def cancel_query(self, connection_id: int) -> None:
+        """
+        Interrupt whatever query is executing for a connection.
+
+        Called for both KILL QUERY and KILL CONNECTION before the connection itself is signalled.
+
+        Args:
+            connection_id: id of the connection being killed
+        """
+
     async def _show_middleware(self, q: Query) -> AllowedResult:
         """Intercept SHOW statements"""
         if isinstance(q.expression, exp.Show):
@@ -407,6 +542,10 @@ class Session(BaseSession):
             return self._show_warnings(expression)
         if kind == "ERRORS":
             return self._show_errors(expression)
+        if kind == "PROFILES":
+            return self._show_profiles(expression)
+        if kind == "PROFILE":
+            return self._show_profile(expression)
         select = show_statement_to_info_schema_query(expression, self.database)
         return await self._query_info_schema(select)
 
@@ -601,7 +740,37 @@ class Session(BaseSession):
         return rows, ["Variable_name", "Value"]
 
     def _show_status(self, show: exp.Show) -> AllowedResult:
-        return [], ["Variable_name", "Value"]
+        rows = [(k, str(v)) for k, v in self.status()]
+        like = show.text("like")
+        if like:
+            rows = [(k, v) for k, v in rows if like_to_regex(like).match(k)]
+        return rows, ["Variable_name", "Value"]
+
+    def status(self) -> List[tuple[str, Any]]:
+        """Status variables reported by SHOW STATUS."""
+        return [
+            ("Statement_cache_hits", self.statement_cache.hits),
+            ("Statement_cache_misses", self.statement_cache.misses),
+            ("Statement_cache_size", len(self.statement_cache.entries)),
+        ]
+
+    def profiles(self) -> List[QueryProfile]:
+        """Profiles of the queries this connection ran, oldest first, for SHOW PROFILES and SHOW PROFILE."""
+        return []
+
+    def _show_profiles(self, show: exp.Show) -> AllowedResult:
+        rows = [(p.query_id, round(p.elapsed(), 6), p.sql) for p in self.profiles()[-PROFILING_HISTORY_SIZE:]]
+        return rows, ["Query_ID", "Duration", "Query"]
+
+    def _show_profile(self, show: exp.Show) -> AllowedResult:
+        profiles = self.profiles()
+        query = show.args.get("query")
+        if query is not None:
+            query_id = int(query.name)
+            profiles = [p for p in profiles if p.query_id == query_id]
+        if not profiles:
+            return [], ["Status", "Duration"]
+        return [(k, round(v, 6)) for k, v in profiles[-1].breakdown()], ["Status", "Duration"]
 
     def _show_warnings(self, show: exp.Show) -> AllowedResult:
         return [], ["Level", "Code", "Message"]
@@ -615,9 +784,19 @@ class Session(BaseSession):
 
 
 class MySession(Session):
-    def __init__(self, queryProcessor: QueryProcessor):
-        super().__init__()
+    def __init__(self, queryProcessor: QueryProcessor, executor: QueryExecutor | None = None,
+                 statement_cache: StatementCache | None = None):
+        super().__init__(statement_cache=statement_cache)
         self.queryProcessor = queryProcessor
+        # Servers share one executor between sessions, a session without one has its own, shut down on close
+        self._own_executor = executor is None
+        self.executor = executor or QueryExecutor(queryProcessor, workers=1)
+        self.variables.set("max_execution_time", int(queryProcessor.governor.max_execution_time * 1000))
+
+    async def close(self) -> None:
+        await super().close()
+        if self._own_executor:
+            self.executor.shutdown()
 
     # 22
     # 3.3
@@ -630,24 +809,174 @@ class MySession(Session):
     # True
     # {"apple", "banana", "cherry"}
 
+    # Rows pulled from the result and encoded per round trip to a worker
+    batch_size = 10000
+
     async def query(self, expression, sql, attrs):
-        r = self.queryProcessor.query(sql)
-        if isinstance(r, pl.DataFrame):
-            return r.rows(), r.columns
+        profile = self.queryProcessor.profiler.begin(sql, "mysql", self.connection.connection_id)
+        profile.record("parse", self.parse_time)
+        return await self._stream(partial(self.queryProcessor.query_reader, sql, batch_size=self.batch_size),
+                                  profile)
+
+    async def prepare_native(self, sql: str) -> Optional[NativeStatement]:
+        text = self.queryProcessor.native_sql(sql)
+        if text is None or (self.database and self.database.lower() in INFO_SCHEMA):
+            return None
+        statements = self.statement_cache.get(sql)
+        if statements is None:
+            statements = self._prepare(sql)
+            self.statement_cache.put(sql, statements)
+        if len(statements) != 1 or statements[0][1] != PASSTHROUGH:
+            return None
+        stmt = NativeStatement(text)
+        try:
+            await self.executor.run(self.connection.connection_id, partial(self.queryProcessor.prepare, stmt))
+        except duckdb.Error:
+            # e.g. several statements, which DuckDB can't prepare as one
+            return None
+        return stmt
+
+    async def execute_native(self, stmt: NativeStatement, params: Sequence[Any]) -> ResultSet:
+        profile = self.queryProcessor.profiler.begin(stmt.sql, "mysql", self.connection.connection_id)
+        return await self._stream(partial(self.queryProcessor.execute_prepared, stmt, params,
+                                          batch_size=self.batch_size), profile)
+
+    async def _stream(self, fn: Callable[..., pa.RecordBatchReader], profile: QueryProfile) -> ResultSet:
+        """Call fn(db=cursor, profile=profile) on a leased cursor and stream the reader it returns."""
+        # Results are streamed batch by batch, the lease keeps the cursor (and so the reader) valid until sent.
+        profiler = self.queryProcessor.profiler
+        try:
+            with profile.phase("queue"):
+                lease = await self.executor.lease(self.connection.connection_id)
+        except BaseException as e:
+            profiler.end(profile, e)
+            raise
+        # Runs until the last row is sent, interrupting the cursor both while executing and streaming
+        deadline = self.queryProcessor.governor.arm(lease.cursor, self.max_execution_time())
+        try:
+            reader = await lease.call(partial(fn, db=lease.cursor, profile=profile))
+        except BaseException as e:
+            if deadline is not None:
+                deadline.cancel()
+            lease.release()
+            e = timed_out(e, deadline)
+            profiler.end(profile, e)
+            raise e
+        columns = [result_column(f) for f in reader.schema]
+        return ResultSet(rows=self._stream_rows(lease, reader, profile, deadline), columns=columns)
+
+    async def _stream_rows(self, lease: CursorLease, reader: pa.RecordBatchReader, profile: QueryProfile,
+                           deadline: Deadline | None = None):
+        error = None
+        try:
+            while (rows := await lease.call(partial(next_rows, reader, profile))) is not None:
+                for row in rows:
+                    yield row
+        except GeneratorExit:
+            # Closed early, not an error of the query
+            raise
+        except BaseException as e:
+            error = timed_out(e, deadline)
+            raise error
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+            lease.release()
+            self.queryProcessor.profiler.end(profile, error)
+
+    def max_execution_time(self) -> float:
+        """Seconds queries of this session may run, SET max_execution_time in ms overriding the governor's."""
+        ms = self.variables.get("max_execution_time")
+        return ms / 1000 if ms else 0
 
-        return [("a", 1), ("b", 2)], ["col1", "col2"]
+    def profiles(self) -> List[QueryProfile]:
+        connection_id = self.connection.connection_id
+        return [p for p in reversed(self.queryProcessor.profiler.queries()) if p.connection_id == connection_id]
 
     async def schema(self):
-        # Optionally provide the database schema.
         # This is used to serve INFORMATION_SCHEMA and SHOW queries.
-        tbls = self.queryProcessor.query("dk>show tables;")
-        r = {}
-        for c in tbls.get_column("name"):
-            r[c] = {"col1": "TEXT", "col2": "INT", }
-        return r
-
-def start_sql(queryProcessor: QueryProcessor, port: int):
-    handler = partial(MySession, queryProcessor)
-    server = MysqlServer(session_factory=handler, port=port)
+        catalog = self.queryProcessor.catalog
+        if catalog.is_current():
+            return catalog.info_schema()
+        return await self.executor.run(self.connection.connection_id, catalog.info_schema)
+
+    def cancel_query(self, connection_id: int) -> None:
+        self.executor.cancel(connection_id)
+
+
+def arrow_to_mysql_type(t: pa.DataType) -> ColumnType:
+    """MySQL column type used to send values of Arrow type t."""
+    if pa.types.is_boolean(t):
+        return ColumnType.TINY
+    elif pa.types.is_integer(t):
+        if t.bit_width == 64 and pa.types.is_unsigned_integer(t):
+            # LONGLONG is sent signed, mysql_mimic has no unsigned column flag
+            return ColumnType.NEWDECIMAL
+        if t.bit_width <= 8 or (t.bit_width == 16 and pa.types.is_signed_integer(t)):
+            return ColumnType.SHORT
+        elif t.bit_width <= 16 or (t.bit_width == 32 and pa.types.is_signed_integer(t)):
+            return ColumnType.LONG
+        return ColumnType.LONGLONG
+    elif pa.types.is_floating(t):
+        return ColumnType.DOUBLE if t.bit_width == 64 else ColumnType.FLOAT
+    elif pa.types.is_decimal(t):
+        return ColumnType.NEWDECIMAL
+    elif pa.types.is_string(t) or pa.types.is_large_string(t):
+        return ColumnType.STRING
+    elif pa.types.is_binary(t) or pa.types.is_large_binary(t) or pa.types.is_fixed_size_binary(t):
+        return ColumnType.BLOB
+    elif pa.types.is_date(t):
+        return ColumnType.DATE
+    elif pa.types.is_timestamp(t):
+        return ColumnType.DATETIME
+    elif pa.types.is_time(t) or pa.types.is_duration(t):
+        return ColumnType.TIME
+    elif pa.types.is_null(t):
+        return ColumnType.NULL
+    return ColumnType.VARCHAR
+
+
+def result_column(f: pa.Field) -> ResultColumn:
+    """Column sending the values of Arrow field f."""
+    if pa.types.is_time(f.type):
+        return ResultColumn(f.name, ColumnType.TIME, binary_encoder=binary_encode_time)
+    return ResultColumn(f.name, arrow_to_mysql_type(f.type))
+
+
+def binary_encode_time(col: ResultColumn, val: time_ | timedelta) -> bytes:
+    """A time of day as the binary protocol's TIME, which mysql_mimic only encodes from a timedelta."""
+    if isinstance(val, time_):
+        val = timedelta(hours=val.hour, minutes=val.minute, seconds=val.second, microseconds=val.microsecond)
+    return _binary_encode_timedelta(col, val)
+
+
+def timed_out(e: BaseException, deadline: Deadline | None) -> BaseException:
+    """The MySQL timeout error replacing e if deadline interrupted the query, otherwise e."""
+    if deadline is None or not deadline.fired:
+        return e
+    error = MysqlError(str(QueryTimeout(deadline.seconds)), code=QUERY_TIMEOUT)
+    error.__cause__ = e
+    return error
+
+
+def next_rows(reader: pa.RecordBatchReader, profile: QueryProfile | None = None) -> list[tuple] | None:
+    """Read the next batch from reader as a list of row tuples, None once exhausted."""
+    try:
+        batch = reader.read_next_batch()
+    except StopIteration:
+        return None
+    with profile.phase("encode") if profile is not None else nullcontext():
+        return list(zip(*(c.to_pylist() for c in batch.columns)))
+
+
+def sql_server(queryProcessor: QueryProcessor, workers: int = 4, queue_size: int = None, **kwargs) -> MysqlServer:
+    """MySQL server answering from queryProcessor, kwargs are passed to MysqlServer."""
+    executor = QueryExecutor(queryProcessor, workers, queue_size)
+    handler = partial(MySession, queryProcessor, executor, StatementCache())
+    return MysqlServer(session_factory=handler, **kwargs)
+
+
+def start_sql(queryProcessor: QueryProcessor, port: int, workers: int = 4, queue_size: int = None):
+    server = sql_server(queryProcessor, workers, queue_size, port=port)
     asyncio.run(server.serve_forever())
 
@@ -0,0 +1,226 @@
+"""Prepared dk> statements over the MySQL binary protocol, kept prepared in DuckDB between executions."""
+from __future__ import annotations
+
+import datetime
+import io
+import itertools
+import math
+import threading
+import weakref
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple
+
+import duckdb
+from mysql_mimic import packets, types
+from mysql_mimic.connection import Connection
+from mysql_mimic.errors import ErrorCode, MysqlError
+from mysql_mimic.packets import make_binary_resultrow, make_column_definition_41
+from mysql_mimic.prepared import PreparedStatement, REGEX_PARAM
+from mysql_mimic.results import NullBitmap
+from mysql_mimic.types import Capabilities, ColumnType, read_uint_1, read_uint_2, read_uint_4, read_uint_len
+from mysql_mimic.utils import aiterate, cooperative_iterate
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from mysql_mimic.results import ResultSet
+
+
+def sql_literal(v: Any) -> str:
+    """DuckDB literal for a statement parameter, passed to EXECUTE as a typed value, quoting any string."""
+    if v is None:
+        return "NULL"
+    elif isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    elif isinstance(v, int):
+        return str(v)
+    elif isinstance(v, float):
+        return (repr(v) if math.isfinite(v) else "'" + str(v) + "'") + "::DOUBLE"
+    elif isinstance(v, Decimal):
+        return format(v, "f") if v.is_finite() else "'" + str(v) + "'::DOUBLE"
+    elif isinstance(v, (bytes, bytearray)):
+        return "'" + "".join("\\x%02X" % b for b in v) + "'::BLOB"
+    elif isinstance(v, datetime.datetime):
+        return ("TIMESTAMPTZ '" if v.tzinfo else "TIMESTAMP '") + v.isoformat(sep=" ") + "'"
+    elif isinstance(v, datetime.date):
+        return "DATE '" + v.isoformat() + "'"
+    elif isinstance(v, datetime.time):
+        return "TIME '" + v.isoformat() + "'"
+    elif isinstance(v, datetime.timedelta):
+        return "INTERVAL (%d) MICROSECONDS" % (v // datetime.timedelta(microseconds=1))
+    # The parser ends a quoted string at a NUL, those are concatenated in
+    parts = ["'" + s.replace("'", "''") + "'" for s in str(v).split("\x00")]
+    return parts[0] if len(parts) == 1 else "(" + " || chr(0) || ".join(parts) + ")"
+
+
+class NativeStatement:
+    """
+    A dk> statement prepared with DuckDB's PREPARE, once on each cursor that executes it.
+
+    Executions skip parsing and planning the statement, DuckDB re-plans by itself when a table or
+    frame it reads changes. DuckDB can't bind parameters of EXECUTE, so each value is spliced into
+    the EXECUTE as a quoted, typed literal made by sql_literal.
+
+    Args:
+        sql: DuckDB statement with ``?`` placeholders
+    """
+
+    _ids = itertools.count(1)
+    # cursor -> names of closed statements still prepared on it, deallocated on its next execution
+    _closed: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.num_params = len(REGEX_PARAM.findall(sql))
+        self.name = "pythondb_stmt_%d" % next(self._ids)
+        # Cursors the statement is prepared on
+        self.cursors: weakref.WeakSet = weakref.WeakSet()
+        # Parameter types of the last execution, clients only resend them when they change
+        self.param_types: Optional[List[Tuple[ColumnType, bool]]] = None
+
+    def prepare(self, cur: duckdb.DuckDBPyConnection) -> None:
+        """Prepare on cur if not done already, raises if DuckDB can't prepare the statement."""
+        with self._lock:
+            stale = self._closed.pop(cur, ())
+        for name in stale:
+            cur.execute("DEALLOCATE " + name)
+        if cur not in self.cursors:
+            cur.execute("PREPARE " + self.name + " AS " + self.sql)
+            self.cursors.add(cur)
+
+    def execute(self, cur: duckdb.DuckDBPyConnection, params: Sequence[Any], batch_size: int) -> pa.RecordBatchReader:
+        """Execute on cur, a cursor used by nobody else until the returned reader is done."""
+        self.prepare(cur)
+        args = "(" + ", ".join(sql_literal(p) for p in params) + ")" if params else ""
+        cur.execute("EXECUTE " + self.name + args)
+        return cur.fetch_record_batch(batch_size)
+
+    def close(self) -> None:
+        """Deallocate from every cursor, when each is next used as they may be busy now."""
+        with self._lock:
+            for cur in self.cursors:
+                self._closed.setdefault(cur, []).append(self.name)
+        self.cursors = weakref.WeakSet()
+
+
+def read_param_value(client_charset, reader: io.BytesIO, param_type: ColumnType, unsigned: bool) -> Any:
+    """Read a binary protocol parameter, adding the decimal and temporal types mysql_mimic lacks."""
+    if param_type in (ColumnType.DECIMAL, ColumnType.NEWDECIMAL):
+        return Decimal(client_charset.decode(types.read_str_len(reader)))
+    elif param_type in (ColumnType.DATE, ColumnType.DATETIME, ColumnType.TIMESTAMP):
+        n = read_uint_1(reader)
+        if n == 0:
+            return None
+        year, month, day = read_uint_2(reader), read_uint_1(reader), read_uint_1(reader)
+        hour = minute = second = micro = 0
+        if n >= 7:
+            hour, minute, second = read_uint_1(reader), read_uint_1(reader), read_uint_1(reader)
+        if n >= 11:
+            micro = read_uint_4(reader)
+        if param_type == ColumnType.DATE:
+            return datetime.date(year, month, day)
+        return datetime.datetime(year, month, day, hour, minute, second, micro)
+    elif param_type == ColumnType.TIME:
+        n = read_uint_1(reader)
+        if n == 0:
+            return datetime.timedelta(0)
+        negative, days = read_uint_1(reader), read_uint_4(reader)
+        hour, minute, second = read_uint_1(reader), read_uint_1(reader), read_uint_1(reader)
+        micro = read_uint_4(reader) if n >= 12 else 0
+        t = datetime.timedelta(days=days, hours=hour, minutes=minute, seconds=second, microseconds=micro)
+        return -t if negative else t
+    return packets._read_param_value(client_charset, reader, param_type, unsigned)
+
+
+class PreparedConnection(Connection):
+    """
+    Connection executing prepared dk> statements as NativeStatements.
+
+    Statements the session can't prepare natively (SHOW, SET, py> code, ...) keep mysql_mimic's
+    behaviour of interpolating the parameters into the text and running it as a query.
+    """
+
+    async def handle_stmt_prepare(self, data: bytes) -> None:
+        sql = self.client_charset.decode(data)
+        native = await self.session.prepare_native(sql)
+        if native is None:
+            return await super().handle_stmt_prepare(data)
+        stmt = PreparedStatement(stmt_id=next(self.prepared_stmt_seq), sql=sql, num_params=native.num_params)
+        self.prepared_stmts[stmt.stmt_id] = stmt
+        self.session.native_statements[stmt.stmt_id] = native
+        for packet in self.com_stmt_prepare_response(stmt):
+            await self.stream.write(packet, drain=False)
+        await self.stream.drain()
+
+    async def handle_stmt_execute(self, data: bytes) -> None:
+        r = io.BytesIO(data)
+        stmt_id = read_uint_4(r)
+        native = self.session.native_statements.get(stmt_id)
+        if native is None:
+            return await super().handle_stmt_execute(data)
+        stmt = self.get_stmt(stmt_id)
+        use_cursor, param_count_available = packets._read_cursor_flags(r)
+        read_uint_4(r)  # iteration count, always 1
+        params = self.read_params(r, stmt, native, param_count_available)
+        stmt.param_buffers = None
+
+        result_set = await self.session.execute_native(native, params)
+        if not result_set:
+            await self.stream.write(self.ok())
+            return
+        await self.write_binary_resultset(result_set, stmt, use_cursor)
+
+    def read_params(self, r: io.BytesIO, stmt: PreparedStatement, native: NativeStatement,
+                    param_count_available: bool) -> List[Any]:
+        """The statement's parameter values, any query attributes sent after them are ignored."""
+        count = stmt.num_params
+        if Capabilities.CLIENT_QUERY_ATTRIBUTES in self.capabilities and (count or param_count_available):
+            count = read_uint_len(r)
+        if count == 0:
+            return []
+        nulls = NullBitmap.from_buffer(r, count)
+        if read_uint_1(r):
+            native.param_types = []
+            for _ in range(count):
+                native.param_types.append(packets._read_param_type(r))
+                if Capabilities.CLIENT_QUERY_ATTRIBUTES in self.capabilities:
+                    types.read_str_len(r)  # name, empty for statement parameters
+        elif native.param_types is None or len(native.param_types) != count:
+            raise MysqlError("Parameter types were never sent", ErrorCode.WRONG_ARGUMENTS)
+        values = []
+        for i, (param_type, unsigned) in enumerate(native.param_types):
+            if nulls.is_flipped(i):
+                values.append(None)
+            elif stmt.param_buffers and i in stmt.param_buffers:
+                values.append(self.client_charset.decode(stmt.param_buffers[i]))
+            else:
+                values.append(read_param_value(self.client_charset, r, param_type, unsigned))
+        return values[:stmt.num_params]
+
+    async def write_binary_resultset(self, result_set: ResultSet, stmt: PreparedStatement, use_cursor: bool) -> None:
+        await self.stream.write(types.uint_len(len(result_set.columns)))
+        for column in result_set.columns:
+            await self.stream.write(make_column_definition_41(server_charset=self.server_charset, name=column.name,
+                                                              column_type=column.type,
+                                                              character_set=column.character_set))
+
+        async def gen_rows():
+            async for row in cooperative_iterate(aiterate(result_set.rows)):
+                yield make_binary_resultrow(row, result_set.columns)
+
+        rows = gen_rows()
+        if use_cursor:
+            stmt.cursor = rows
+            await self.stream.write(self.ok_or_eof(flags=types.ServerStatus.SERVER_STATUS_CURSOR_EXISTS))
+        else:
+            if not self.deprecate_eof():
+                await self.stream.write(self.eof())
+            async for row in rows:
+                await self.stream.write(row)
+            await self.stream.write(self.ok_or_eof())
+
+    async def handle_stmt_close(self, data: bytes) -> None:
+        native = self.session.native_statements.pop(packets.parse_com_stmt_close(data).stmt_id, None)
+        if native is not None:
+            native.close()
+        await super().handle_stmt_close(data)
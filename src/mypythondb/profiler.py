@@ -0,0 +1,221 @@
+"""Per-query timings of each processing phase, kept for the most recent and the slowest queries."""
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import polars as pl
+
+from .lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+
+
+class QueryProfile:
+    """
+    Phase timings, rows and bytes of one query.
+
+    Phase times are exclusive, time spent in a phase entered while another is running is only
+    counted for the inner one, so the phases of a query never add up to more than its duration.
+    A phase entered several times, e.g. once per streamed batch, reports its total.
+
+    Args:
+        query_id: sequence number, unique within its Profiler
+        sql: statement as issued
+        source: what issued the query, "python", "mysql" or "web"
+        connection_id: MySQL connection the query came from, if any
+    """
+
+    def __init__(self, query_id: int, sql: str, source: str, connection_id: Optional[int] = None):
+        self.query_id = query_id
+        self.sql = sql
+        self.source = source
+        self.connection_id = connection_id
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        # Seconds from start to end, None while running
+        self.duration: Optional[float] = None
+        # phase -> seconds, in the order first entered
+        self.phases: Dict[str, float] = {}
+        self.rows = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        # dk, pl, py or q once the statement's language is known
+        self.lang: Optional[str] = None
+        # Time taken by nested phases of each running phase
+        self._nested: List[float] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Count the time spent in the with block towards phase name."""
+        self._nested.append(0.0)
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            self.record(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def record(self, name: str, seconds: float) -> None:
+        """Add seconds measured elsewhere to phase name."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add(self, rows: int, nbytes: int) -> None:
+        """Count rows and bytes of result produced."""
+        self.rows += rows
+        self.bytes += nbytes
+
+    def add_frame(self, df: pl.DataFrame) -> None:
+        """Count the rows and estimated bytes of a result frame."""
+        # polars can't estimate the size of Object columns
+        self.add(df.height, sum(c.estimated_size() for c in df.get_columns() if c.dtype != pl.Object))
+
+    def elapsed(self) -> float:
+        """Duration if finished, otherwise the time since the start."""
+        return self.duration if self.duration is not None else time.perf_counter() - self._t0
+
+    def breakdown(self) -> List[tuple[str, float]]:
+        """(phase, seconds) pairs followed by the time not spent in any phase, e.g. waiting on the client."""
+        other = self.elapsed() - sum(self.phases.values())
+        return list(self.phases.items()) + [("other", max(other, 0.0))]
+
+    def to_dict(self) -> dict:
+        """JSON serializable form, times in milliseconds."""
+        return {
+            "query_id": self.query_id,
+            "started": self.started,
+            "source": self.source,
+            "connection_id": self.connection_id,
+            "lang": self.lang,
+            "sql": self.sql,
+            "duration_ms": round(self.elapsed() * 1000, 3),
+            "phases_ms": {k: round(v * 1000, 3) for k, v in self.phases.items()},
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "error": self.error,
+        }
+
+
+class Profiler:
+    """
+    Keeps the profiles of the most recent queries and of the slowest ones.
+
+    Args:
+        history: number of recent queries kept
+        slow_threshold: seconds a query must take to be kept as slow
+        slow_count: number of slow queries kept, the fastest is dropped first
+    """
+
+    def __init__(self, history: int = 200, slow_threshold: float = 1.0, slow_count: int = 50):
+        self.recent: deque[QueryProfile] = deque(maxlen=history)
+        self.slow_threshold = slow_threshold
+        self.slow_count = slow_count
+        # Min heap of (duration, query_id, profile)
+        self._slow: List[tuple[float, int, QueryProfile]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Of every query ended, kept or not
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def begin(self, sql: str, source: str, connection_id: Optional[int] = None) -> QueryProfile:
+        return QueryProfile(next(self._ids), sql, source, connection_id)
+
+    def end(self, profile: QueryProfile, error: Optional[BaseException] = None) -> None:
+        """Finish profile and keep it, does nothing if already finished."""
+        if profile.duration is not None:
+            return
+        profile.duration = time.perf_counter() - profile._t0
+        if error is not None:
+            profile.error = str(error) or type(error).__name__
+        with self._lock:
+            self.count += 1
+            self.errors += error is not None
+            self.rows += profile.rows
+            self.seconds += profile.duration
+            self.recent.append(profile)
+            if profile.duration >= self.slow_threshold:
+                entry = (profile.duration, profile.query_id, profile)
+                if len(self._slow) < self.slow_count:
+                    heapq.heappush(self._slow, entry)
+                else:
+                    heapq.heappushpop(self._slow, entry)
+
+    @contextmanager
+    def run(self, sql: str, source: str, connection_id: Optional[int] = None) -> Iterator[QueryProfile]:
+        """Profile of the with block, ended with any exception raised in it."""
+        profile = self.begin(sql, source, connection_id)
+        try:
+            yield profile
+        except BaseException as e:
+            self.end(profile, e)
+            raise
+        self.end(profile)
+
+    def stream(self, reader: pa.RecordBatchReader, profile: QueryProfile, end: bool = False) -> pa.RecordBatchReader:
+        """
+        reader with the time spent reading batches counted as the fetch phase, and their rows and bytes counted.
+
+        With end=True the profile is ended once the reader is exhausted, fails or is closed.
+        """
+        def batches():
+            it = iter(reader)
+            try:
+                while True:
+                    with profile.phase("fetch"):
+                        b = next(it, None)
+                    if b is None:
+                        break
+                    profile.add(b.num_rows, b.nbytes)
+                    yield b
+            except GeneratorExit:
+                # Closed early, the client had all it wanted
+                if end:
+                    self.end(profile)
+                raise
+            except BaseException as e:
+                if end:
+                    self.end(profile, e)
+                raise
+            if end:
+                self.end(profile)
+
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+    def queries(self, slow: bool = False) -> List[QueryProfile]:
+        """Recent queries newest first, or slow queries slowest first."""
+        with self._lock:
+            if slow:
+                return [p for _, _, p in sorted(self._slow, reverse=True)]
+            return list(reversed(self.recent))
+
+    def get(self, query_id: int) -> Optional[QueryProfile]:
+        with self._lock:
+            return next((p for p in itertools.chain(self.recent, (e[2] for e in self._slow))
+                         if p.query_id == query_id), None)
+
+    def to_frame(self, profiles: List[QueryProfile]) -> pl.DataFrame:
+        """One row per profile with a millisecond column per phase."""
+        rows = []
+        for p in profiles:
+            d = p.to_dict()
+            row = {k: d[k] for k in ("query_id", "source", "connection_id", "lang", "sql", "duration_ms", "rows", "bytes",
+                                     "error")}
+            row["started"] = d["started"]
+            row.update({k + "_ms": v for k, v in d["phases_ms"].items()})
+            rows.append(row)
+        if not rows:
+            return pl.DataFrame(schema={"query_id": pl.Int64, "source": pl.String, "connection_id": pl.Int64,
+                                        "lang": pl.String, "sql": pl.String, "duration_ms": pl.Float64, "rows": pl.Int64,
+                                        "bytes": pl.Int64, "error": pl.String, "started": pl.Datetime("us")})
+        df = pl.from_dicts(rows, infer_schema_length=None)
+        return df.with_columns(pl.from_epoch(pl.col("started") * 1_000_000, time_unit="us"))
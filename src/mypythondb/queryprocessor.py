@@ -1,41 +1,104 @@
 """Command-line interface."""
+from __future__ import annotations
+
 import ast
+import copy
+import re
 import sys
-from http.server import HTTPServer
+import threading
 
-import click
 import code
 import asyncio
-from functools import partial
+from functools import lru_cache, partial
+from types import CodeType
 
-from mysql_mimic import MysqlServer
-from pathlib import Path
 import polars as pl
-import pandas as pd
 
 from datetime import date, datetime
 
-# TO allow pyinstaller to find imports
-import pyarrow as pa
-import xlsxwriter
-import numpy as np
-import kola
 import duckdb
 from polars import DataFrame
 
-def exec_with_return(code: str, globals: dict, locals: dict, verbose: bool):
+from typing import TYPE_CHECKING, Any, Callable, Optional, Sequence
+
+from .lazy import lazy_import, imported
+from .frameregistry import FrameRegistry
+from .rwlock import RWLock
+from .catalog import Catalog
+from .profiler import Profiler, QueryProfile
+from .result import LazyResult, LazyFrameResult
+from .loader import Loader, print_progress
+from .snapshot import write_snapshot, read_snapshot
+from .converters import CONVERTERS
+from .governor import ResourceGovernor
+from .resultcache import ResultCache, CachingRelation, read_tables, READ_PATTERN, WRITE_PATTERN, ANY_FRAME
+
+if TYPE_CHECKING:
+    from .prepared import NativeStatement
+
+# Offered to py> code, imported when first used
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+np = lazy_import("numpy")
+xlsxwriter = lazy_import("xlsxwriter")
+kola = lazy_import("kola")
+
+# Statements that may change which tables or columns exist
+DDL_PATTERN = re.compile(r"\b(CREATE|DROP|ALTER|ATTACH|DETACH|IMPORT\s+DATABASE|USE)\s", re.IGNORECASE)
+
+# Compiled py> snippets kept, by source, so statements sent repeatedly are never parsed again
+COMPILE_CACHE_SIZE = 512
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_with_return(code: str) -> tuple[CodeType, Optional[CodeType]]:
+    """
+    Compile code once into the statements to exec and the expression whose value it returns.
+
+    The value is that of a final expression statement, which is then left out of the statements,
+    or the target of a final assignment.
+    """
     a = ast.parse(code)
     last_expression = None
     if a.body:
         if isinstance(a_last := a.body[-1], ast.Expr):
-            last_expression = ast.unparse(a.body.pop())
+            last_expression = a.body.pop().value
         elif isinstance(a_last, ast.Assign):
-            last_expression = ast.unparse(a_last.targets[0])
+            last_expression = a_last.targets[0]
         elif isinstance(a_last, (ast.AnnAssign, ast.AugAssign)):
-            last_expression = ast.unparse(a_last.target)
+            last_expression = a_last.target
+    result = None
+    if last_expression is not None:
+        last_expression = copy.deepcopy(last_expression)
+        # An assignment target is read back, so load rather than store it
+        for node in ast.walk(last_expression):
+            if hasattr(node, "ctx"):
+                node.ctx = ast.Load()
+        result = compile(ast.Expression(last_expression), "<string>", "eval")
+    return compile(a, "<string>", "exec"), result
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def code_names(code: str) -> frozenset[str]:
+    """Every name code reads, assigns or deletes, including within the functions it defines."""
+    try:
+        body, last_expression = compile_with_return(code)
+    except SyntaxError:
+        return frozenset()
+    names = set()
+    todo = [body] + ([last_expression] if last_expression else [])
+    while todo:
+        c = todo.pop()
+        names.update(c.co_names, c.co_varnames, c.co_freevars)
+        todo.extend(k for k in c.co_consts if isinstance(k, CodeType))
+    return frozenset(names)
+
+
+def exec_with_return(code: str, globals: dict, locals: dict, verbose: bool):
+    body, last_expression = compile_with_return(code)
     if verbose:
         print("locals before: ", locals.keys())
-    exec(ast.unparse(a), globals, locals)
+    exec(body, globals, locals)
     if last_expression:
         r = eval(last_expression, globals, locals)
         if verbose:
@@ -53,7 +116,26 @@ class QueryProcessor:
 
         self.verbose = verbose
         self.mylocals = {"pythondb":self, "pdb":self}
-        self.ctx = pl.SQLContext(register_globals=True, eager=True, frames={})
+        self.ctx = pl.SQLContext(register_globals=True, eager=False, frames={})
+        # Run pl> queries as plans collected on the streaming engine when read, see enable_lazy_polars
+        self.lazy_polars = False
+        self.frames = FrameRegistry(self.duckdb, self.ctx)
+        # py> statements write mylocals, ctx and frames, everything else only reads them
+        self.lock = RWLock()
+        # The creating thread queries on self.duckdb, other threads get a cursor each
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+        # Incremented after any statement that may have been DDL
+        self.ddl_generation = 0
+        self.catalog = Catalog(self)
+        # Opt-in, see enable_result_cache
+        self.result_cache: ResultCache | None = None
+        # Phase timings of recent and slow queries, see profile
+        self.profiler = Profiler()
+        # Supervisor of the processes serving MySQL when started with replicas, see workers
+        self.replicas = None
+        # Query time, memory and admission limits, see limit_resources
+        self.governor = ResourceGovernor()
 
     def setlang(self, lg:str):
         l = lg.upper()
@@ -73,10 +155,99 @@ class QueryProcessor:
     def getconfig(self):
         return {"lang":self.query_lang}
 
+    def enable_result_cache(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 300.0) -> None:
+        """Cache dk> and pl> read results, keeping at most max_bytes of results for up to ttl seconds."""
+        self.result_cache = ResultCache(max_bytes, ttl)
+
+    def disable_result_cache(self) -> None:
+        self.result_cache = None
+
+    def limit_resources(self, max_execution_time: float = 0, memory_limit: str = None, max_result_bytes: int = 0,
+                        queue_size: int = 64, queue_timeout: float = 30.0) -> None:
+        """
+        Limit how long queries run, how much memory they take and how many the servers admit.
+
+        Args:
+            max_execution_time: seconds a query may run before it is interrupted, 0 for no limit
+            memory_limit: DuckDB memory_limit shared by every query e.g. "4GB"
+            max_result_bytes: most bytes of result one query may hold in memory, 0 for no limit
+            queue_size: queries allowed to wait for a free worker of each server
+            queue_timeout: seconds a query may wait for a free worker before it is rejected
+        """
+        governor = ResourceGovernor(max_execution_time, memory_limit, max_result_bytes, queue_size, queue_timeout)
+        governor.apply(self.duckdb)
+        self.governor = governor
+
+    def enable_lazy_polars(self) -> None:
+        """
+        Return pl> results as uncollected plans, collected on polars' streaming engine as far as they're read.
+
+        Filters and column selections are pushed down into the frames and files scanned, so data
+        files larger than memory can be queried. Lazy results aren't kept by the result cache.
+        """
+        self.lazy_polars = True
+
+    def disable_lazy_polars(self) -> None:
+        self.lazy_polars = False
+
+    def register_lazy(self, name: str, lf: pl.LazyFrame) -> None:
+        """Make lf, e.g. a pl.scan_parquet, queryable by pl> statements as name, unless a polars frame is bound to name."""
+        with self.lock.write():
+            self.frames.register_lazy(name, lf)
+            if self.result_cache is not None:
+                self.result_cache.invalidate({name})
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """The connection the calling thread runs dk> statements on when none is given."""
+        if threading.get_ident() == self._owner:
+            return self.duckdb
+        cur = getattr(self._local, "cursor", None)
+        if cur is None:
+            cur = self._local.cursor = self.duckdb.cursor()
+        return cur
+
     def getps1(self):
         return '>>>' if self.query_lang == 'py' else 'q)' if self.query_lang == 'q' else (self.query_lang + ">")
 
-    def queryraw(self, sql):
+    def profile(self, query_id: int = None, slow: bool = False) -> DataFrame:
+        """
+        Recent queries, newest first, with their time per phase in milliseconds.
+
+        Args:
+            query_id: only this query, as one row per phase
+            slow: the slowest queries instead, slowest first
+        """
+        if query_id is None:
+            return self.profiler.to_frame(self.profiler.queries(slow))
+        p = self.profiler.get(query_id)
+        if p is None:
+            raise Exception("No profile for query " + str(query_id))
+        phases = p.breakdown()
+        return pl.DataFrame({"phase": [k for k, _ in phases], "ms": [v * 1000 for _, v in phases]})
+
+    def workers(self) -> DataFrame:
+        """Health and query counts of each MySQL replica process."""
+        if self.replicas is None:
+            raise Exception("Not serving MySQL from replicas, start with --replicas N")
+        return self.replicas.to_frame()
+
+    def queryraw(self, sql, db: duckdb.DuckDBPyConnection = None, profile: QueryProfile = None):
+        """
+        Run sql, dk> statements are run on db if given, otherwise on the shared connection.
+
+        dk> results, and pl> results with lazy_polars, are returned as a LazyResult, executed as far
+        as the caller reads it.
+        Phase timings are recorded on profile, or on a profile of its own if none is given.
+        """
+        if profile is None:
+            with self.profiler.run(sql, "python") as profile:
+                r = self.queryraw(sql, db, profile)
+            if isinstance(r, LazyResult):
+                # Executed after the profile ended, if at all
+                r.profile = None
+            return r
+        if db is None:
+            db = self.cursor()
         s = sql.strip()
         if len(s) == 0:
             return None
@@ -88,30 +259,34 @@ class QueryProcessor:
             s = 'q)' + s
 
         r = None
+        profile.lang = "q" if s.startswith("q)") else "py" if s.startswith(">>>") else s[:2]
         if s.startswith("dk>"):
             while s.startswith("dk>"):
                 s = s[3:]
-            r = self.duckdb.sql(s)
-            r = r.pl() if r is not None else None
+            r = self._duckdb_query(s, db, profile)
         elif s.startswith("pl>"):
             while s.startswith("pl>"):
                 s = s[3:]
-            r = self.ctx.execute(s)
+            r = self._polars_query(s, profile)
         elif s.startswith(">>>") or s.startswith("py>"):
             while s.startswith(">>>") or s.startswith("py>"):
                 s = s[3:]
-            r = exec_with_return(s, globals(), self.mylocals, self.verbose)
+            with self.lock.write():
+                try:
+                    with profile.phase("python"):
+                        r = exec_with_return(s, globals(), self.mylocals, self.verbose)
+                finally:
+                    # Register any new or changed vars, those the code touched may have been edited in place
+                    with profile.phase("register"):
+                        changed = self.frames.sync(self.mylocals, code_names(s))
+                    if DDL_PATTERN.search(s):
+                        self.ddl_generation += 1
+                    if self.result_cache is not None:
+                        if WRITE_PATTERN.search(s):
+                            self.result_cache.clear()
+                        else:
+                            self.result_cache.invalidate(changed)
             print(r)
-            # Register any newly created vars
-            polars = {}
-            for k in self.mylocals.keys():
-                v = self.mylocals[k]
-                if isinstance(v, pl.DataFrame):
-                    self.duckdb.register(k, v)
-                    polars[k] = v
-                elif isinstance(v, pd.DataFrame):
-                    self.duckdb.register(k, v)
-            self.ctx = pl.SQLContext(register_globals=True, eager=True, frames=polars)
         elif s.startswith("q)"):  # A few Easter eggs
             while s.startswith("q)"):
                 s = s[2:]
@@ -130,51 +305,224 @@ class QueryProcessor:
 
         return r
 
-    def query(self, sql) -> DataFrame:
-        return self.to_pdf(self.queryraw(sql))
+    def _duckdb_query(self, s: str, db: duckdb.DuckDBPyConnection, profile: QueryProfile):
+        cache = self.result_cache
+        key = cache.key("dk", s) if cache is not None else None
+        if key is not None:
+            with profile.phase("cache"):
+                hit = cache.get(key)
+                if hit is not None:
+                    profile.add_frame(hit)
+                    return hit
+                generation = cache.generation
+                with self.lock.read():
+                    tables = read_tables(s, db, self.frames.frames)
+            if tables is None:
+                key = None
+        try:
+            with self.lock.read():
+                with profile.phase("register"):
+                    self.frames.refresh(db)
+                # Statements other than queries also execute here
+                with profile.phase("plan"):
+                    r = db.sql(s)
+        finally:
+            if DDL_PATTERN.search(s):
+                self.ddl_generation += 1
+            if cache is not None and not READ_PATTERN.match(s):
+                cache.clear()
+        if r is None:
+            return None
+        if key is not None:
+            return CachingRelation(cache, key, tables, r, generation, profile)
+        return LazyResult(r, profile)
+
+    def _polars_query(self, s: str, profile: QueryProfile):
+        if self.lazy_polars:
+            with self.lock.read(), profile.phase("plan"):
+                return LazyFrameResult(self.ctx.execute(s), profile)
+        cache = self.result_cache
+        key = cache.key("pl", s) if cache is not None else None
+        hit = None
+        if key is not None:
+            with profile.phase("cache"):
+                hit = cache.get(key)
+        if hit is None:
+            generation = cache.generation if key is not None else None
+            with self.lock.read(), profile.phase("execute"):
+                hit = self.ctx.execute(s, eager=True)
+            if key is not None:
+                cache.put(key, [ANY_FRAME], hit, generation)
+        profile.add_frame(hit)
+        return hit
+
+    def query(self, sql, db: duckdb.DuckDBPyConnection = None, profile: QueryProfile = None,
+              limit: int = None) -> DataFrame:
+        """The result of sql as a DataFrame, of at most limit rows, only those are computed for dk> statements."""
+        if profile is None:
+            with self.profiler.run(sql, "python") as profile:
+                return self.query(sql, db, profile, limit)
+        governor = self.governor
+        with governor.deadline(db or self.cursor()):
+            r = self.queryraw(sql, db, profile=profile)
+            if limit is not None and isinstance(r, LazyResult):
+                r = r.limit(limit)
+            with profile.phase("to_pdf"):
+                df = r.pl(governor.max_result_bytes) if isinstance(r, LazyResult) else self.to_pdf(r)
+        return df if limit is None else df.head(limit)
+
+    def query_reader(self, sql, db: duckdb.DuckDBPyConnection = None, batch_size: int = 10000,
+                     profile: QueryProfile = None, limit: int = None, offset: int = 0) -> pa.RecordBatchReader:
+        """
+        Run sql and stream the result as Arrow record batches of at most batch_size rows.
+
+        Only limit rows from offset on are streamed if limit is given, for dk> statements and lazy
+        pl> queries only those are computed.
+        A given profile is left for the caller to end, one of its own ends with the reader.
+        """
+        own = profile is None
+        if own:
+            profile = self.profiler.begin(sql, "python")
+        try:
+            reader = self._query_reader(sql, db, batch_size, profile, limit, offset)
+        except BaseException as e:
+            if own:
+                self.profiler.end(profile, e)
+            raise
+        return self.profiler.stream(reader, profile, end=own)
+
+    def _query_reader(self, sql, db: duckdb.DuckDBPyConnection, batch_size: int, profile: QueryProfile,
+                      limit: int = None, offset: int = 0) -> pa.RecordBatchReader:
+        r = self.queryraw(sql, db, profile=profile)
+        if isinstance(r, LazyResult):
+            if limit is not None:
+                r = r.limit(limit, offset)
+            return r.fetch_arrow_reader(batch_size)
+        with profile.phase("to_pdf"):
+            df = self.to_pdf(r)
+            if limit is not None:
+                df = df.slice(offset, limit)
+        with profile.phase("to_arrow"):
+            # Arrow has no equivalent of polars Object columns, send their string form
+            objs = [pl.Series(c, [None if v is None else str(v) for v in df.get_column(c)], dtype=pl.String)
+                    for c, t in df.schema.items() if t == pl.Object]
+            if objs:
+                df = df.with_columns(objs)
+            return df.to_arrow().to_reader(max_chunksize=batch_size)
+
+    def is_read(self, sql: str) -> bool:
+        """Whether sql is one dk> or pl> query that only reads, so running it again changes nothing."""
+        s = sql.strip()
+        if s.startswith(("pythondb.", "pdb.", "q)")):
+            return False
+        lang = self.query_lang
+        if len(s) >= 3 and s[2] == ">":
+            lang = s[:2]
+            while s.startswith(lang + ">"):
+                s = s[3:]
+        s = s.strip().rstrip(";")
+        return lang in ("dk", "pl") and READ_PATTERN.match(s) is not None and ";" not in s
+
+    def native_sql(self, sql: str) -> Optional[str]:
+        """The DuckDB text of sql if it is a dk> statement, else None."""
+        s = sql.strip()
+        if s.startswith("dk>"):
+            while s.startswith("dk>"):
+                s = s[3:]
+            return s
+        elif self.query_lang == "dk" and not s.startswith(("pythondb.", "pdb.", "q)")) and (len(s) < 3 or s[2] != ">"):
+            return s
+        return None
+
+    def prepare(self, stmt: NativeStatement, db: duckdb.DuckDBPyConnection) -> None:
+        """Prepare a dk> statement on db, once the frames it may read are registered there."""
+        with self.lock.read():
+            self.frames.refresh(db)
+        stmt.prepare(db)
+
+    def execute_prepared(self, stmt: NativeStatement, params: Sequence[Any], db: duckdb.DuckDBPyConnection,
+                         batch_size: int = 10000, profile: QueryProfile = None) -> pa.RecordBatchReader:
+        """
+        Execute a prepared dk> statement on db and stream its result, bypassing the result cache.
+
+        A given profile is left for the caller to end, one of its own ends with the reader.
+        """
+        own = profile is None
+        if own:
+            profile = self.profiler.begin(stmt.sql, "python")
+        profile.lang = "dk"
+        try:
+            with self.lock.read(), profile.phase("register"):
+                self.frames.refresh(db)
+            with profile.phase("execute"):
+                reader = stmt.execute(db, params, batch_size)
+        except BaseException as e:
+            if own:
+                self.profiler.end(profile, e)
+            raise
+        finally:
+            if DDL_PATTERN.search(stmt.sql):
+                self.ddl_generation += 1
+            if self.result_cache is not None and not READ_PATTERN.match(stmt.sql):
+                self.result_cache.clear()
+        return self.profiler.stream(reader, profile, end=own)
 
     @staticmethod
     def to_pdf(obj) -> DataFrame:
-        if isinstance(obj, pl.DataFrame):
-            return obj
-        elif isinstance(obj, bool):
-            return pl.DataFrame({"bool": [obj]})
-        elif isinstance(obj, int):
-            return pl.DataFrame({"int": [obj]})
-        elif isinstance(obj, float):
-            return pl.DataFrame({"float": [obj]})
-        elif isinstance(obj, complex):
-            return pl.DataFrame({"complex": [obj]})
-        elif isinstance(obj, str):
-            return pl.DataFrame({"str": [obj]})
-        elif isinstance(obj, list):
-            return pl.DataFrame({"list": obj})
-        elif isinstance(obj, tuple):
-            return pl.DataFrame({"tuple": [obj]})
-        elif isinstance(obj, range):
-            return pl.DataFrame({"range": [obj]})
-        elif isinstance(obj, dict):
-            return pl.from_dict(obj)
-        elif isinstance(obj, set):
-            return pl.DataFrame({"set": list(obj)})
-        elif isinstance(obj, duckdb.DuckDBPyRelation):
-            return obj.pl()
-        if isinstance(obj, pd.DataFrame):
-            return pl.from_pandas(obj)
-        elif obj is None:
-            return pl.DataFrame({"None": []})
-        print(obj)
-        return pl.DataFrame({"unrecognised": type(obj)})
-
-    def load_files(self, source_files:list[str]) -> None:
-        original_lang = self.getlang()
-        for srcp in source_files:
-            if self.verbose:
-                print("Loading file: " + srcp)
-            txt = Path(srcp).read_text()
-            p = srcp.lower()
-            if p.endswith(".sql") and original_lang == 'py':
-                self.setlang("dk")
-            elif p.endswith(".py"):
-                self.setlang("py")
-            self.queryraw(txt)
+        """obj as a polars DataFrame, see converters.Converters for how each type is converted."""
+        return CONVERTERS.convert(obj)
+
+    @staticmethod
+    def register_converter(cls, converter: Callable[[Any], DataFrame]) -> None:
+        """Convert results of type cls, a class or "module.QualName", and its subclasses with converter(obj)."""
+        CONVERTERS.register(cls, converter)
+
+    def bind(self, name: str, value: Any) -> None:
+        """Assign a python variable as py> code would, registering it if it is a dataframe."""
+        self._bind_all({name: value})
+
+    def _bind_all(self, values: dict, tables: dict = None) -> None:
+        with self.lock.write():
+            self.mylocals.update(values)
+            changed = self.frames.sync(self.mylocals, tables=tables)
+            if self.result_cache is not None:
+                self.result_cache.invalidate(changed)
+
+    def snapshot(self, path: str) -> list[str]:
+        """
+        Save every registered polars and pandas frame as Arrow IPC files in directory path, see restore.
+
+        Returns:
+            The names of the frames saved.
+        """
+        with self.lock.read():
+            return write_snapshot({k: v for k, (v, _) in self.frames.frames.items()}, path)
+
+    def restore(self, path: str) -> list[str]:
+        """
+        Bind the frames saved by snapshot to their names again.
+
+        The files are memory mapped rather than read, so restoring is near instant whatever their
+        size, data is paged in as queries touch it and processes restoring the same snapshot share
+        those pages.
+
+        Returns:
+            The names of the frames restored.
+        """
+        frames, tables = read_snapshot(path)
+        # DuckDB scans the mapped tables, converting the polars frames would copy their strings
+        self._bind_all(frames, tables)
+        return list(frames)
+
+    def load_files(self, source_files: list[str], jobs: int = None, materialize: bool = False,
+                   progress: bool = False) -> None:
+        """
+        Load data files and run scripts, see loader.Source for what each path may be.
+
+        Args:
+            source_files: paths, globs or name=path of data files and .sql/.py scripts
+            jobs: most files loading at once
+            materialize: load data files into tables rather than views over the files
+            progress: print a line as each file finishes
+        """
+        Loader(self, jobs, materialize, print_progress if progress else None).load(source_files)
@@ -1,20 +1,91 @@
-import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import base64
+import io
 import json
+import re
+import threading
+import time
 from polars import DataFrame, Int32, Int64
 import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
 import urllib.parse
 import typing
-import tempfile
-import sys
 
 from src.mypythondb.queryprocessor import QueryProcessor
+from src.mypythondb.assets import Asset, AssetTable, asset_roots
+from src.mypythondb.cursors import CursorStore
+from src.mypythondb.governor import ResultTooLarge, ServerBusy
+from src.mypythondb.profiler import QueryProfile
+from src.mypythondb.result import read_all
 
 
-def start_web(query_processor: QueryProcessor, port: int):
-    handler = partial(QWebServ, query_processor)
-    httpd = HTTPServer(('localhost', port), handler)
+class QueryPool(ThreadPoolExecutor):
+    """
+    Worker threads that each run their queries on their own DuckDB cursor.
+
+    Tasks run under the query processor's governor: beyond the workers at most its queue_size
+    tasks wait, further ones and those that waited longer than its queue_timeout fail with
+    ServerBusy, and each task's cursor is interrupted once it ran for max_execution_time.
+    """
+
+    def __init__(self, query_processor: QueryProcessor, workers: int):
+        self.local = threading.local()
+        self.query_processor = query_processor
+        self.workers = workers
+        # Tasks submitted and not yet done
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        super().__init__(max_workers=workers, thread_name_prefix="pythondb-web",
+                         initializer=self._init_worker, initargs=(query_processor,))
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        governor = self.query_processor.governor
+        with self._pending_lock:
+            if self.pending >= self.workers + governor.queue_size:
+                raise ServerBusy("Server busy: " + str(self.pending) + " queries running or waiting")
+            self.pending += 1
+        try:
+            future = super().submit(self._governed, time.monotonic(), fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: typing.Optional[Future]):
+        with self._pending_lock:
+            self.pending -= 1
+
+    def _governed(self, submitted: float, fn, *args, **kwargs):
+        governor = self.query_processor.governor
+        waited = time.monotonic() - submitted
+        if governor.queue_timeout and waited > governor.queue_timeout:
+            raise ServerBusy("Server busy: no worker became free within %gs" % governor.queue_timeout)
+        with governor.deadline(self.cursor):
+            return fn(*args, **kwargs)
+
+    def _init_worker(self, query_processor: QueryProcessor):
+        self.local.cursor = query_processor.duckdb.cursor()
+        query_processor.frames.attach(self.local.cursor)
+
+    @property
+    def cursor(self):
+        """Cursor of the calling worker thread."""
+        return self.local.cursor
+
+
+def start_web(query_processor: QueryProcessor, port: int, workers: int = 4):
+    # Every connection gets a thread so static assets never queue behind a query,
+    # queries themselves are bounded by the worker pool.
+    pool = QueryPool(query_processor, workers)
+    assets = AssetTable(asset_roots(), QWebServ.content_type)
+    handler = partial(QWebServ, query_processor, pool, assets, CursorStore())
+    httpd = ThreadingHTTPServer(('localhost', port), handler)
+    httpd.daemon_threads = True
     httpd.serve_forever()
 
 
@@ -33,9 +104,266 @@ def to_dashtype(pltype: pl.DataType) -> str:
     return "string"
 
 
+class Page:
+    """
+    Iterates the batches holding rows offset to offset+limit of a streamed result.
+
+    Once exhausted ``more`` tells whether the result has rows beyond the page.
+    """
+
+    def __init__(self, reader: pa.RecordBatchReader, offset: int, limit: int):
+        self.reader = reader
+        self.offset = offset
+        self.limit = limit
+        self.more = False
+
+    def __iter__(self) -> typing.Iterator[pa.RecordBatch]:
+        skip, left = self.offset, self.limit
+        for b in self.reader:
+            if skip:
+                n = min(skip, b.num_rows)
+                b = b.slice(n)
+                skip -= n
+            if b.num_rows == 0:
+                continue
+            if left == 0 or b.num_rows > left:
+                self.more = True
+                b = b.slice(0, left)
+            left -= b.num_rows
+            if b.num_rows:
+                yield b
+            if self.more:
+                return
+
+
+def encode_token(qry: str, offset: int) -> str:
+    """Continuation token fetching the rows of qry from offset on."""
+    return base64.urlsafe_b64encode(json.dumps({"query": qry, "offset": offset}).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token: str) -> typing.Tuple[str, int]:
+    d = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    return d["query"], int(d["offset"])
+
+
+def dashtypes(schema: pa.Schema) -> dict:
+    df = pl.from_arrow(schema.empty_table())
+    return {c: to_dashtype(t) for c, t in zip(df.columns, df.dtypes)}
+
+
+def json_chunks(batches: typing.Iterable[pa.RecordBatch], schema: pa.Schema, orient: str = "rows",
+                trailer: typing.Callable[[], dict] = None) -> typing.Iterator[bytes]:
+    """
+    Encode a result as {"tbl":{"data":..., "types":...}} one piece at a time.
+
+    Args:
+        batches: the rows to encode
+        schema: schema of batches
+        orient: "rows" for a list of row objects, encoded and sent batch by batch, or
+            "columns" for an object of column arrays, which holds all batches in memory
+        trailer: called after the data is sent, its keys are added to the outer object
+    """
+    yield b'{"tbl":{"data":'
+    if orient == "columns":
+        df = pl.from_arrow(pa.Table.from_batches(list(batches), schema))
+        yield b'{'
+        for i, c in enumerate(df.columns):
+            buf = io.BytesIO()
+            df.select(pl.col(c).implode()).write_json(buf)
+            # [{"c":[...]}] -> "c":[...]
+            yield (b',' if i else b'') + buf.getvalue()[2:-2]
+        yield b'}'
+    else:
+        yield b'['
+        for i, b in enumerate(batches):
+            buf = io.BytesIO()
+            pl.from_arrow(b).write_json(buf)
+            yield (b',' if i else b'') + buf.getvalue()[1:-1]
+        yield b']'
+    yield b', "types":' + bytes(json.dumps(dashtypes(schema)), 'utf-8') + b'}'
+    for k, v in (trailer() if trailer else {}).items():
+        yield b', ' + bytes(json.dumps(k), 'utf-8') + b':' + bytes(json.dumps(v), 'utf-8')
+    yield b'}'
+
+
+def csv_chunks(batches: typing.Iterable[pa.RecordBatch], schema: pa.Schema) -> typing.Iterator[bytes]:
+    """Encode a result as CSV, one batch at a time."""
+    header = True
+    for b in batches:
+        yield pl.from_arrow(b).write_csv(include_header=header).encode('utf-8')
+        header = False
+    if header:
+        yield pl.from_arrow(schema.empty_table()).write_csv().encode('utf-8')
+
+
+class ChunkSink:
+    """
+    Write-only file collecting what an Arrow writer writes, for sending as response chunks.
+
+    Writes smaller than ``coalesce`` bytes are copied together, larger ones (column buffers) are
+    kept as references to the Arrow memory so they are sent without copying.
+    """
+    coalesce = 64 * 1024
+    closed = False
+
+    def __init__(self):
+        self.pieces = []
+        self.small = bytearray()
+        self.pos = 0
+
+    def write(self, data) -> int:
+        n = len(data)
+        if n < self.coalesce:
+            self.small += data
+        else:
+            self._flush_small()
+            self.pieces.append(data)
+        self.pos += n
+        return n
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def _flush_small(self):
+        if self.small:
+            self.pieces.append(bytes(self.small))
+            self.small.clear()
+
+    def take(self) -> list:
+        """Everything written since the last take."""
+        self._flush_small()
+        pieces, self.pieces = self.pieces, []
+        return pieces
+
+
+def arrow_chunks(batches: typing.Iterable[pa.RecordBatch], schema: pa.Schema) -> typing.Iterator:
+    """Encode a result in the Arrow IPC streaming format, one batch at a time."""
+    sink = ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield from sink.take()
+        for b in batches:
+            writer.write_batch(b)
+            yield from sink.take()
+    yield from sink.take()
+
+
+def parquet_chunks(batches: typing.Iterable[pa.RecordBatch], schema: pa.Schema) -> typing.Iterator:
+    """Encode a result as a Parquet file, each batch becomes a row group."""
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for b in batches:
+            writer.write_batch(b)
+            yield from sink.take()
+    yield from sink.take()
+
+
+def write_xlsx(file: typing.BinaryIO, batches: typing.Iterable[pa.RecordBatch], schema: pa.Schema,
+               max_rows: int) -> int:
+    """
+    Write a result as an xlsx workbook with a single sheet.
+
+    Rows are written in order with xlsxwriter's constant_memory mode, so only the current row is
+    held in memory rather than every cell of the sheet.
+
+    Args:
+        file: where the workbook is written
+        batches: the rows to write
+        schema: schema of batches
+        max_rows: rows after the first max_rows are left out
+    Returns:
+        The number of rows written.
+    """
+    wb = xlsxwriter.Workbook(file, {'constant_memory': True, 'nan_inf_to_errors': True, 'remove_timezone': True,
+                                    'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    ws = wb.add_worksheet()
+    ws.write_row(0, 0, schema.names, wb.add_format({'bold': True}))
+    # lists, structs and other values Excel has no type for are written as text
+    as_text = [i for i, f in enumerate(schema)
+               if pa.types.is_nested(f.type) or pa.types.is_binary(f.type) or pa.types.is_interval(f.type)]
+    r = 0
+    for b in batches:
+        if r >= max_rows:
+            break
+        b = b.slice(0, max_rows - r)
+        for row in zip(*[c.to_pylist() for c in b.columns]):
+            r += 1
+            if as_text:
+                row = list(row)
+                for i in as_text:
+                    row[i] = None if row[i] is None else str(row[i])
+            ws.write_row(r, 0, row)
+    wb.close()
+    return r
+
+
+# Other names clients send for an offered MIME type
+MIME_ALIASES = {"text/csv": "text/comma-separated-values", "application/csv": "text/comma-separated-values"}
+
+
+def negotiate(accept: typing.Optional[str], offered: typing.Dict[str, str], default: str) -> str:
+    """
+    Pick the format of a response from an Accept header.
+
+    Args:
+        accept: value of the Accept header, may be None
+        offered: format -> MIME type of every format available
+        default: format used if the client accepts anything or nothing offered
+    """
+    best, best_q = default, 0.0
+    for i, item in enumerate((accept or "").split(",")):
+        mime, *params = [x.strip() for x in item.split(";")]
+        mime = MIME_ALIASES.get(mime.lower(), mime)
+        q = 1.0
+        for prm in params:
+            if prm.startswith("q="):
+                try:
+                    q = float(prm[2:])
+                except ValueError:
+                    q = 0.0
+        # Earlier entries win ties
+        q -= i * 1e-6
+        for fmt, m in offered.items():
+            if mime == m and q > best_q:
+                best, best_q = fmt, q
+    return best
+
+
 class QWebServ(BaseHTTPRequestHandler):
-    def __init__(self, query_processor: QueryProcessor, *args, **kwargs):
+    # Keep-alive, every response must carry a Content-Length
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle delay the body on a reused connection
+    disable_nagle_algorithm = True
+
+    # Most rows returned by one JSON response, further rows are fetched with the continuation token
+    max_rows = 100000
+    # Rows read from the result and encoded per chunk
+    batch_size = 10000
+    # Rows per Parquet row group, DuckDB's own row group size
+    row_group_size = 122880
+    # Query result formats a POST may ask for in its Accept header
+    result_formats = ("json", "arrow", "parquet", "csv")
+    # Most rows written to an Excel download, Excel's own limit is 1048576 including the header
+    xls_max_rows = 1048575
+    # Result downloads, /file.{format}?{query}
+    download_pattern = re.compile(r"^/(file|t)\.(csv|xls|arrow|parquet)\?")
+    # Most rows rendered by the /?]{query} HTML view
+    html_rows = 1000
+    # Most profiles listed by /api/queries
+    max_profiles = 200
+    # Windows of a server side cursor, /api/cursor/{id}?offset=&limit=&sort=&desc=
+    cursor_pattern = re.compile(r"^/api/cursor/([A-Za-z0-9_-]+)(\?|$)")
+    # Seconds a client turned away with 503 is asked to wait before retrying
+    retry_after = 1
+
+    def __init__(self, query_processor: QueryProcessor, pool: QueryPool, assets: AssetTable, cursors: CursorStore,
+                 *args, **kwargs):
         self.query_processor = query_processor
+        self.pool = pool
+        self.assets = assets
+        self.cursors = cursors
         # BaseHTTPRequestHandler calls do_GET **inside** __init__ !!!
         # So we have to call super().__init__ after setting attributes.
         super().__init__(*args, **kwargs)
@@ -45,68 +373,288 @@ class QWebServ(BaseHTTPRequestHandler):
         "css": "text/css",
         "js": "text/javascript",
         "plain": "text/plain",
-        "xls": "application/vnd.ms-excel",
+        "xls": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         "csv": "text/comma-separated-values",
         "json": "application/json",
+        "arrow": "application/vnd.apache.arrow.stream",
+        "parquet": "application/vnd.apache.parquet",
         "ico": "image/x-icon",
-        "png": "image/png"
+        "png": "image/png",
+        "jpg": "image/jpeg",
+        "svg": "image/svg+xml",
+        "txt": "text/plain",
+        "map": "application/json",
+        "woff": "font/woff",
+        "woff2": "font/woff2",
+        "ttf": "font/ttf",
+        "eot": "application/vnd.ms-fontobject"
     }
 
-    def set_content_type(self):
-        extension = self.path.split(".")[-1]
-        if extension in self.extensions:
-            return self.extensions[extension]
-        return self.extensions["html"]
+    @staticmethod
+    def content_type(path: str) -> str:
+        extension = path.split(".")[-1]
+        if extension in QWebServ.extensions:
+            return QWebServ.extensions[extension]
+        return QWebServ.extensions["html"]
 
-    def query(self, qr: str) -> pl.DataFrame:
+    def query(self, qr: str, profile: QueryProfile = None, limit: int = None) -> pl.DataFrame:
         qry = urllib.parse.unquote(qr)
-        return self.query_processor.query(qry)
+        return self.query_processor.query(qry, self.pool.cursor, profile, limit)
+
+    def run_query(self, qr: str, encode: typing.Callable[[pl.DataFrame], bytes], limit: int = None) -> bytes:
+        """Run the query and encode at most limit rows of its result on the query worker pool."""
+        def run():
+            df = self.query(qr, profile, limit)
+            with profile.phase("encode"):
+                return encode(df)
+
+        with self.query_processor.profiler.run(urllib.parse.unquote(qr), "web") as profile:
+            return self.pool.submit(run).result()
+
+    def reader(self, qry: str, batch_size: int = None, profile: QueryProfile = None, limit: int = None,
+               offset: int = 0) -> pa.RecordBatchReader:
+        """Stream the result of an unquoted query, must be called on a query worker."""
+        return self.query_processor.query_reader(qry, self.pool.cursor, batch_size or self.batch_size, profile,
+                                                 limit, offset)
+
+    def send_chunked(self, chunks: typing.Iterable[bytes], content_type: str, headers: dict,
+                     profile: QueryProfile):
+        """
+        Send chunks with chunked transfer encoding.
+
+        The first chunk is produced before the headers are sent, so a failing query still results in
+        an error status. Later failures can only abort the response, the connection is then closed.
+        The time spent producing and sending chunks is counted on profile, which is ended once done.
+        """
+        end = self.query_processor.profiler.end
+        it = iter(chunks)
+        try:
+            with profile.phase("encode"):
+                first = next(it, b'')
+        except Exception as e:
+            end(profile, e)
+            raise
+        self.set_headers()
+        self.send_header("Content-type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command == "HEAD":
+            if hasattr(it, "close"):
+                it.close()
+            end(profile, None)
+            return
+        c, error = first, None
+        try:
+            while c is not None:
+                n = len(c)
+                with profile.phase("send"):
+                    if n >= ChunkSink.coalesce:
+                        # Large Arrow buffers are written as they are rather than copied into the chunk
+                        self.wfile.write(b'%x\r\n' % n)
+                        self.wfile.write(memoryview(c))
+                        self.wfile.write(b'\r\n')
+                    elif n:
+                        self.wfile.write(b'%x\r\n' % n + bytes(c) + b'\r\n')
+                with profile.phase("encode"):
+                    c = next(it, None)
+            with profile.phase("send"):
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            print(e)
+            error = e
+            self.close_connection = True
+        finally:
+            end(profile, error)
+
+    def stream_json(self, qry: str, orient: str = "rows", limit: int = None, offset: int = 0):
+        """
+        Send at most limit rows of the result from offset on, with a continuation token if more remain.
+
+        The query runs again for each page, with the page's rows pushed down into it, so tokens are
+        only given for read only dk> and pl> queries. Other results beyond limit are marked truncated.
+        """
+        limit = self.max_rows if limit is None else min(limit, self.max_rows)
+        profile = self.query_processor.profiler.begin(qry, "web")
+        pageable = self.query_processor.is_read(qry)
+
+        def chunks():
+            # One row beyond the page tells whether more remain
+            reader = self.reader(qry, profile=profile, limit=limit + 1 if pageable else None, offset=offset)
+            page = Page(reader, 0, limit)
+            trailer = lambda: {"next": encode_token(qry, offset + limit) if page.more and pageable else None,
+                               "truncated": page.more and not pageable}
+            yield from json_chunks(page, reader.schema, orient, trailer)
+
+        self.send_chunked(chunks(), self.extensions['json'], {"Vary": "Accept"}, profile)
+
+    def stream_result(self, qry: str, fmt: str, headers: dict = None):
+        """Send the whole result of qry as csv, arrow or parquet."""
+        encode = {"csv": csv_chunks, "arrow": arrow_chunks, "parquet": parquet_chunks}[fmt]
+        batch_size = self.row_group_size if fmt == "parquet" else None
+        profile = self.query_processor.profiler.begin(qry, "web")
+
+        def chunks():
+            reader = self.reader(qry, batch_size, profile)
+            yield from encode(reader, reader.schema)
+
+        self.send_chunked(chunks(), self.extensions[fmt], headers, profile)
+
+    def send_queries(self, params: dict):
+        """Send the recent and the slow query profiles as JSON, at most ?limit= of each."""
+        limit = min(int(params.get("limit", [self.max_profiles])[0]), self.max_profiles)
+        profiler = self.query_processor.profiler
+        body = {"recent": [p.to_dict() for p in profiler.queries()[:limit]],
+                "slow": [p.to_dict() for p in profiler.queries(slow=True)[:limit]],
+                "slow_threshold_ms": profiler.slow_threshold * 1000}
+        self.send_body(json.dumps(body).encode(), self.extensions['json'], headers={"Cache-Control": "no-store"})
+
+    def send_workers(self):
+        """Send the health and query counts of each MySQL replica process as JSON, 404 without replicas."""
+        replicas = self.query_processor.replicas
+        if replicas is None:
+            self.send_body(b"Not serving MySQL from replicas", self.extensions['plain'], 404)
+            return
+        self.send_body(json.dumps({"workers": replicas.health()}).encode(), self.extensions['json'],
+                       headers={"Cache-Control": "no-store"})
 
-    def set_headers(self):
-        self.send_response(200)
+    def open_cursor(self, qry: str):
+        """Run qry once and hold its result as a cursor, replying with the cursor's id, row count and types."""
+        # Read no further than the store or the governor allows, rather than all of it before checking
+        max_bytes = self.cursors.max_bytes
+        if self.query_processor.governor.max_result_bytes:
+            max_bytes = min(max_bytes, self.query_processor.governor.max_result_bytes)
+
+        def run():
+            with self.query_processor.profiler.run(qry, "web") as profile:
+                tbl = read_all(self.reader(qry, profile=profile), max_bytes)
+            return self.cursors.open(qry, tbl)
+
+        try:
+            cursor = self.pool.submit(run).result()
+        except ResultTooLarge as e:
+            self.send_error(413, str(e))
+            return
+        body = {"cursor": cursor.cursor_id, "rows": cursor.num_rows, "columns": cursor.table.column_names,
+                "types": dashtypes(cursor.table.schema), "ttl": self.cursors.ttl}
+        self.send_body(json.dumps(body).encode(), self.extensions['json'])
+
+    def send_window(self, cursor_id: str, params: dict):
+        """Send ?limit= rows of a cursor from ?offset= on, sorted on ?sort= (descending if ?desc=1) if given."""
+        cursor = self.cursors.get(cursor_id)
+        if cursor is None:
+            self.send_error(404, "No such cursor, it may have expired")
+            return
+        arg = lambda k, default: params.get(k, [default])[0]
+        try:
+            offset, limit = int(arg("offset", 0)), min(int(arg("limit", self.batch_size)), self.max_rows)
+        except ValueError:
+            self.send_error(400, "offset and limit must be integers")
+            return
+        if offset < 0 or limit < 0:
+            self.send_error(400, "offset and limit must not be negative")
+            return
+        try:
+            window = cursor.window(offset, limit, arg("sort", None), arg("desc", "0") in ("1", "true"))
+        except KeyError as e:
+            self.send_error(400, "Unknown sort column " + str(e))
+            return
+        trailer = lambda: {"offset": offset, "rows": cursor.num_rows}
+        body = b''.join(json_chunks(window.to_batches(), window.schema, arg("orient", "rows"), trailer))
+        self.send_body(body, self.extensions['json'])
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200, headers: dict = None):
+        self.set_headers(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_asset(self, asset: Asset):
+        """Send a static file, compressed if the client accepts it, or 304 if the client's copy is current."""
+        headers = {"ETag": asset.etag, "Last-Modified": asset.last_modified, "Cache-Control": asset.cache_control}
+        if asset.encoded:
+            headers["Vary"] = "Accept-Encoding"
+        if asset.not_modified(self.headers['If-None-Match'], self.headers['If-Modified-Since']):
+            self.set_headers(304)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            return
+        encoding, body = asset.negotiate(self.headers['Accept-Encoding'])
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        self.send_body(body, asset.content_type, headers=headers)
+
+    def send_busy(self, e: ServerBusy):
+        """503 asking the client to retry once the queries ahead of it are done."""
+        self.send_response(503, str(e))
+        self.send_header("Retry-After", str(self.retry_after))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def set_headers(self, status: int = 200):
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         self.send_header('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         self.send_header("Access-Control-Allow-Headers", "X-Requested-With")
 
     @staticmethod
-    def write_json(file:typing.BinaryIO, df:DataFrame):
-        file.write(b'{"tbl":{"data":')
-        df.write_json(file, row_oriented=True)
-        ptypes = {}
-        idx = 0
-        for c in df.columns:
-            ptypes[c] = to_dashtype(df.dtypes[idx])
-            idx = idx + 1
-        file.write(b', "types":')
-        file.write(bytes(json.dumps(ptypes), 'utf-8'))
-        file.write(b'}}')
+    def write_json(file:typing.BinaryIO, df:DataFrame, orient: str = "rows"):
+        tbl = df.to_arrow()
+        for c in json_chunks(tbl.to_batches(), tbl.schema, orient):
+            file.write(c)
 
     def do_POST(self):
         try:
             print("POST: ", self.path)
-            self.set_headers()
-            self.send_header('Content-type', self.extensions['json'])
-            self.end_headers()
-            # r = self.query(self.path)
             data_string = self.rfile.read(int(self.headers['Content-Length']))
+            jsdict = {}
             if self.headers['Content-type'] == self.extensions['json']:
                 jsdict = json.loads(data_string)
-                qry = jsdict['query']
+                qry = jsdict.get('query')
+            else:
+                qry = data_string.decode('utf-8')
+            if self.path == '/api/cursor':
+                self.open_cursor(urllib.parse.unquote(qry))
+                return
+            offset = 0
+            if jsdict.get('next'):
+                qry, offset = decode_token(jsdict['next'])
+                if not self.query_processor.is_read(qry):
+                    self.send_error(400, "Continuation tokens are only valid for read only dk> and pl> queries")
+                    return
             else:
-                qry = data_string
-            r = self.query(qry)
-            print(r)
-            self.write_json(self.wfile, r)
+                qry = urllib.parse.unquote(qry)
+            fmt = negotiate(self.headers['Accept'], {f: self.extensions[f] for f in self.result_formats}, "json")
+            if fmt == "json":
+                self.pool.submit(self.stream_json, qry, jsdict.get('orient', 'rows'), jsdict.get('limit'), offset).result()
+            else:
+                self.pool.submit(self.stream_result, qry, fmt, {"Vary": "Accept"}).result()
+        except ServerBusy as e:
+            self.send_busy(e)
         except Exception as e:
             print(e)
-            self.send_response(500)
+            self.send_error(500, str(e))
+
+    def do_DELETE(self):
+        cursor = self.cursor_pattern.match(self.path)
+        if cursor is None or not self.cursors.close(cursor.group(1)):
+            self.send_error(404)
+            return
+        self.send_body(b'{}', self.extensions['json'])
 
     def do_OPTIONS(self):
         # issue two requests, first one OPTIONS and then the GET request.
         # 501 Unsupported method ('OPTIONS')) caused by CORS and by requesting the "Content-Type: application/json; ...
         # To solve the error, I enabled CORS in do_OPTIONS and enabled clients to request a specific content type.
         self.set_headers()
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
     def do_GET(self):
@@ -116,74 +664,64 @@ class QWebServ(BaseHTTPRequestHandler):
             if self.path == '/' or self.path.startswith("/sqleditor"):
                 p = 'html/index.html'
 
+            download = self.download_pattern.match(self.path)
+            cursor = self.cursor_pattern.match(self.path)
             if self.path.startswith("/?]"):
-                r = self.query(self.path[3:])
-                self.wfile.write(bytes(r._repr_html_(), 'utf-8'))
-            elif (self.path.startswith("/file.csv?") or self.path.startswith("/t.csv?")
-                  or self.path.startswith("/file.xls?") or self.path.startswith("/t.xls?")):
-                p = self.path.index("?")
-                typ = self.path[p - 3:p]
-                r = self.query(self.path[p + 1:])
-                self.send_response(200)
-                self.send_header("Content-type", self.extensions[typ])
-                self.send_header("Content-Disposition", "attachment")
-                self.end_headers()
+                body = self.run_query(self.path[3:], lambda r: bytes(r._repr_html_(), 'utf-8'), self.html_rows)
+                self.send_body(body, self.extensions['html'])
+            elif download:
+                name, typ = download.groups()
+                qry = urllib.parse.unquote(self.path[download.end():])
                 if typ == "xls":
-                    with tempfile.NamedTemporaryFile(suffix="xlsx") as tmp:
-                        print(tmp.name)
-                        r.write_excel(tmp.name)
-                        self.wfile.write(bytes(open(tmp.name).read(), 'utf-8'))
+                    body = self.pool.submit(self.to_xls, qry).result()
+                    self.send_body(body, self.extensions[typ],
+                                   headers={"Content-Disposition": 'attachment; filename="' + name + '.xlsx"'})
                 else:
-                    r.write_csv(self.wfile)
+                    self.pool.submit(self.stream_result, qry, typ, {"Content-Disposition": "attachment"}).result()
             elif self.path == '/api/servertree':
-                self.set_headers()
-                self.send_header("Content-type", self.extensions['json'])
-                self.end_headers()
-                r = self.query("dk>show tables;")
-                s = "["
-                i = 0
-                for c in r.get_column("name"):
-                    # server: String, namespace: String, name: String, fullName: String, type: String, query: String,
-                    # Partial info: String.Or(Undefined), db: String.Or(Undefined), columns: String.Or(Undefined)
-                    s = s + (',' if i > 0 else '') + '{"server":"pythondb", "name":"' + c + '", "namespace":"", "fullName":"' + c + '", "type":"table", "query":"dk>SELECT * FROM ' + c + ' LIMIT 1000"}'
-                    i = i + 1
-                s = s + "]"
-                self.wfile.write(bytes(s, 'utf-8'))
+                self.send_body(self.run_query("dk>show tables;", self.to_servertree), self.extensions['json'])
+            elif self.path.split('?')[0] == '/api/queries':
+                self.send_queries(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
+            elif self.path.split('?')[0] == '/api/workers':
+                self.send_workers()
+            elif cursor:
+                self.send_window(cursor.group(1), urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
             else:
                 # Prefer {currrentDir}/  >  {bundledDir}/ > index
-                actual_path = p
-                if os.path.exists(p):
-                    actual_path = p
-                elif getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
-                    actual_path = os.path.join(sys._MEIPASS, p)
-                    if not os.path.exists(actual_path):
-                        actual_path = 'html/index.html'
-                else:
-                    actual_path = 'html/index.html'
-
-                is_binary = p.endswith(".ico") or p.endswith(".png")
-                try:
-                    if is_binary:
-                        file_to_open = open(actual_path, 'rb').read()
-                    else:
-                        enc = "utf8" if p.endswith(".css") else None
-                        file_to_open = open(actual_path, encoding=enc).read()
-
-                    self.set_headers()
-                    self.send_header("Content-type", self.set_content_type())
-                    if is_binary:
-                        self.send_header('Content-length', str(len(file_to_open)))
-                    self.send_response(200)
-                except Exception as e:
-                    print(e)
-                    file_to_open = "File not found"
-                    self.send_response(404)
-                self.end_headers()
-                if is_binary:
-                    self.wfile.write(file_to_open)
-                else:
-                    self.wfile.write(bytes(file_to_open, 'utf-8'))
+                asset = self.assets.get(urllib.parse.unquote(p[len('html'):].split('?')[0]))
+                if asset is None:
+                    asset = self.assets.get('index.html')
+                if asset is None:
+                    self.send_body(b"File not found", self.extensions['plain'], 404)
+                    return
+                self.send_asset(asset)
+        except ServerBusy as e:
+            self.send_busy(e)
         except Exception as e:
             print(e)
-            self.send_response(500)
+            self.send_error(500, str(e))
 
+    def do_HEAD(self):
+        """The headers GET would send, negotiated the same way, without the body."""
+        self.do_GET()
+
+    def to_xls(self, qry: str) -> bytes:
+        """The first xls_max_rows rows of the result as an xlsx workbook, must be called on a query worker."""
+        with self.query_processor.profiler.run(qry, "web") as profile:
+            reader = self.reader(qry, profile=profile)
+            buf = io.BytesIO()
+            with profile.phase("encode"):
+                write_xlsx(buf, reader, reader.schema, self.xls_max_rows)
+            return buf.getvalue()
+
+    @staticmethod
+    def to_servertree(r: DataFrame) -> bytes:
+        s = "["
+        i = 0
+        for c in r.get_column("name"):
+            # server: String, namespace: String, name: String, fullName: String, type: String, query: String,
+            # Partial info: String.Or(Undefined), db: String.Or(Undefined), columns: String.Or(Undefined)
+            s = s + (',' if i > 0 else '') + '{"server":"pythondb", "name":"' + c + '", "namespace":"", "fullName":"' + c + '", "type":"table", "query":"dk>SELECT * FROM ' + c + ' LIMIT 1000"}'
+            i = i + 1
+        s = s + "]"
+        return bytes(s, 'utf-8')
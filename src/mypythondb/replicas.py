@@ -0,0 +1,210 @@
+"""Read only replicas of the MySQL server, in worker processes sharing one listening socket."""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import socket
+import threading
+import time
+from typing import List, Optional
+
+import duckdb
+import polars as pl
+from mysql_mimic.control import LocalControl
+
+from .mysession import sql_server
+from .queryprocessor import QueryProcessor
+
+# Per worker slots of the shared stats array, in this order
+STATS = ("heartbeat", "connections", "queries", "errors", "rows", "seconds")
+
+
+class CountingControl(LocalControl):
+    """LocalControl that counts the open connections."""
+
+    def __init__(self, server_id: Optional[int] = None):
+        super().__init__(server_id)
+        self.open = 0
+
+    async def add(self, connection) -> int:
+        self.open += 1
+        return await super().add(connection)
+
+    async def remove(self, connection_id: int) -> None:
+        self.open -= 1
+        await super().remove(connection_id)
+
+
+def serve_replica(sock: socket.socket, index: int, stats, database: Optional[str], snapshot: Optional[str],
+                  language: Optional[str], sqlworkers: int, heartbeat_interval: float,
+                  limits: Optional[dict] = None) -> None:
+    """Worker process: serve MySQL connections accepted on sock from its own read only QueryProcessor."""
+    qp = QueryProcessor(db=duckdb.connect(database, read_only=True) if database else None)
+    if language:
+        qp.setlang(language)
+    if limits:
+        qp.limit_resources(**limits)
+    if snapshot:
+        qp.restore(snapshot)
+    base = index * len(STATS)
+
+    async def heartbeat(control: CountingControl) -> None:
+        # Beats from the event loop, so a worker whose loop is stuck stops beating
+        profiler = qp.profiler
+        while True:
+            stats[base:base + len(STATS)] = [time.time(), control.open, profiler.count,
+                                             profiler.errors, profiler.rows, profiler.seconds]
+            await asyncio.sleep(heartbeat_interval)
+
+    async def serve() -> None:
+        # Connection ids start with the server id, keeping them unique across workers
+        control = CountingControl(server_id=index + 1)
+        server = sql_server(qp, sqlworkers, control=control)
+        # port=None, MysqlServer otherwise adds its default port, which asyncio refuses alongside sock
+        await server.start_server(sock=sock, port=None)
+        beat = asyncio.create_task(heartbeat(control))
+        try:
+            await server.serve_forever()
+        finally:
+            beat.cancel()
+
+    asyncio.run(serve())
+
+
+class Supervisor:
+    """
+    Serves the MySQL port from worker processes that each answer queries independently.
+
+    Every worker opens the same DuckDB file read only and/or restores the same snapshot, memory
+    mapped so the workers share its pages, then accepts connections on a socket bound once by the
+    supervisor. MySQL encoding and parsing then scale with the number of workers rather than being
+    bound to the GIL of one process. Workers that exit or stop sending heartbeats are restarted.
+    Each connection stays on the worker that accepted it, KILL only reaches connections of the
+    worker it is sent to.
+
+    Args:
+        port: MySQL port to listen on
+        workers: number of worker processes
+        database: DuckDB file the workers open read only, in memory if None
+        snapshot: directory of a QueryProcessor.snapshot the workers restore
+        language: language the workers interpret queries as
+        sqlworkers: number of queries each worker may execute at once
+        host: address to listen on, all by default
+        limits: QueryProcessor.limit_resources arguments applied by each worker, a memory_limit per worker
+    """
+
+    # Seconds between the heartbeats of a worker
+    heartbeat_interval = 1.0
+    # Seconds without a heartbeat, after starting up, before a worker is considered hung and restarted
+    heartbeat_timeout = 30.0
+    # Seconds a new worker may take to restore its state and start serving
+    startup_timeout = 300.0
+    # Seconds between health checks of the workers
+    check_interval = 2.0
+
+    def __init__(self, port: int, workers: int, database: Optional[str] = None, snapshot: Optional[str] = None,
+                 language: Optional[str] = None, sqlworkers: int = 4, host: str = "", limits: Optional[dict] = None):
+        self.port = port
+        self.workers = workers
+        self.database = database
+        self.snapshot = snapshot
+        self.language = language
+        self.sqlworkers = sqlworkers
+        self.host = host
+        self.limits = limits
+        # Spawned rather than forked, DuckDB and the server threads of this process can't be forked safely
+        self._mp = multiprocessing.get_context("spawn")
+        self.stats = self._mp.Array("d", workers * len(STATS), lock=False)
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self.started = [0.0] * workers
+        self.restarts = [0] * workers
+        self.sock: Optional[socket.socket] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Bind the port, start the workers and the thread keeping them healthy."""
+        self.sock = socket.create_server((self.host, self.port), backlog=1024)
+        for i in range(self.workers):
+            self._spawn(i)
+        threading.Thread(target=self._monitor, name="pythondb-replicas", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._lock:
+            for p in self.processes:
+                if p is not None and p.is_alive():
+                    p.terminate()
+            for p in self.processes:
+                if p is not None:
+                    p.join(5)
+        if self.sock is not None:
+            self.sock.close()
+
+    def _spawn(self, i: int) -> None:
+        self.stats[i * len(STATS):(i + 1) * len(STATS)] = [0.0] * len(STATS)
+        p = self._mp.Process(target=serve_replica, name="pythondb-replica-" + str(i), daemon=True,
+                             args=(self.sock, i, self.stats, self.database, self.snapshot, self.language,
+                                   self.sqlworkers, self.heartbeat_interval, self.limits))
+        p.start()
+        self.processes[i] = p
+        self.started[i] = time.time()
+
+    def _healthy(self, i: int, now: float) -> bool:
+        p = self.processes[i]
+        if p is None or not p.is_alive():
+            return False
+        beat = self.stats[i * len(STATS)]
+        if beat == 0.0:
+            return now - self.started[i] < self.startup_timeout
+        return now - beat < self.heartbeat_timeout
+
+    def _monitor(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            now = time.time()
+            with self._lock:
+                if self._stop.is_set():
+                    return
+                for i in range(self.workers):
+                    if not self._healthy(i, now):
+                        p = self.processes[i]
+                        if p is not None and p.is_alive():
+                            p.kill()
+                            p.join(5)
+                        self.restarts[i] += 1
+                        self._spawn(i)
+
+    def health(self) -> List[dict]:
+        """Per worker state and counters, JSON serializable."""
+        now = time.time()
+        workers = []
+        with self._lock:
+            for i, p in enumerate(self.processes):
+                values = dict(zip(STATS, self.stats[i * len(STATS):(i + 1) * len(STATS)]))
+                beat = values.pop("heartbeat")
+                if p is None or not p.is_alive():
+                    status = "down"
+                elif beat == 0.0:
+                    status = "starting"
+                else:
+                    status = "up" if now - beat < self.heartbeat_timeout else "hung"
+                workers.append({
+                    "worker": i,
+                    "pid": p.pid if p is not None else None,
+                    "status": status,
+                    "heartbeat_age": round(now - beat, 3) if beat else None,
+                    "restarts": self.restarts[i],
+                    "connections": int(values["connections"]),
+                    "queries": int(values["queries"]),
+                    "errors": int(values["errors"]),
+                    "rows": int(values["rows"]),
+                    "query_seconds": round(values["seconds"], 3),
+                })
+        return workers
+
+    def to_frame(self) -> pl.DataFrame:
+        """health() as a DataFrame, one row per worker."""
+        return pl.from_dicts(self.health(), schema={"worker": pl.Int64, "pid": pl.Int64, "status": pl.String,
+                                                    "heartbeat_age": pl.Float64, "restarts": pl.Int64,
+                                                    "connections": pl.Int64, "queries": pl.Int64, "errors": pl.Int64,
+                                                    "rows": pl.Int64, "query_seconds": pl.Float64})
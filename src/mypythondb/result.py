@@ -0,0 +1,158 @@
+"""Results of dk> and lazy pl> statements that are only computed as far as their consumer reads them."""
+from __future__ import annotations
+
+from contextlib import nullcontext
+from typing import List, Optional
+
+import duckdb
+import polars as pl
+
+from .lazy import lazy_import
+from .governor import ResultTooLarge
+from .profiler import QueryProfile
+
+pa = lazy_import("pyarrow")
+
+
+def too_large(nbytes: int, max_bytes: int) -> None:
+    """Raise ResultTooLarge if nbytes exceeds max_bytes."""
+    if nbytes > max_bytes:
+        raise ResultTooLarge("Result of more than %d bytes is too large to hold, at most %d bytes" % (nbytes, max_bytes))
+
+
+def read_all(reader: pa.RecordBatchReader, max_bytes: int) -> pa.Table:
+    """Every batch of reader, raising ResultTooLarge as soon as more than max_bytes were read."""
+    batches = []
+    nbytes = 0
+    for b in reader:
+        nbytes += b.nbytes
+        too_large(nbytes, max_bytes)
+        batches.append(b)
+    return pa.Table.from_batches(batches, reader.schema)
+
+
+class LazyResult:
+    """
+    An unexecuted DuckDB relation, executed when and as far as its result is read.
+
+    The REPL prints a preview computed from its first rows, the web and MySQL servers stream it in
+    batches and only ``pl`` or ``arrow`` materialize the whole result. ``limit`` narrows it before
+    anything is executed, so previewing a large parquet file only reads the rows shown.
+
+    Args:
+        rel: relation of the statement
+        profile: profile the execution and conversion phases are counted on, if any
+    """
+
+    # Rows shown by repr and str
+    preview_rows = 10
+
+    def __init__(self, rel: duckdb.DuckDBPyRelation, profile: Optional[QueryProfile] = None):
+        self.rel = rel
+        self.profile = profile
+        # DuckDB keeps no result to read again once a relation was streamed
+        self._streamed = False
+
+    def _phase(self, name: str):
+        return self.profile.phase(name) if self.profile is not None else nullcontext()
+
+    @property
+    def columns(self) -> List[str]:
+        return self.rel.columns
+
+    def limit(self, n: int, offset: int = 0) -> LazyResult:
+        """At most n rows of the result from offset on, still unexecuted."""
+        return LazyResult(self.rel.limit(n, offset), self.profile)
+
+    def fetch_arrow_reader(self, batch_size: int = 1000000) -> pa.RecordBatchReader:
+        """Execute and stream the result in batches of at most batch_size rows."""
+        with self._phase("execute"):
+            if self._streamed:
+                self.rel.execute()
+            self._streamed = True
+            return self.rel.fetch_arrow_reader(batch_size)
+
+    def arrow(self, max_bytes: int = 0) -> pa.Table:
+        """The whole result, raising ResultTooLarge as soon as more than max_bytes were read if given."""
+        if max_bytes:
+            reader = self.fetch_arrow_reader()
+            with self._phase("execute"):
+                return read_all(reader, max_bytes)
+        with self._phase("execute"):
+            if self._streamed:
+                self.rel.execute()
+                self._streamed = False
+            return self.rel.arrow()
+
+    def pl(self, max_bytes: int = 0) -> pl.DataFrame:
+        # What DuckDB's own .pl() does, split to tell DuckDB's time from the conversion's
+        tbl = self.arrow(max_bytes)
+        with self._phase("to_polars"):
+            df = pl.DataFrame(tbl)
+        if self.profile is not None:
+            self.profile.add(tbl.num_rows, tbl.nbytes)
+        return df
+
+    def head(self, n: int = preview_rows) -> pl.DataFrame:
+        """The first n rows, only those are computed."""
+        return self.limit(n).pl()
+
+    def _preview(self, render) -> str:
+        r = self.limit(self.preview_rows + 1)
+        r.profile = None
+        df = r.pl()
+        if df.height <= self.preview_rows:
+            return render(df)
+        return render(df.head(self.preview_rows)) + "\n... showing the first " + str(self.preview_rows) + " rows"
+
+    def __repr__(self) -> str:
+        return self._preview(repr)
+
+    def _repr_html_(self) -> str:
+        return self._preview(lambda df: df._repr_html_())
+
+
+class LazyFrameResult(LazyResult):
+    """
+    An uncollected polars query plan, collected on the streaming engine when its result is read.
+
+    Predicates and projections are pushed down into the frames and file scans the plan reads, and
+    ``limit`` into the plan, so only the data a consumer pulls is read.
+
+    Args:
+        lf: plan of the statement
+        profile: profile the execution and conversion phases are counted on, if any
+    """
+
+    def __init__(self, lf: pl.LazyFrame, profile: Optional[QueryProfile] = None):
+        super().__init__(None, profile)
+        self.lf = lf
+
+    @property
+    def columns(self) -> List[str]:
+        return self.lf.collect_schema().names()
+
+    def limit(self, n: int, offset: int = 0) -> LazyFrameResult:
+        return LazyFrameResult(self.lf.slice(offset, n), self.profile)
+
+    def fetch_arrow_reader(self, batch_size: int = 1000000) -> pa.RecordBatchReader:
+        return self.arrow().to_reader(max_chunksize=batch_size)
+
+    def arrow(self, max_bytes: int = 0) -> pa.Table:
+        df = self._collect(max_bytes)
+        with self._phase("to_arrow"):
+            return df.to_arrow()
+
+    def pl(self, max_bytes: int = 0) -> pl.DataFrame:
+        df = self._collect(max_bytes)
+        if self.profile is not None:
+            self.profile.add_frame(df)
+        return df
+
+    def _collect(self, max_bytes: int = 0) -> pl.DataFrame:
+        with self._phase("execute"):
+            df = self.lf.collect(streaming=True)
+        if max_bytes:
+            # polars can't stop part way, the result is dropped rather than kept
+            too_large(df.estimated_size(), max_bytes)
+        return df
@@ -0,0 +1,195 @@
+"""Opt-in cache of query results, invalidated when the tables or frames they read change."""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import duckdb
+import polars as pl
+
+from .lazy import lazy_import
+from .profiler import QueryProfile
+from .result import LazyResult
+
+pa = lazy_import("pyarrow")
+
+# Only single read statements are cached
+READ_PATTERN = re.compile(r"^\s*(SELECT|WITH|FROM|VALUES|SHOW|DESCRIBE|SUMMARIZE|PIVOT|UNPIVOT|TABLE)\b", re.IGNORECASE)
+# Results that differ between runs of the same text
+VOLATILE_PATTERN = re.compile(r"\b(RANDOM|NOW|CURRENT_\w+|GEN_RANDOM_UUID|UUID|NEXTVAL|SETSEED)\b", re.IGNORECASE)
+# Statements in python code that may write to tables
+WRITE_PATTERN = re.compile(r"\b(CREATE|DROP|ALTER|ATTACH|DETACH|INSERT|UPDATE|DELETE|COPY|TRUNCATE|IMPORT\s+DATABASE)\s",
+                           re.IGNORECASE)
+# Normalization leaves quoted literals and identifiers untouched
+TOKEN_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+# Table name that stands for "any registered frame", used for pl> results
+ANY_FRAME = "*"
+# Schemas of the catalog views, which list the registered frames
+CATALOG_SCHEMAS = {"information_schema", "pg_catalog"}
+
+
+def normalize(s: str) -> str:
+    """Query text with whitespace collapsed and any trailing semicolons removed."""
+    return TOKEN_PATTERN.sub(lambda m: m.group(1) or " ", s).strip().rstrip(";").strip()
+
+
+def read_tables(s: str, db: duckdb.DuckDBPyConnection, frames: Iterable[str]) -> Optional[set[str]]:
+    """
+    Lowercase names of the tables and frames a DuckDB read statement depends on.
+
+    Views are opaque, a statement reading a view is marked as depending on ANY_FRAME too as the
+    view may be defined over a registered frame. So are catalog statements (SHOW, DESCRIBE, ...),
+    catalog views and table functions such as duckdb_tables(), whose results list the frames.
+    Returns None if s can't be parsed.
+    """
+    import sqlglot
+    from sqlglot import expressions as exp
+
+    try:
+        e = sqlglot.parse_one(s, read="duckdb")
+    except sqlglot.errors.ParseError:
+        return None
+    tables = set()
+    for t in e.find_all(exp.Table):
+        if not isinstance(t.this, exp.Identifier) or t.db.lower() in CATALOG_SCHEMAS:
+            tables.add(ANY_FRAME)
+        else:
+            tables.add(t.name.lower())
+    if not isinstance(e, exp.Query):
+        tables.add(ANY_FRAME)
+    others = tables - {f.lower() for f in frames} - {ANY_FRAME}
+    if others:
+        views = {v.lower() for (v,) in db.execute("SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall()}
+        if not others.isdisjoint(views):
+            tables.add(ANY_FRAME)
+    return tables
+
+
+class ResultCache:
+    """
+    Memory bounded LRU cache of query results with a time to live.
+
+    Entries are keyed on language plus normalized query text and remember the tables they read,
+    ``invalidate`` drops every entry reading a changed table or frame. A write statement whose
+    targets can't be determined clears the cache entirely.
+
+    Args:
+        max_bytes: total estimated size of cached results
+        ttl: seconds an entry stays valid, None to keep entries until evicted or invalidated
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: Optional[float] = 300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (result, tables, expires, nbytes)
+        self.entries: OrderedDict[tuple, tuple[pl.DataFrame, frozenset, float, int]] = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Incremented by every invalidation, results computed across one are not stored
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(lang: str, s: str) -> Optional[tuple]:
+        """Cache key for statement s in lang, None if its result must not be cached."""
+        s = normalize(s)
+        if not READ_PATTERN.match(s) or ";" in s or VOLATILE_PATTERN.search(s):
+            return None
+        return lang, s
+
+    def get(self, key: tuple) -> Optional[pl.DataFrame]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, tables: Iterable[str], result: pl.DataFrame, generation: int) -> None:
+        """Store result, read from lowercase tables, unless an invalidation happened since generation was read."""
+        nbytes = result.estimated_size()
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if generation != self.generation or nbytes > self.max_bytes:
+                return
+            if key in self.entries:
+                self._pop(key)
+            self.entries[key] = (result, frozenset(tables), expires, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+
+    def invalidate(self, tables: Iterable[str]) -> None:
+        """Drop every entry that read any of tables."""
+        names = {t.lower() for t in tables}
+        if not names:
+            return
+        with self._lock:
+            self.generation += 1
+            for k in [k for k, e in self.entries.items() if ANY_FRAME in e[1] or not names.isdisjoint(e[1])]:
+                self._pop(k)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.entries.clear()
+            self.nbytes = 0
+
+    def _pop(self, key: tuple) -> None:
+        self.nbytes -= self.entries.pop(key)[3]
+
+
+class CachingRelation(LazyResult):
+    """
+    A LazyResult whose complete result is stored in a ResultCache once fetched.
+
+    Args:
+        cache: cache the result is stored in
+        key: cache key of the statement
+        tables: tables the statement reads
+        rel: relation of the statement
+        generation: cache generation read before the statement executed
+        profile: profile the execution and conversion phases are counted on, if any
+    """
+
+    def __init__(self, cache: ResultCache, key: tuple, tables: Iterable[str], rel: duckdb.DuckDBPyRelation,
+                 generation: int, profile: Optional[QueryProfile] = None):
+        super().__init__(rel, profile)
+        self.cache = cache
+        self.key = key
+        self.tables = tables
+        self.generation = generation
+
+    def pl(self, max_bytes: int = 0) -> pl.DataFrame:
+        df = super().pl(max_bytes)
+        self.cache.put(self.key, self.tables, df, self.generation)
+        return df
+
+    def fetch_arrow_reader(self, batch_size: int = 1000000) -> pa.RecordBatchReader:
+        """Stream the result, caching it if it completes within the cache's size limit."""
+        reader = super().fetch_arrow_reader(batch_size)
+
+        def batches():
+            kept, nbytes = [], 0
+            for b in reader:
+                if kept is not None:
+                    nbytes += b.nbytes
+                    if nbytes > self.cache.max_bytes:
+                        kept = None
+                    else:
+                        kept.append(b)
+                yield b
+            if kept is not None:
+                df = pl.from_arrow(pa.Table.from_batches(kept, reader.schema))
+                self.cache.put(self.key, self.tables, df, self.generation)
+
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
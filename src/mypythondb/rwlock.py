@@ -0,0 +1,68 @@
+"""Reader/writer lock guarding the python state a QueryProcessor shares between threads."""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class RWLock:
+    """
+    Any number of readers or a single writer.
+
+    Both sides are reentrant and the writer may also take the read side, so python code run
+    under the write lock can still issue queries. Waiting writers block new readers, except
+    threads that already hold a read, so a steady stream of queries can't starve a py> statement.
+    Taking the write side while holding only the read side would deadlock and raises instead.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # thread id -> read depth
+        self._readers: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                depth = self._readers.pop(me) - 1
+                if depth:
+                    self._readers[me] = depth
+                else:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writes += 1
+            else:
+                if me in self._readers:
+                    raise RuntimeError("Write lock requested by a thread holding the read lock")
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                    self._cond.notify_all()
+                self._writer = me
+                self._writes = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writes -= 1
+                if not self._writes:
+                    self._writer = None
+                    self._cond.notify_all()
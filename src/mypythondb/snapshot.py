@@ -0,0 +1,115 @@
+"""Session frames saved as Arrow IPC files and restored memory mapped, without copying their data."""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, List
+
+import polars as pl
+
+from .lazy import imported, lazy_import
+
+pa = lazy_import("pyarrow")
+
+# Lists every frame of a snapshot directory, written last so a snapshot is complete once it exists
+MANIFEST = "manifest.json"
+# Layout version written to the manifest, restore refuses any other
+FORMAT_VERSION = 1
+
+POLARS = "polars"
+PANDAS = "pandas"
+
+
+def to_arrow(v: Any) -> tuple[str, pa.Table]:
+    """(kind, Arrow table) of a polars or pandas frame."""
+    if isinstance(v, pl.DataFrame):
+        # Large strings rather than string views, DuckDB scans those from the mapped file itself and
+        # polars reads them back by adding views over the same string data
+        return POLARS, v.to_arrow()
+    pandas = imported("pandas")
+    if pandas is not None and isinstance(v, pandas.DataFrame):
+        return PANDAS, pa.Table.from_pandas(v)
+    raise TypeError("Not a polars or pandas DataFrame: " + type(v).__name__)
+
+
+def from_arrow(kind: str, table: pa.Table) -> Any:
+    """The frame of kind backed by table, sharing its buffers wherever the types allow."""
+    if kind == POLARS:
+        return pl.from_arrow(table, rechunk=False)
+    return table.to_pandas(split_blocks=True)
+
+
+def write_snapshot(frames: Dict[str, Any], path: str) -> List[str]:
+    """
+    Write each frame to path/<name>.arrow, uncompressed so it can be memory mapped, and the manifest listing them.
+
+    Files are written under a temporary name and then renamed, a process still mapping the previous
+    snapshot keeps reading its files. Frames that can't be converted to Arrow, e.g. holding python
+    objects, are left out with a warning.
+
+    Returns:
+        The names of the frames written.
+    """
+    os.makedirs(path, exist_ok=True)
+    previous = snapshot_files(path)
+    entries = []
+    for name, v in frames.items():
+        try:
+            kind, table = to_arrow(v)
+        except Exception as e:
+            print("Not snapshotting " + name + ": " + str(e))
+            continue
+        file = name + ".arrow"
+        tmp = os.path.join(path, file + ".tmp")
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, os.path.join(path, file))
+        entries.append({"name": name, "kind": kind, "file": file, "rows": table.num_rows})
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"version": FORMAT_VERSION, "frames": entries}, f, indent=1)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+    # Frames of the previous snapshot that are no longer in the session, other files are left alone
+    for f in previous - {e["file"] for e in entries}:
+        try:
+            os.remove(os.path.join(path, f))
+        except OSError:
+            pass  # Still mapped by a process on a platform that forbids removing it
+    return [e["name"] for e in entries]
+
+
+def snapshot_files(path: str) -> set[str]:
+    """Files listed in the manifest of the snapshot at path, none if there is no readable manifest."""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return {os.path.basename(e["file"]) for e in json.load(f)["frames"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+
+
+def read_snapshot(path: str) -> tuple[Dict[str, Any], Dict[str, pa.Table]]:
+    """
+    Every frame in the snapshot at path, each memory mapped read only.
+
+    Returns:
+        name -> frame, and name -> mapped Arrow table of each polars frame DuckDB can scan as it is.
+    """
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise Exception("Unsupported snapshot version " + str(manifest.get("version")) + " in " + path)
+    frames = {}
+    tables = {}
+    for e in manifest["frames"]:
+        source = pa.memory_map(os.path.join(path, e["file"]))
+        table = pa.ipc.open_file(source).read_all()
+        frames[e["name"]] = from_arrow(e["kind"], table)
+        if e["kind"] == POLARS and not any(is_view(f.type) for f in table.schema):
+            tables[e["name"]] = table
+    return frames, tables
+
+
+def is_view(t: pa.DataType) -> bool:
+    """Whether t is a string or binary view, which DuckDB can't scan."""
+    return pa.types.is_string_view(t) or pa.types.is_binary_view(t)
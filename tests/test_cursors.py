@@ -0,0 +1,27 @@
+import time
+
+import pyarrow as pa
+
+from src.mypythondb.cursors import CursorStore
+
+
+def test_cursors_expire_and_evict_least_recently_used() -> None:
+    tbl = pa.table({"a": list(range(1000))})
+    store = CursorStore(max_bytes=tbl.nbytes * 2, ttl=0.2)
+    c1 = store.open("q1", tbl)
+    c2 = store.open("q2", tbl)
+    assert store.get(c1.cursor_id) is c1
+    store.open("q3", tbl)
+    # c2 was used least recently
+    assert store.get(c2.cursor_id) is None and store.get(c1.cursor_id) is c1
+    time.sleep(0.25)
+    assert store.get(c1.cursor_id) is None and not store.cursors
+
+
+def test_cursor_window_sorted() -> None:
+    store = CursorStore()
+    c = store.open("q", pa.table({"a": [3, None, 1, 2], "b": ["c", "x", "a", "b"]}))
+    assert c.window(1, 2).column("b").to_pylist() == ["x", "a"]
+    assert c.window(0, 10, "a").column("a").to_pylist() == [1, 2, 3, None]
+    assert c.window(0, 2, "a", descending=True).column("b").to_pylist() == ["c", "b"]
+    assert c.window(5, 10).num_rows == 0
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from mysql_mimic.errors import MysqlError
+
+from src.mypythondb.console import QueryProcessor
+from src.mypythondb.executor import QueryExecutor
+
+
+def test_runs_on_worker_cursor() -> None:
+    qp = QueryProcessor()
+    qp.query('py>plx = pl.DataFrame({"a": [1, 2]})')
+    executor = QueryExecutor(qp, workers=2)
+
+    async def run():
+        return await executor.run(1, lambda cur: qp.query("dk>SELECT sum(a) AS s FROM plx", cur))
+
+    assert asyncio.run(run()).item() == 3
+
+
+def test_cancel_interrupts_query() -> None:
+    qp = QueryProcessor()
+    executor = QueryExecutor(qp, workers=1)
+
+    async def run():
+        task = asyncio.ensure_future(executor.run(7, lambda cur: qp.query("dk>SELECT count(*) FROM range(100000000000)", cur)))
+        while not task.done():
+            executor.cancel(7)
+            await asyncio.sleep(0.05)
+        with pytest.raises(Exception):
+            await task
+        return await executor.run(7, lambda cur: qp.query("dk>SELECT 42 AS i", cur))
+
+    assert asyncio.run(run()).item() == 42
+
+
+def test_rejects_when_queue_full() -> None:
+    qp = QueryProcessor()
+    executor = QueryExecutor(qp, workers=1, queue_size=0)
+    executor.pending = 1
+    with pytest.raises(MysqlError):
+        asyncio.run(executor.run(1, lambda cur: None))
+
+
+def test_queue_timeout_rejects_waiting_query() -> None:
+    qp = QueryProcessor()
+    qp.limit_resources(queue_timeout=0.1)
+    executor = QueryExecutor(qp, workers=1)
+    assert executor.queue_size == 64
+
+    async def run():
+        lease = await executor.lease(1)
+        try:
+            with pytest.raises(MysqlError, match="Server busy"):
+                await executor.run(2, lambda cur: None)
+        finally:
+            lease.release()
+        assert executor.pending == 0
+        return await executor.run(2, lambda cur: 42)
+
+    assert asyncio.run(run()) == 42
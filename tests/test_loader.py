@@ -0,0 +1,64 @@
+import os
+
+import duckdb
+import pyarrow as pa
+import pytest
+
+from src.mypythondb.console import QueryProcessor
+from src.mypythondb.loader import Source
+
+
+def test_data_files_globs_and_scripts(tmp_path) -> None:
+    con = duckdb.connect()
+    (tmp_path / "hive" / "year=2024").mkdir(parents=True)
+    con.sql(f"COPY (SELECT range AS a FROM range(10)) TO '{tmp_path}/sales.parquet'")
+    con.sql(f"COPY (SELECT 1 AS x) TO '{tmp_path}/part_1.csv'")
+    con.sql(f"COPY (SELECT 2 AS x) TO '{tmp_path}/part_2.csv'")
+    con.sql(f"COPY (SELECT 'j' AS s) TO '{tmp_path}/events.json'")
+    con.sql(f"COPY (SELECT 5 AS v) TO '{tmp_path}/hive/year=2024/f.parquet'")
+    with pa.OSFile(str(tmp_path / "2023-ticks.arrow"), "wb") as f:
+        tbl = pa.table({"p": [1.5, 2.5]})
+        with pa.ipc.new_file(f, tbl.schema) as w:
+            w.write_table(tbl)
+    # Runs alongside the data files, so it reads the file rather than the view loaded from it
+    (tmp_path / "a.sql").write_text(f"-- pythondb: parallel\nCREATE TABLE a AS SELECT count(*) AS n FROM '{tmp_path}/sales.parquet';")
+    (tmp_path / "b.py").write_text("b = pdb.query('dk>SELECT sum(x) AS s FROM parts').item()")
+    (tmp_path / "c.sql").write_text("pl>SELECT 1 AS one")
+    (tmp_path / "d.sql").write_text("py>d = 4")
+
+    qp = QueryProcessor()
+    progress = []
+    from src.mypythondb.loader import Loader
+    Loader(qp, jobs=3, progress=lambda *a: progress.append(a)).load([
+        str(tmp_path / "sales.parquet"), "parts=" + str(tmp_path / "part_*.csv"), str(tmp_path / "events.json"),
+        str(tmp_path / "hive"), str(tmp_path / "2023-ticks.arrow"), str(tmp_path / "a.sql"), str(tmp_path / "b.py"),
+        str(tmp_path / "c.sql"), str(tmp_path / "d.sql")])
+    assert qp.query("dk>SELECT count(*) FROM sales").item() == 10
+    assert qp.query("dk>SELECT s FROM events").item() == "j"
+    assert qp.query("dk>SELECT v, year FROM hive").row(0) == (5, 2024)
+    assert qp.query("pl>SELECT sum(p) AS p FROM _2023_ticks").item() == 4.0
+    assert qp.query("dk>SELECT n FROM a").item() == 10
+    # Scannable files are queryable from pl> too
+    assert qp.query("pl>SELECT sum(a) AS a FROM sales").item() == 45
+    assert qp.query("pl>SELECT sum(x) AS x FROM parts").item() == 3
+    assert qp.query("pl>SELECT v FROM hive").item() == 5
+    assert qp.mylocals["b"] == 3
+    # Scripts naming their own language keep it
+    assert qp.mylocals["d"] == 4
+    assert [p[0] for p in progress] == list(range(1, 10)) and all(p[4] is None for p in progress)
+    # Scripts not marked parallel run last, on their own
+    assert [os.path.basename(p[2].path) for p in progress[-3:]] == ["b.py", "c.sql", "d.sql"]
+    assert qp.getlang() == "py"
+    tables = {r[0] for r in qp.duckdb.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    assert tables == {"a"}
+
+    qp.load_files([str(tmp_path / "sales.parquet")], materialize=True)
+    assert "sales" in {r[0] for r in qp.duckdb.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    with pytest.raises(duckdb.Error):
+        qp.load_files([str(tmp_path / "missing_*.parquet")])
+
+
+def test_source_names() -> None:
+    assert Source.default_name("data/sales_*.parquet") == "sales"
+    assert Source.default_name("data/trades/*.parquet") == "trades"
+    assert Source.default_name("data/2024-01.csv") == "_2024_01"
@@ -90,3 +90,224 @@
 # def test_python_duckdb() -> None:
 #     chk(tq[10], '[i: LONGLONG, ]  [(42,)]')
 #
+
+import pyarrow as pa
+from mysql_mimic.types import ColumnType
+
+from src.mypythondb.console import QueryProcessor
+from src.mypythondb.mysession import arrow_to_mysql_type, next_rows
+
+
+def test_arrow_to_mysql_type() -> None:
+    assert arrow_to_mysql_type(pa.int8()) == ColumnType.SHORT
+    assert arrow_to_mysql_type(pa.int32()) == ColumnType.LONG
+    assert arrow_to_mysql_type(pa.uint32()) == ColumnType.LONGLONG
+    assert arrow_to_mysql_type(pa.uint64()) == ColumnType.NEWDECIMAL
+    assert arrow_to_mysql_type(pa.float64()) == ColumnType.DOUBLE
+    assert arrow_to_mysql_type(pa.large_string()) == ColumnType.STRING
+    assert arrow_to_mysql_type(pa.timestamp("us")) == ColumnType.DATETIME
+    assert arrow_to_mysql_type(pa.list_(pa.int64())) == ColumnType.VARCHAR
+
+
+def test_next_rows_streams_batches() -> None:
+    qp = QueryProcessor()
+    reader = qp.query_reader("dk>SELECT range AS a, 'x' AS b FROM range(25)", batch_size=10)
+    batches = []
+    while (rows := next_rows(reader)) is not None:
+        batches.append(rows)
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert batches[0][3] == (3, 'x')
+
+
+def test_catalog_types_and_invalidation() -> None:
+    qp = QueryProcessor()
+    qp.query('py>plx = pl.DataFrame({"a": [1, 2], "b": ["x", "y"]})')
+    qp.query("dk>CREATE TABLE tbl(i INTEGER NOT NULL, d DECIMAL(10,2))")
+    cols = {(c.table, c.name): (c.type, c.is_nullable) for c in qp.catalog.columns()}
+    assert cols[("plx", "a")] == ("BIGINT", True)
+    assert cols[("plx", "b")] == ("TEXT", True)
+    assert cols[("tbl", "i")] == ("INT", False)
+    assert cols[("tbl", "d")] == ("DECIMAL(10,2)", True)
+
+    info_schema = qp.catalog.info_schema()
+    qp.query("dk>SELECT * FROM tbl")
+    qp.query("py>x = 1")
+    assert qp.catalog.is_current() and qp.catalog.info_schema() is info_schema
+    qp.query("dk>DROP TABLE tbl")
+    assert not qp.catalog.is_current()
+
+
+def test_statement_cache_routes_and_status() -> None:
+    import asyncio
+    from src.mypythondb.mysession import Session
+
+    session = Session()
+
+    async def run():
+        for sql in ["SELECT 1", "SELECT a FROM t", "SELECT a FROM t", "SELECT @@version FROM t", "py>2+2", "SET @@x = 1"]:
+            try:
+                await session.handle_query(sql, {})
+            except Exception:
+                pass
+        return await session.handle_query("SHOW STATUS LIKE 'Statement_cache%'", {})
+
+    rows, _ = asyncio.run(run())
+    routes = {sql: [r for _, r in stmts] for sql, stmts in session.statement_cache.entries.items()}
+    assert routes["SELECT 1"] == ["static"]
+    assert routes["SELECT a FROM t"] == ["passthrough"]
+    assert routes["SELECT @@version FROM t"] == ["variables"]
+    assert routes["py>2+2"] == ["passthrough"]
+    assert routes["SET @@x = 1"] == ["set"]
+    assert dict(rows)["Statement_cache_hits"] == "1"
+    assert dict(rows)["Statement_cache_misses"] == "6"
+
+
+def test_native_statement_parameters() -> None:
+    import datetime
+    from decimal import Decimal
+    from src.mypythondb.prepared import NativeStatement, sql_literal
+
+    assert sql_literal("it's") == "'it''s'"
+    assert sql_literal(1.5) == "1.5::DOUBLE"
+    assert sql_literal(b"\x00a") == "'\\x00\\x61'::BLOB"
+    assert sql_literal(datetime.date(2024, 1, 2)) == "DATE '2024-01-02'"
+
+    qp = QueryProcessor()
+    qp.query('py>k = pl.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})')
+    stmt = NativeStatement(qp.native_sql("dk>SELECT a, b, ? AS c FROM k WHERE a > ? ORDER BY a"))
+    assert stmt.num_params == 2
+    rows = qp.execute_prepared(stmt, [Decimal("1.25"), 1], qp.cursor(), 100).read_all().to_pylist()
+    assert rows == [{"a": 2, "b": "y", "c": Decimal("1.25")}, {"a": 3, "b": "z", "c": Decimal("1.25")}]
+    # A changed frame is picked up by the statement prepared on the old one
+    qp.query('py>k = pl.DataFrame({"a": [5], "b": ["w"]})')
+    assert qp.execute_prepared(stmt, [None, 0], qp.cursor(), 100).read_all().to_pylist() == [{"a": 5, "b": "w", "c": None}]
+    stmt.close()
+    stmt.prepare(qp.cursor())
+    assert stmt.execute(qp.cursor(), ["q", 4], 100).read_all().num_rows == 1
+    # Values are passed as literals, quotes, backslashes and NULs come back unchanged
+    for v in ["it's", "a\\'); DROP TABLE k; --", "\\x41\\", "nul\x00end\x00", "'\x00'", b"\x00'\\"]:
+        assert stmt.execute(qp.cursor(), [v, 4], 100).read_all().to_pylist() == [{"a": 5, "b": "w", "c": v}]
+
+
+def test_prepare_over_new_frame() -> None:
+    import asyncio
+    from types import SimpleNamespace
+    from src.mypythondb.mysession import MySession
+
+    qp = QueryProcessor()
+    qp.setlang("dk")
+    session = MySession(qp)
+    session._connection = SimpleNamespace(connection_id=7)
+    # Created after the session's executor cursor last synced the frames
+    qp.query('py>fresh = pl.DataFrame({"a": [1, 2, 3]})')
+    stmt = asyncio.run(session.prepare_native("SELECT sum(a) AS s FROM fresh WHERE a > ?"))
+    assert stmt is not None
+    assert qp.execute_prepared(stmt, [1], qp.cursor(), 100).read_all().to_pylist() == [{"s": 5}]
+
+
+def test_show_profiles() -> None:
+    import asyncio
+    from types import SimpleNamespace
+    from src.mypythondb.mysession import MySession
+
+    qp = QueryProcessor()
+    session = MySession(qp)
+    session._connection = SimpleNamespace(connection_id=7)
+
+    async def run():
+        result = await session.handle_query("SELECT range AS a FROM range(3)", {})
+        rows = [r async for r in result.rows]
+        profiles = await session.handle_query("SHOW PROFILES", {})
+        profile = await session.handle_query("SHOW PROFILE FOR QUERY %d" % profiles[0][-1][0], {})
+        return rows, profiles, profile
+
+    rows, (profiles, columns), (profile, _) = asyncio.run(run())
+    assert rows == [(0,), (1,), (2,)]
+    assert columns == ["Query_ID", "Duration", "Query"] and profiles[-1][2] == "SELECT range AS a FROM range(3)"
+    assert [k for k, _ in profile] == ["parse", "queue", "register", "plan", "execute", "fetch", "encode", "other"]
+    assert qp.profiler.queries()[0].rows == 3
+
+
+def test_max_execution_time() -> None:
+    import asyncio
+    import pytest
+    from types import SimpleNamespace
+    from mysql_mimic.errors import MysqlError
+    from src.mypythondb.mysession import MySession, QUERY_TIMEOUT
+
+    qp = QueryProcessor()
+    qp.limit_resources(max_execution_time=30)
+    session = MySession(qp)
+    session._connection = SimpleNamespace(connection_id=7)
+    assert session.variables.get("max_execution_time") == 30000
+
+    async def run(sql):
+        result = await session.handle_query(sql, {})
+        return [r async for r in result.rows]
+
+    asyncio.run(session.handle_query("SET max_execution_time = 200", {}))
+    assert session.max_execution_time() == 0.2
+    for sql in ["SELECT count(*) FROM range(100000000000) a, range(10) b", "SELECT range FROM range(100000000000)"]:
+        with pytest.raises(MysqlError) as e:
+            asyncio.run(run(sql))
+        assert e.value.code == QUERY_TIMEOUT
+    assert asyncio.run(run("SELECT range FROM range(1)")) == [(0,)]
+    assert qp.profiler.errors == 2
+
+
+def serve(qp: QueryProcessor) -> int:
+    """Serve MySQL from qp on a free port, from a daemon thread, returning the port."""
+    import asyncio
+    import threading
+    from src.mypythondb.mysession import sql_server
+
+    server = sql_server(qp, 2, port=0)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start_server(host="127.0.0.1"))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server._server.sockets[0].getsockname()[1]
+
+
+def test_prepared_time_and_unsigned_bigint() -> None:
+    import datetime
+    import decimal
+    import mysql.connector
+
+    qp = QueryProcessor()
+    qp.setlang("dk")
+    client = mysql.connector.connect(host="127.0.0.1", port=serve(qp), user="test")
+    expected = (datetime.timedelta(hours=12, minutes=34, seconds=56), decimal.Decimal("18446744073709551615"))
+    for prepared in (False, True):
+        cur = client.cursor(prepared=prepared)
+        cur.execute("SELECT TIME '12:34:56' AS t, 18446744073709551615::UBIGINT AS u")
+        assert cur.fetchall() == [expected]
+    client.close()
+
+
+def test_session_shuts_down_its_own_executor() -> None:
+    import asyncio
+    import pytest
+    from types import SimpleNamespace
+    from src.mypythondb.executor import QueryExecutor
+    from src.mypythondb.mysession import MySession
+
+    from src.mypythondb.mysession import Session
+    from src.mypythondb.prepared import NativeStatement
+
+    qp = QueryProcessor()
+    shared = QueryExecutor(qp, workers=1)
+    own, server = MySession(qp), MySession(qp, shared)
+    for session in (own, server):
+        session._connection = SimpleNamespace(connection_id=7)
+        native = NativeStatement("SELECT 1")
+        native.prepare(qp.cursor())
+        session.native_statements[1] = native
+        asyncio.run(session.close())
+        # The base close still runs, closing the native statements and dropping the connection
+        assert not native.cursors and not session.native_statements
+        assert session._connection is None
+    asyncio.run(Session().close())
+    with pytest.raises(RuntimeError):
+        asyncio.run(own.executor.run(1, lambda cur: None))
+    # The server's executor outlives its sessions
+    assert asyncio.run(shared.run(1, lambda cur: 42)) == 42
@@ -1,6 +1,11 @@
+import os
+import time
+
+import polars as pl
 import pytest
 
 from src.mypythondb.console import QueryProcessor
+from src.mypythondb.governor import QueryTimeout, ResultTooLarge
 
 tq = ["pdx",
       "2",
@@ -188,4 +193,327 @@ def test_py_created_vars_visible_in_dk_and_pl() -> None:
 │ 33  │
 └─────┘"""
     assert runner.query("dk>SELECT max(a) AS m FROM testboth").__str__() == exp
-    assert runner.query("pl>SELECT max(a) AS m FROM testboth").__str__() == exp
\ No newline at end of file
+    assert runner.query("pl>SELECT max(a) AS m FROM testboth").__str__() == exp
+
+def test_py_frames_reregistered_only_when_changed() -> None:
+    runner = QueryProcessor()
+    runner.query('py>f1 = pl.DataFrame({"a":[1]})')
+    runner.query('py>f2 = pd.DataFrame({"a":[2]})')
+    generation = runner.frames.generation
+    runner.query('py>x = 5')
+    assert runner.frames.generation == generation
+    runner.query('py>f1 = pl.DataFrame({"a":[7, 8]})')
+    assert runner.frames.generation == generation + 1
+    assert runner.query("dk>SELECT sum(a) AS s FROM f1").item() == 15
+    assert runner.query("pl>SELECT sum(a) AS s FROM f1").item() == 15
+    runner.query('py>del f1')
+    assert "f1" not in runner.frames.frames
+    with pytest.raises(Exception):
+        runner.query("dk>SELECT * FROM f1")
+    assert runner.query("dk>SELECT a FROM f2").item() == 2
+
+
+def test_py_frames_edited_in_place_reregistered() -> None:
+    runner = QueryProcessor()
+    runner.enable_result_cache()
+    runner.query('py>df = pl.DataFrame({"a": [1, 2]})')
+    runner.query('py>pdf = pd.DataFrame({"a": [1, 2]})')
+    assert runner.query("dk>select sum(a) AS s from df").item() == 3
+    assert runner.query("pl>select sum(a) AS s from df").item() == 3
+    assert runner.query("dk>select sum(a) AS s from pdf").item() == 3
+    runner.query('py>df[0, "a"] = 100')
+    runner.query('py>pdf.loc[0, "a"] = 100')
+    assert runner.query("dk>select sum(a) AS s from df").item() == 102
+    assert runner.query("pl>select sum(a) AS s from df").item() == 102
+    assert runner.query("dk>select sum(a) AS s from pdf").item() == 102
+    generation = runner.frames.generation
+    runner.query('py>x = 5')
+    assert runner.frames.generation == generation
+
+
+def test_result_cache_invalidation() -> None:
+    runner = QueryProcessor()
+    runner.enable_result_cache()
+    runner.query("dk>CREATE TABLE t AS SELECT 1 AS a")
+    runner.query('py>f = pl.DataFrame({"a": [5]})')
+    q = "dk>SELECT sum(a) AS s FROM t"
+    assert runner.query(q).item() == 1
+    assert runner.query("dk>SELECT   sum(a) AS s FROM t;").item() == 1
+    assert runner.result_cache.hits == 1
+    assert runner.query("pl>SELECT a FROM f").item() == 5
+    assert runner.query("dk>SELECT a FROM f").item() == 5
+
+    runner.query('py>f = pl.DataFrame({"a": [6]})')
+    assert runner.query("pl>SELECT a FROM f").item() == 6
+    assert runner.query("dk>SELECT a FROM f").item() == 6
+    assert ("dk", "SELECT sum(a) AS s FROM t") in runner.result_cache.entries
+
+    runner.query("dk>INSERT INTO t VALUES (2)")
+    assert runner.query(q).item() == 3
+    reader = runner.query_reader(q)
+    assert reader.read_all().num_rows == 1
+
+
+def test_result_cache_invalidates_catalog_queries() -> None:
+    runner = QueryProcessor()
+    runner.enable_result_cache()
+    queries = ["dk>show tables", "dk>SELECT table_name FROM information_schema.tables",
+               "dk>SELECT view_name FROM duckdb_views()"]
+    before = [runner.query(q).height for q in queries]
+    runner.query('py>a = pl.DataFrame({"x": [1]})')
+    after = [runner.query(q).height for q in queries]
+    assert [b < a for b, a in zip(before, after)] == [True] * len(queries)
+    assert runner.query("dk>describe a").height == 1
+    runner.query('py>a = pl.DataFrame({"x": [1], "y": [2]})')
+    assert runner.query("dk>describe a").height == 2
+
+
+def test_result_cache_streamed_results_are_stored() -> None:
+    runner = QueryProcessor()
+    runner.enable_result_cache()
+    q = "dk>SELECT range AS a FROM range(100)"
+    assert runner.query_reader(q, batch_size=10).read_all().num_rows == 100
+    hits = runner.result_cache.hits
+    assert runner.query(q).height == 100
+    assert runner.result_cache.hits == hits + 1
+
+
+def test_import_leaves_heavy_modules_unloaded() -> None:
+    import subprocess
+    import sys
+    code = ("import sys, src.mypythondb; "
+            "print(sorted(m for m in ('pandas', 'numpy', 'pyarrow', 'sqlglot', 'mysql_mimic', 'xlsxwriter', 'kola') "
+            "if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+    q = QueryProcessor()
+    q.query("py>df = pd.DataFrame({'a': [1, 2]})")
+    assert q.query("dk>SELECT sum(a) AS s FROM df").item() == 3
+
+
+def test_concurrent_queries_while_frames_change() -> None:
+    import threading
+    q = QueryProcessor()
+    q.query('py>f = pl.DataFrame({"a": [1, 2]})')
+    errors = []
+
+    def reader(lang: str) -> None:
+        for _ in range(200):
+            try:
+                assert q.query(lang + ">SELECT count(*) AS n FROM f").item() in (2, 3)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(lang,)) for lang in ("dk", "dk", "pl")]
+    for t in threads:
+        t.start()
+    for i in range(50):
+        q.query('py>f = pl.DataFrame({"a": [1, 2%s]})' % (", 3" if i % 2 else ""))
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_profile() -> None:
+    qp = QueryProcessor()
+    qp.query('py>pf = pl.DataFrame({"a": [1, 2, 3]})')
+    qp.query("dk>SELECT a * 2 AS b FROM pf")
+    with pytest.raises(Exception):
+        qp.query("dk>SELECT nope FROM pf")
+    df = qp.profile()
+    assert df.get_column("sql").to_list()[:3] == ["dk>SELECT nope FROM pf", "dk>SELECT a * 2 AS b FROM pf",
+                                                  'py>pf = pl.DataFrame({"a": [1, 2, 3]})']
+    assert df.get_column("error")[0] is not None and df.get_column("rows")[1] == 3
+    assert df.get_column("lang").to_list()[:3] == ["dk", "dk", "py"]
+    phases = qp.profile(df.get_column("query_id")[1])
+    assert phases.get_column("phase").to_list() == ["register", "plan", "execute", "to_polars", "to_pdf", "other"]
+
+
+def test_lazy_result_only_computes_what_is_read() -> None:
+    from src.mypythondb.result import LazyResult
+    qp = QueryProcessor()
+    r = qp.queryraw("dk>SELECT range AS a FROM range(1000000000)")
+    assert isinstance(r, LazyResult) and r.columns == ["a"]
+    assert "showing the first 10 rows" in repr(r)
+    assert r.limit(3, 5).pl().get_column("a").to_list() == [5, 6, 7]
+    assert qp.query("dk>SELECT range AS a FROM range(1000000000)", limit=4).height == 4
+    small = qp.queryraw("dk>SELECT range AS a FROM range(25)")
+    assert [b.num_rows for b in small.fetch_arrow_reader(10)] == [10, 10, 5]
+    assert small.arrow().num_rows == 25 and qp.to_pdf(small).height == 25
+    assert "showing" not in repr(small.limit(10))
+
+
+def test_snapshot_and_restore(tmp_path) -> None:
+    qp = QueryProcessor()
+    qp.queryraw("py>import pandas as pd")
+    qp.queryraw("py>trades = pl.DataFrame({'sym': ['a', 'b', 'a'], 'px': [1.5, 2.0, 3.0]})")
+    qp.queryraw("py>people = pd.DataFrame({'name': ['tom', 'nick'], 'age': [10, 11]})")
+    qp.queryraw("py>gone = pl.DataFrame({'x': [1]})")
+    assert sorted(qp.snapshot(str(tmp_path))) == ["gone", "people", "trades"]
+    (tmp_path / "mine.arrow").write_bytes(b"not a frame")
+    qp.queryraw("py>del gone")
+    assert sorted(qp.snapshot(str(tmp_path))) == ["people", "trades"]
+    assert not (tmp_path / "gone.arrow").exists()
+    # Only files of the previous snapshot are removed
+    assert (tmp_path / "mine.arrow").read_bytes() == b"not a frame"
+
+    restored = QueryProcessor()
+    assert sorted(restored.restore(str(tmp_path))) == ["people", "trades"]
+    assert restored.mylocals["trades"].equals(qp.mylocals["trades"])
+    assert restored.mylocals["people"].equals(qp.mylocals["people"])
+    assert restored.query("dk>SELECT sum(px) AS s FROM trades WHERE sym = 'a'").item() == 4.5
+    assert restored.query("dk>SELECT max(age) AS a FROM people").item() == 11
+
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+def test_restore_shares_mapped_buffers(tmp_path) -> None:
+    qp = QueryProcessor()
+    qp.bind("trades", pl.DataFrame({"sym": ["abc" * 20 + str(i) for i in range(1000)], "px": range(1000)}))
+    qp.snapshot(str(tmp_path))
+    restored = QueryProcessor()
+    restored.restore(str(tmp_path))
+
+    mapped = []
+    with open("/proc/self/maps") as f:
+        for line in f:
+            if line.rstrip().endswith(str(tmp_path / "trades.arrow")):
+                start, end = line.split()[0].split("-")
+                mapped.append((int(start, 16), int(end, 16)))
+
+    def shared(buffers) -> bool:
+        return all(any(s <= b.address < e for s, e in mapped) for b in buffers if b is not None and b.size)
+
+    # DuckDB scans the mapped table, polars' string views point into it
+    assert shared(b for c in restored.frames.arrow["trades"].columns for chunk in c.chunks for b in chunk.buffers())
+    views = restored.mylocals["trades"].to_arrow(compat_level=pl.CompatLevel.newest())
+    assert shared(views.column("sym").chunk(0).buffers()[2:])
+    assert restored.query("dk>SELECT max(px) AS m FROM trades WHERE sym LIKE '%999'").item() == 999
+
+
+def test_exec_with_return_compiles_once() -> None:
+    from src.mypythondb.queryprocessor import compile_with_return, exec_with_return
+    ns = {}
+    assert exec_with_return("a = 2\na * 3", {}, ns, False) == 6
+    assert exec_with_return("b, c = 1, [5]", {}, ns, False) == (1, [5])
+    assert exec_with_return("c[0] += 4", {}, ns, False) == 9
+    assert exec_with_return("d: int = a", {}, ns, False) == 2
+    assert exec_with_return("import math", {}, ns, False) is None
+    before = compile_with_return.cache_info()
+    for _ in range(3):
+        assert exec_with_return("a = a + 1", {}, ns, False) == ns["a"]
+    after = compile_with_return.cache_info()
+    assert after.misses - before.misses == 1 and after.hits - before.hits == 2
+    assert ns["a"] == 5
+
+
+def test_to_pdf_converters() -> None:
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import polars as pl
+    to_pdf = QueryProcessor.to_pdf
+
+    a = np.arange(5, dtype=np.float64)
+    df = to_pdf(a)
+    assert df.columns == ["array"] and np.shares_memory(df["array"].to_numpy(), a)
+    assert to_pdf(np.arange(6).reshape(3, 2)).shape == (3, 2)
+    assert to_pdf(np.int64(7)).item() == 7
+
+    pdf = pd.DataFrame({"a": a, "b": ["x", "y", "z", None, "w"], "c": [1.0, np.nan, 2.0, 3.0, 4.0]})
+    df = to_pdf(pdf)
+    assert df.columns == ["a", "b", "c"] and np.shares_memory(df["a"].to_numpy(), pdf["a"].to_numpy())
+    assert df["c"].null_count() == 1 and df["b"][3] is None
+    assert to_pdf(pdf["b"]).columns == ["b"]
+
+    tbl = pa.table({"x": [1, 2, 3]})
+    assert to_pdf(tbl)["x"].to_list() == [1, 2, 3]
+    assert to_pdf(tbl.to_batches()[0]).height == 3
+    assert to_pdf(tbl.to_reader()).height == 3
+    assert to_pdf(pa.array([1, 2])).height == 2
+    assert to_pdf(tbl.column("x")).height == 3
+
+    assert to_pdf(pl.LazyFrame({"x": [1, 2]}).filter(pl.col("x") > 1))["x"].to_list() == [2]
+    assert to_pdf(pl.Series("s", [1, 2])).columns == ["s"]
+    assert to_pdf([{"a": 1}, {"a": 2, "b": "x"}]).shape == (2, 2)
+    assert to_pdf([3, 5])["list"].to_list() == [3, 5]
+
+    converters = __import__("src.mypythondb.converters", fromlist=["CONVERTERS"]).CONVERTERS
+    converters.chunk_size, chunk_size = 3, converters.chunk_size
+    try:
+        assert to_pdf({"i": i} for i in range(10))["i"].to_list() == list(range(10))
+        assert to_pdf(pl.DataFrame({"i": [i]}) for i in range(4)).height == 4
+        assert to_pdf(iter([]))["list"].to_list() == []
+    finally:
+        converters.chunk_size = chunk_size
+
+    class Point:
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+
+    assert to_pdf(Point(1, 2)).columns == ["unrecognised"]
+    QueryProcessor.register_converter(Point, lambda p: pl.DataFrame({"x": [p.x], "y": [p.y]}))
+    assert to_pdf(Point(1, 2)).row(0) == (1, 2)
+    assert to_pdf([Point(1, 2), Point(3, 4)])["x"].to_list() == [1, 3]
+
+
+def test_lazy_polars(tmp_path) -> None:
+    import polars as pl
+    from src.mypythondb.result import LazyFrameResult
+    pl.DataFrame({"a": range(100), "b": ["x"] * 100}).write_parquet(tmp_path / "big.parquet")
+    qp = QueryProcessor()
+    qp.enable_lazy_polars()
+    qp.register_lazy("big", pl.scan_parquet(tmp_path / "big.parquet"))
+    qp.queryraw("py>small = pl.DataFrame({'a': [1, 2, 3]})")
+
+    r = qp.queryraw("pl>SELECT a FROM big WHERE a >= 50")
+    assert isinstance(r, LazyFrameResult) and r.columns == ["a"]
+    # The filter and the column selection reach the scan
+    plan = r.lf.explain()
+    assert "SELECTION" in plan and "PROJECT 1/2 COLUMNS" in plan
+    assert r.limit(3, 1).pl()["a"].to_list() == [51, 52, 53]
+    assert "showing the first 10 rows" in repr(r)
+    assert qp.query("pl>SELECT sum(a) AS s FROM big WHERE a >= 50").item() == sum(range(50, 100))
+    assert qp.query("pl>SELECT * FROM small", limit=2).height == 2
+    reader = qp.query_reader("pl>SELECT a FROM big", batch_size=40)
+    assert [b.num_rows for b in reader] == [40, 40, 20]
+    assert qp.profile()["rows"][0] == 100
+
+    qp.disable_lazy_polars()
+    assert isinstance(qp.queryraw("pl>SELECT * FROM small"), pl.DataFrame)
+
+
+def test_lazy_registrations_invalidate_and_outlive_frames() -> None:
+    qp = QueryProcessor()
+    qp.enable_result_cache()
+    qp.register_lazy("scan", pl.LazyFrame({"a": [1]}))
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 1
+    qp.register_lazy("scan", pl.LazyFrame({"a": [5]}))
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 5
+    # A py> frame of the same name hides the scan until deleted
+    qp.query("py>scan = pl.DataFrame({'a': [7]})")
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 7
+    qp.query("py>del scan")
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 5
+    qp.query("py>scan = pl.DataFrame({'a': [8]})")
+    qp.register_lazy("scan", pl.LazyFrame({"a": [9]}))
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 8
+    qp.query("py>scan = 1")
+    assert qp.query("pl>SELECT sum(a) AS s FROM scan").item() == 9
+
+
+def test_resource_limits() -> None:
+    qp = QueryProcessor()
+    qp.limit_resources(max_execution_time=0.3, memory_limit="1GB", max_result_bytes=10000)
+    assert qp.duckdb.sql("SELECT current_setting('memory_limit')").fetchone()[0] in ("1.0 GiB", "953.6 MiB")
+    start = time.perf_counter()
+    with pytest.raises(QueryTimeout):
+        qp.query("dk>SELECT count(*) FROM range(100000000000) a, range(10) b")
+    assert time.perf_counter() - start < 5
+    with pytest.raises(ResultTooLarge):
+        qp.query("dk>SELECT range AS a FROM range(1000000)")
+    qp.enable_lazy_polars()
+    qp.register_lazy("lf", pl.LazyFrame({"a": range(1000000)}))
+    with pytest.raises(ResultTooLarge):
+        qp.query("pl>SELECT a FROM lf")
+    assert qp.query("dk>SELECT 42 AS i").item() == 42
@@ -0,0 +1,225 @@
+import http.client
+import gzip
+import io
+import json
+import os
+import socket
+import _thread as thread
+import time
+import zipfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.mypythondb.console import QueryProcessor
+from src.mypythondb.qwebserv import QWebServ, start_web
+
+
+@pytest.fixture(scope="module")
+def port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        free = s.getsockname()[1]
+    query_processor = QueryProcessor()
+    query_processor.query('py>plx = pl.DataFrame({"a": [1, 2], "b": ["x", "y"]})')
+    thread.start_new_thread(start_web, (query_processor, free))
+    time.sleep(0.5)
+    return free
+
+
+def get(conn: http.client.HTTPConnection, path: str) -> http.client.HTTPResponse:
+    conn.request("GET", path)
+    r = conn.getresponse()
+    r.body = r.read()
+    return r
+
+
+def test_keep_alive_with_content_length(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    r = get(conn, "/api/servertree")
+    assert r.status == 200 and b'"name":"plx"' in r.body
+    assert int(r.getheader("Content-Length")) == len(r.body)
+    r = get(conn, "/file.csv?dk>SELECT%20*%20FROM%20plx")
+    assert r.status == 200 and r.getheader("Transfer-Encoding") == "chunked"
+    assert r.body == b"a,b\n1,x\n2,y\n"
+    r = get(conn, "/file.csv?dk>SELECT%20*%20FROM%20plx%20WHERE%20a%20>%205")
+    assert r.body == b"a,b\n"
+
+
+def post(conn: http.client.HTTPConnection, body: dict) -> dict:
+    conn.request("POST", "/", json.dumps(body), {"Content-type": "application/json"})
+    r = conn.getresponse()
+    assert r.status == 200
+    return json.loads(r.read())
+
+
+def test_json_pages_with_continuation_token(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    qry = "dk>SELECT range AS n FROM range(25000)"
+    r = post(conn, {"query": qry, "limit": 15000})
+    assert r["tbl"]["types"] == {"n": "number"}
+    assert [x["n"] for x in r["tbl"]["data"]] == list(range(15000))
+    r = post(conn, {"next": r["next"], "limit": 15000})
+    assert [x["n"] for x in r["tbl"]["data"]] == list(range(15000, 25000))
+    assert r["next"] is None and r["truncated"] is False
+    r = post(conn, {"query": "dk>SELECT * FROM plx", "orient": "columns"})
+    assert r["tbl"]["data"] == {"a": [1, 2], "b": ["x", "y"]}
+
+
+def test_continuation_tokens_only_for_read_queries(port: int) -> None:
+    from src.mypythondb.qwebserv import encode_token
+
+    conn = http.client.HTTPConnection("localhost", port)
+    r = post(conn, {"query": "pl>SELECT a FROM plx", "limit": 1})
+    assert [x["a"] for x in r["tbl"]["data"]] == [1]
+    assert [x["a"] for x in post(conn, {"next": r["next"], "limit": 1})["tbl"]["data"]] == [2]
+    # Python code isn't run again per page
+    r = post(conn, {"query": "py>pages = list(range(5))\npages", "limit": 2})
+    assert len(r["tbl"]["data"]) == 2 and r["next"] is None and r["truncated"] is True
+    r = post(conn, {"query": "py>pages", "limit": 10})
+    assert len(r["tbl"]["data"]) == 5 and r["truncated"] is False
+    conn.request("POST", "/", json.dumps({"next": encode_token("py>pages.append(1)", 2)}),
+                 {"Content-type": "application/json"})
+    r = conn.getresponse()
+    r.read()
+    assert r.status == 400
+
+
+def test_arrow_and_parquet_results(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    qry = "dk>SELECT range AS n, 'v' || range AS s FROM range(300000)"
+    conn.request("POST", "/", json.dumps({"query": qry}),
+                 {"Content-type": "application/json", "Accept": "application/vnd.apache.arrow.stream"})
+    r = conn.getresponse()
+    assert r.getheader("Content-type") == "application/vnd.apache.arrow.stream"
+    tbl = pa.ipc.open_stream(r.read()).read_all()
+    assert tbl.num_rows == 300000 and tbl.column("n").to_pylist()[-1] == 299999
+    r = get(conn, "/file.parquet?dk>SELECT%20*%20FROM%20plx")
+    assert r.getheader("Content-type") == "application/vnd.apache.parquet"
+    assert pq.read_table(io.BytesIO(r.body)).to_pydict() == {"a": [1, 2], "b": ["x", "y"]}
+    # text/csv is the registered name of the csv format offered
+    conn.request("POST", "/", json.dumps({"query": "dk>SELECT * FROM plx"}),
+                 {"Content-type": "application/json", "Accept": "text/csv"})
+    r = conn.getresponse()
+    assert r.getheader("Content-type") == "text/comma-separated-values"
+    assert r.read().decode().splitlines() == ["a,b", "1,x", "2,y"]
+
+
+def test_xls_download_is_a_valid_workbook(port: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(QWebServ, "xls_max_rows", 3)
+    conn = http.client.HTTPConnection("localhost", port)
+    r = get(conn, "/file.xls?dk>SELECT%20range%20AS%20n,%20'v'%20||%20range%20AS%20s%20FROM%20range(10)")
+    assert r.status == 200
+    assert r.getheader("Content-type") == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    assert int(r.getheader("Content-Length")) == len(r.body)
+    with zipfile.ZipFile(io.BytesIO(r.body)) as z:
+        sheet = z.read("xl/worksheets/sheet1.xml").decode()
+    assert sheet.count("<row ") == 4
+
+
+def test_static_assets_cached_compressed_and_revalidated(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    conn.request("GET", "/index.html", headers={"Accept-Encoding": "gzip, deflate"})
+    r = conn.getresponse()
+    body = r.read()
+    assert r.getheader("Content-Encoding") == "gzip" and r.getheader("Cache-Control") == "no-cache"
+    with open("html/index.html", "rb") as f:
+        assert gzip.decompress(body) == f.read()
+    conn.request("GET", "/index.html", headers={"If-None-Match": r.getheader("ETag")})
+    r = conn.getresponse()
+    assert r.status == 304 and r.read() == b""
+    js = next(n for n in os.listdir("html/static/js") if n.endswith(".js"))
+    r = get(conn, "/static/js/" + js)
+    assert r.status == 200 and r.getheader("Content-Encoding") is None
+    assert "immutable" in r.getheader("Cache-Control")
+    r = get(conn, "/sqleditor/no/such/page")
+    assert r.status == 200 and r.getheader("Content-type") == "text/html"
+    # HEAD gets GET's headers, negotiated the same way, and no body, leaving the connection usable
+    conn.request("HEAD", "/index.html", headers={"Accept-Encoding": "gzip"})
+    r = conn.getresponse()
+    assert r.status == 200 and r.read() == b"" and r.getheader("Content-Encoding") == "gzip"
+    assert int(r.getheader("Content-Length")) == len(body)
+    conn.request("HEAD", "/file.csv?dk>SELECT%20*%20FROM%20plx")
+    r = conn.getresponse()
+    assert r.status == 200 and r.read() == b"" and r.getheader("Content-type") == "text/comma-separated-values"
+    assert get(conn, "/index.html").status == 200
+
+
+def test_query_profiles(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    post(conn, {"query": "dk>SELECT a, b FROM plx WHERE a = 2"})
+    r = get(conn, "/api/queries?limit=5")
+    queries = json.loads(r.body)
+    assert r.status == 200 and len(queries["recent"]) <= 5
+    p = next(q for q in queries["recent"] if q["sql"] == "dk>SELECT a, b FROM plx WHERE a = 2")
+    assert p["source"] == "web" and p["lang"] == "dk" and p["rows"] == 1 and p["error"] is None
+    assert {"plan", "execute", "fetch", "encode", "send"} <= p["phases_ms"].keys()
+    assert sum(p["phases_ms"].values()) <= p["duration_ms"] + 0.01
+
+
+def test_cursor_windows_sorted_and_closed(port: int) -> None:
+    conn = http.client.HTTPConnection("localhost", port)
+    conn.request("POST", "/api/cursor", json.dumps({"query": "dk>SELECT range AS n, range % 7 AS m FROM range(5000)"}),
+                 {"Content-type": "application/json"})
+    r = conn.getresponse()
+    opened = json.loads(r.read())
+    assert r.status == 200 and opened["rows"] == 5000 and opened["columns"] == ["n", "m"]
+    path = "/api/cursor/" + opened["cursor"]
+    w = json.loads(get(conn, path + "?offset=4990&limit=20").body)
+    assert [x["n"] for x in w["tbl"]["data"]] == list(range(4990, 5000)) and w["rows"] == 5000
+    w = json.loads(get(conn, path + "?offset=1&limit=3&sort=m&desc=1").body)
+    assert [x["m"] for x in w["tbl"]["data"]] == [6, 6, 6]
+    # Only results too large to hold are 413, other failures of the query are errors of the server
+    conn.request("POST", "/api/cursor", json.dumps({"query": "py>int('x')"}), {"Content-type": "application/json"})
+    r = conn.getresponse()
+    r.read()
+    assert r.status == 500
+    assert get(conn, path + "?sort=nope").status == 400
+    assert get(conn, path + "?offset=abc").status == 400
+    assert get(conn, path + "?limit=-1").status == 400
+    conn.request("DELETE", path)
+    assert conn.getresponse().read() == b"{}"
+    assert get(conn, path).status == 404
+
+
+def test_cursor_results_read_within_bound() -> None:
+    from src.mypythondb.governor import ResultTooLarge
+    from src.mypythondb.result import read_all
+
+    batch = pa.record_batch({"n": pa.array(range(1000), pa.int64())})
+    read = []
+
+    def batches():
+        for i in range(100):
+            read.append(i)
+            yield batch
+
+    with pytest.raises(ResultTooLarge):
+        read_all(pa.RecordBatchReader.from_batches(batch.schema, batches()), 3 * batch.nbytes)
+    # Stopped at the first batch over the bound rather than reading the rest
+    assert len(read) == 4
+
+
+def test_query_pool_admission_and_timeout() -> None:
+    import threading
+    from src.mypythondb.governor import QueryTimeout, ServerBusy
+    from src.mypythondb.qwebserv import QueryPool
+
+    qp = QueryProcessor()
+    qp.limit_resources(max_execution_time=0.3, queue_size=1, queue_timeout=0.2)
+    pool = QueryPool(qp, 1)
+    release = threading.Event()
+    running = pool.submit(release.wait)
+    waiting = pool.submit(lambda: 1)
+    with pytest.raises(ServerBusy):
+        pool.submit(lambda: 2)
+    time.sleep(0.3)
+    release.set()
+    running.result()
+    # Waited longer than queue_timeout for the worker
+    with pytest.raises(ServerBusy):
+        waiting.result()
+    with pytest.raises(QueryTimeout):
+        pool.submit(lambda: qp.query_reader("dk>SELECT count(*) FROM range(100000000000)", pool.cursor).read_all()).result()
+    assert pool.submit(lambda: 3).result() == 3
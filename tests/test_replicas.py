@@ -0,0 +1,62 @@
+import time
+
+import duckdb
+import mysql.connector
+import polars as pl
+
+from src.mypythondb.queryprocessor import QueryProcessor
+from src.mypythondb.replicas import Supervisor
+
+
+def test_replicas_share_socket_database_and_snapshot(tmp_path) -> None:
+    con = duckdb.connect(str(tmp_path / "db.duckdb"))
+    con.sql("CREATE TABLE t AS SELECT range AS a FROM range(100)")
+    con.close()
+    qp = QueryProcessor()
+    qp.bind("frame", pl.DataFrame({"x": [1, 2, 3]}))
+    qp.snapshot(str(tmp_path / "snap"))
+
+    supervisor = Supervisor(0, 2, str(tmp_path / "db.duckdb"), str(tmp_path / "snap"), "dk", sqlworkers=1)
+    supervisor.check_interval = 0.2
+    supervisor.start()
+    try:
+        port = supervisor.sock.getsockname()[1]
+        deadline = time.time() + 60
+        while any(w["status"] != "up" for w in supervisor.health()):
+            assert time.time() < deadline
+            time.sleep(0.1)
+
+        for _ in range(4):
+            client = mysql.connector.connect(host="127.0.0.1", port=port, user="test")
+            cur = client.cursor()
+            cur.execute("SELECT sum(a) FROM t")
+            assert cur.fetchall()[0][0] == 4950
+            cur.execute("SELECT sum(x) FROM frame")
+            assert cur.fetchall()[0][0] == 6
+            client.close()
+        time.sleep(supervisor.heartbeat_interval * 1.5)
+        assert sum(w["queries"] for w in supervisor.health()) >= 8
+
+        # A dead worker is replaced
+        pid = supervisor.processes[0].pid
+        supervisor.processes[0].kill()
+        deadline = time.time() + 60
+        while supervisor.health()[0]["status"] != "up" or supervisor.health()[0]["pid"] == pid:
+            assert time.time() < deadline
+            time.sleep(0.1)
+        assert supervisor.health()[0]["restarts"] == 1
+        df = supervisor.to_frame()
+        assert df["worker"].to_list() == [0, 1]
+    finally:
+        supervisor.stop()
+
+
+def test_replicas_reject_data_files(tmp_path) -> None:
+    from click.testing import CliRunner
+    from src.mypythondb.console import main
+
+    duckdb.connect(str(tmp_path / "db.duckdb")).close()
+    pl.DataFrame({"x": [1]}).write_parquet(tmp_path / "x.parquet")
+    result = CliRunner().invoke(main, ["--quiet", "--replicas", "2", str(tmp_path / "db.duckdb"), str(tmp_path / "x.parquet")])
+    assert result.exit_code == 2
+    assert "--replicas serves only" in result.output and "x.parquet" in result.output
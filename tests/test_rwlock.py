@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from src.mypythondb.rwlock import RWLock
+
+
+def test_readers_share_and_writer_excludes() -> None:
+    lock = RWLock()
+    events = []
+
+    def reader(name: str) -> None:
+        with lock.read():
+            events.append(name + " in")
+            time.sleep(0.1)
+            events.append(name + " out")
+
+    def writer() -> None:
+        with lock.write():
+            events.append("w in")
+            events.append("w out")
+
+    readers = [threading.Thread(target=reader, args=(n,)) for n in ("r1", "r2")]
+    for t in readers:
+        t.start()
+    time.sleep(0.02)
+    w = threading.Thread(target=writer)
+    w.start()
+    for t in readers + [w]:
+        t.join()
+    assert set(events[:2]) == {"r1 in", "r2 in"}
+    assert events[-2:] == ["w in", "w out"]
+
+
+def test_reentrancy() -> None:
+    lock = RWLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+    with lock.read():
+        with lock.read():
+            with pytest.raises(RuntimeError):
+                with lock.write():
+                    pass
+    with lock.write():
+        pass